@@ -0,0 +1,101 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import sys
+import json
+import timeit
+import wrapt
+from threading import Lock
+
+from pc_ble_driver_py.ble_driver import NordicSemiErrorCheck, NordicSemiAPICall
+from pc_ble_driver_py import ble_driver_constants as const
+from pc_ble_driver_py import metrics
+
+CALLS = 200000
+
+
+class Target(object):
+    """Stands in for BLEDriver, the method bodies do no work."""
+    api_lock    = Lock()
+    serial_port = 'benchmark'
+
+    def plain(self, conn_handle, write_params):
+        return const.NRF_SUCCESS
+
+
+    @NordicSemiErrorCheck
+    @wrapt.synchronized(api_lock)
+    def wrapt_stacked(self, conn_handle, write_params):
+        return const.NRF_SUCCESS
+
+
+    @NordicSemiAPICall
+    def api_call(self, conn_handle, write_params):
+        return const.NRF_SUCCESS
+
+
+def measure(calls):
+    target  = Target()
+    result  = dict()
+    for name in ['plain', 'wrapt_stacked', 'api_call']:
+        method          = getattr(target, name)
+        elapsed         = min(timeit.repeat(lambda: method(0, None), number = calls, repeat = 5))
+        result[name]    = elapsed / calls * 1e6
+
+    metrics.registry.enable()
+    method                      = target.api_call
+    elapsed                     = min(timeit.repeat(lambda: method(0, None), number = calls, repeat = 5))
+    result['api_call_metrics']  = elapsed / calls * 1e6
+    metrics.registry.disable()
+    return result
+
+
+def main(output_file):
+    result = measure(CALLS)
+    print("Undecorated method:                       {:.3f} us per call".format(result['plain']))
+    print("NordicSemiErrorCheck + wrapt.synchronized: {:.3f} us per call".format(result['wrapt_stacked']))
+    print("NordicSemiAPICall:                        {:.3f} us per call".format(result['api_call']))
+    print("NordicSemiAPICall with metrics enabled:   {:.3f} us per call".format(result['api_call_metrics']))
+    if output_file:
+        with open(output_file, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+
+
+if __name__ == "__main__":
+    output_file = sys.argv[1] if len(sys.argv) == 2 else None
+    main(output_file)
+    quit()
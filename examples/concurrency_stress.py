@@ -0,0 +1,212 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import sys
+import time
+import json
+import random
+from threading import Thread
+
+from pc_ble_driver_py.ble_driver    import *
+from pc_ble_driver_py.ble_adapter   import BLEAdapter
+from pc_ble_driver_py.exceptions    import NordicSemiException
+from pc_ble_driver_py.observers     import BLEDriverObserver
+from simulated_driver               import SimulatedDriver
+
+CONNECTIONS         = 16
+THREADS_PER_CONN    = 4
+OPERATIONS          = 50
+CONN_INTERVAL_S     = 0.0075
+JOIN_TIMEOUT_S      = 60
+
+CHAR_UUID           = BLEUUID(0x2A3D)
+CHAR_VALUE_HANDLE   = 0x0010
+
+
+class SimulatedPeer(SimulatedDriver):
+    """GATT client requests are answered one connection interval later."""
+    def __init__(self, conn_interval_s):
+        super(SimulatedPeer, self).__init__()
+        self.conn_interval_s = conn_interval_s
+
+
+    def respond(self, callback, **kwargs):
+        self.post(self.conn_interval_s, callback, **kwargs)
+
+
+    @NordicSemiAPICall
+    def ble_gattc_write(self, conn_handle, write_params):
+        self.respond('on_gattc_evt_write_rsp',
+                     conn_handle    = conn_handle,
+                     status         = BLEGattStatusCode.success,
+                     error_handle   = 0,
+                     attr_handle    = write_params.handle,
+                     write_op       = write_params.write_op,
+                     offset         = write_params.offset,
+                     data           = write_params.data)
+        return const.NRF_SUCCESS
+
+
+    @NordicSemiAPICall
+    def ble_gattc_read(self, conn_handle, handle, offset):
+        # The value read back identifies the connection it was read on
+        self.respond('on_gattc_evt_read_rsp',
+                     conn_handle    = conn_handle,
+                     status         = BLEGattStatusCode.success,
+                     error_handle   = 0,
+                     attr_handle    = handle,
+                     offset         = offset,
+                     data           = [conn_handle & 0xFF, conn_handle >> 8])
+        return const.NRF_SUCCESS
+
+
+
+class ChurnObserver(BLEDriverObserver):
+    """Unregisters itself and registers a successor from within its callback."""
+    def __init__(self, stats):
+        self.stats = stats
+
+    def on_gattc_evt_write_rsp(self, ble_driver, conn_handle, **kwargs):
+        ble_driver.observer_unregister(self)
+        ble_driver.observer_register(ChurnObserver(self.stats))
+        self.stats['churned'] += 1
+
+
+
+class ReentrantObserver(BLEDriverObserver):
+    """Calls a blocking procedure from the event thread once, which must be refused."""
+    def __init__(self, adapter, stats):
+        self.adapter    = adapter
+        self.stats      = stats
+
+    def on_gattc_evt_read_rsp(self, ble_driver, conn_handle, **kwargs):
+        ble_driver.observer_unregister(self)
+        try:
+            self.adapter.read_req(conn_handle, CHAR_UUID)
+        except NordicSemiException:
+            self.stats['refused'] += 1
+
+
+
+def connect(adapter, conn_handle):
+    adapter.driver.connect(conn_handle, BLEGapRoles.central)
+    service     = BLEService(BLEUUID(0x1800), 0x0001, 0xFFFF)
+    char        = BLECharacteristic(CHAR_UUID, CHAR_VALUE_HANDLE - 1, CHAR_VALUE_HANDLE)
+    char.end_handle = CHAR_VALUE_HANDLE
+    char.descs.append(BLEDescriptor(CHAR_UUID, CHAR_VALUE_HANDLE))
+    service.chars.append(char)
+    adapter.db_conns[conn_handle].services.append(service)
+
+
+def worker(adapter, conn_handle, operations, errors):
+    try:
+        for i in range(operations):
+            adapter.write_req(conn_handle, CHAR_UUID, [i & 0xFF])
+            (status, data) = adapter.read_req(conn_handle, CHAR_UUID)
+            if data != [conn_handle & 0xFF, conn_handle >> 8]:
+                errors.append('Connection {} read {}'.format(conn_handle, data))
+    except Exception as e:
+        errors.append('Connection {}: {!r}'.format(conn_handle, e))
+
+
+def observer_churn(driver, stop):
+    observer = BLEDriverObserver()
+    while not stop:
+        driver.observer_register(observer)
+        driver.observer_unregister(observer)
+        time.sleep(random.random() * 0.001)
+
+
+def run(connections, threads_per_conn, operations, conn_interval_s):
+    driver  = SimulatedPeer(conn_interval_s)
+    adapter = BLEAdapter(driver)
+    stats   = dict(churned = 0, refused = 0)
+    errors  = list()
+    stop    = list()
+    driver.observer_register(ChurnObserver(stats))
+    driver.observer_register(ReentrantObserver(adapter, stats))
+    for conn_handle in range(connections):
+        connect(adapter, conn_handle)
+
+    threads = [Thread(target = worker, args = (adapter, conn_handle, operations, errors))
+               for conn_handle in range(connections) for i in range(threads_per_conn)]
+    churn   = Thread(target = observer_churn, args = (driver, stop))
+    t_start = time.time()
+    churn.start()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(JOIN_TIMEOUT_S)
+    elapsed = time.time() - t_start
+    stop.append(True)
+    churn.join()
+
+    hung = len([t for t in threads if t.is_alive()])
+    if not hung:
+        driver.close()
+    procedures = len(threads) * operations * 2
+    return dict(connections     = connections,
+                threads         = len(threads),
+                procedures      = procedures,
+                elapsed_s       = elapsed,
+                procedures_s    = procedures / elapsed,
+                hung_threads    = hung,
+                errors          = len(errors),
+                churned         = stats['churned'],
+                refused         = stats['refused']), errors
+
+
+def main(output_file):
+    result, errors = run(CONNECTIONS, THREADS_PER_CONN, OPERATIONS, CONN_INTERVAL_S)
+    for e in errors[:10]:
+        print(e)
+    print("{} threads on {} connections: {} procedures in {:.2f} s ({:.0f} per s)".format(
+          result['threads'], result['connections'], result['procedures'], result['elapsed_s'], result['procedures_s']))
+    print("Observers churned from callbacks: {}, blocking calls refused on event thread: {}".format(
+          result['churned'], result['refused']))
+    print("Hung threads: {}, errors: {}".format(result['hung_threads'], result['errors']))
+    if output_file:
+        with open(output_file, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+    return result['hung_threads'] == 0 and result['errors'] == 0 and result['refused'] == 1
+
+
+if __name__ == "__main__":
+    output_file = sys.argv[1] if len(sys.argv) == 2 else None
+    if not main(output_file):
+        exit(1)
+    quit()
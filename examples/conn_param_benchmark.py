@@ -0,0 +1,168 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import sys
+import json
+import time
+
+from pc_ble_driver_py.ble_driver            import *
+from pc_ble_driver_py.ble_adapter           import BLEAdapter
+from pc_ble_driver_py.conn_param_manager    import ConnParamManager
+from simulated_driver                       import SimulatedDriver
+
+CONNECTIONS     = 8
+BULK_CONNS      = 2
+BULK_HVX_RATE   = 100
+BULK_S          = 2.0
+IDLE_S          = 4.0
+SAMPLE_S        = 0.05
+
+# Model of the link, not measured values: radio time of one connection event
+# and the connection events between an update request and its instant.
+EVENT_TIME_S    = 0.0025
+UPDATE_EVENTS   = 6
+
+
+class SimulatedCentral(SimulatedDriver):
+    """Central with several connections.
+
+    Connection parameter updates take effect UPDATE_EVENTS connection events
+    after they are requested, and are reported with a connection parameter
+    update event from the event thread.
+    """
+    def __init__(self):
+        super(SimulatedCentral, self).__init__()
+        self.conn_params = dict()
+
+
+    def connect(self, conn_handle, conn_params):
+        self.conn_params[conn_handle] = conn_params
+        super(SimulatedCentral, self).connect(conn_handle, BLEGapRoles.central, conn_params)
+
+
+    @NordicSemiAPICall
+    def ble_gap_conn_param_update(self, conn_handle, conn_params):
+        interval_s = self.conn_params[conn_handle].max_conn_interval_ms / 1000.0
+        self.schedule(interval_s * UPDATE_EVENTS, self.conn_param_update, conn_handle, conn_params)
+        return const.NRF_SUCCESS
+
+
+    def conn_param_update(self, conn_handle, conn_params):
+        self.conn_params[conn_handle] = conn_params
+        self.observers_notify('on_gap_evt_conn_param_update', ble_driver = self, conn_handle = conn_handle,
+                              conn_params = conn_params)
+
+
+    def hvx(self, conn_handle):
+        self.post(0, 'on_gattc_evt_hvx', conn_handle = conn_handle, status = BLEGattStatusCode.success,
+                  error_handle = 0, attr_handle = 0x10, hvx_type = BLEGattHVXType.notification, data = [0])
+
+
+    def radio_time(self):
+        """Fraction of the radio time taken by connection events, and the interval of each connection."""
+        intervals = dict((conn_handle, conn_params.max_conn_interval_ms / 1000.0)
+                         for conn_handle, conn_params in self.conn_params.items())
+        return (sum(EVENT_TIME_S / interval_s for interval_s in intervals.values()), intervals)
+
+
+
+def sample(central, samples):
+    (radio_time, intervals) = central.radio_time()
+    samples.append((radio_time, [intervals[c] for c in range(BULK_CONNS)]))
+
+
+def run_phase(central, duration_s, hvx_rate, samples):
+    t_end   = time.time() + duration_s
+    t_next  = time.time()
+    t_hvx   = time.time()
+    while time.time() < t_end:
+        if hvx_rate and time.time() >= t_hvx:
+            for conn_handle in range(BULK_CONNS):
+                central.hvx(conn_handle)
+            t_hvx += 1.0 / hvx_rate
+        if time.time() >= t_next:
+            sample(central, samples)
+            t_next += SAMPLE_S
+        time.sleep(0.001)
+
+
+def measure(adaptive):
+    central = SimulatedCentral()
+    adapter = BLEAdapter(central)
+    if adaptive:
+        manager = ConnParamManager(adapter)
+        manager.start()
+    for conn_handle in range(CONNECTIONS):
+        central.connect(conn_handle, central.conn_params_setup())
+        char            = BLECharacteristic(BLEUUID(0x2A37), 0x000F, 0x0010)
+        char.end_handle = 0x0011
+        service         = BLEService(BLEUUID(0x180D), 0x000E, 0x0011)
+        service.chars.append(char)
+        adapter.db_conns[conn_handle].services.append(service)
+
+    bulk = list()
+    idle = list()
+    run_phase(central, BULK_S, BULK_HVX_RATE, bulk)
+    run_phase(central, IDLE_S, 0, idle)
+    if adaptive:
+        manager.stop()
+    central.close()
+
+    # Notifications wait half a connection interval on average
+    latencies   = [sum(intervals) / len(intervals) / 2 for (_, intervals) in bulk[len(bulk) // 2:]]
+    radio_idle  = [radio_time for (radio_time, _) in idle[-len(idle) // 4:]]
+    per_link    = sum(radio_idle) / len(radio_idle) / CONNECTIONS
+    return dict(adaptive            = adaptive,
+                bulk_latency_ms     = sum(latencies) / len(latencies) * 1000,
+                idle_radio_time     = sum(radio_idle) / len(radio_idle),
+                idle_links_fit      = int(1.0 / per_link))
+
+
+def main(output_file):
+    for adaptive in [False, True]:
+        result = measure(adaptive)
+        print("adaptive {:5}: bulk notification latency {:5.1f} ms, idle radio time {:5.1%}, {:4} idle links fit".format(
+              str(result['adaptive']), result['bulk_latency_ms'], result['idle_radio_time'], result['idle_links_fit']))
+        if output_file:
+            with open(output_file, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+
+
+if __name__ == "__main__":
+    output_file = sys.argv[1] if len(sys.argv) == 2 else None
+    main(output_file)
+    quit()
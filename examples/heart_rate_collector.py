@@ -46,11 +46,12 @@ TARGET_DEV_NAME = "Nordic_HRM"
 CONNECTIONS     = 1
 
 def init(conn_ic_id):
-    global BLEDriver, BLEAdvData, BLEEvtID, BLEAdapter, BLEEnableParams, BLEGapTimeoutSrc, BLEUUID
+    global BLEDriver, BLEAdvData, BLEEvtID, BLEAdapter, BLEEnableParams, BLEGapTimeoutSrc, BLEUUID, ConnectionPolicy, gatt_codecs
     from pc_ble_driver_py import config
     config.__conn_ic_id__ = conn_ic_id
     from pc_ble_driver_py.ble_driver    import BLEDriver, BLEAdvData, BLEEvtID, BLEEnableParams, BLEGapTimeoutSrc, BLEUUID
-    from pc_ble_driver_py.ble_adapter   import BLEAdapter
+    from pc_ble_driver_py.ble_adapter   import BLEAdapter, ConnectionPolicy
+    from pc_ble_driver_py               import gatt_codecs
     global nrf_sd_ble_api_ver
     nrf_sd_ble_api_ver = config.sd_api_ver_get()
 
@@ -86,12 +87,11 @@ class HRCollector(BLEDriverObserver, BLEAdapterObserver):
         self.adapter.driver.ble_gap_scan_start()
         new_conn = self.conn_q.get(timeout = 60)
 
-        if nrf_sd_ble_api_ver >= 3:
-            att_mtu = self.adapter.att_mtu_exchange(new_conn)
-
+        # The ATT MTU is exchanged by the connection policy of the adapter
         self.adapter.service_discovery(new_conn)
-        self.adapter.enable_notification(new_conn, BLEUUID(BLEUUID.Standard.battery_level))
-        self.adapter.enable_notification(new_conn, BLEUUID(BLEUUID.Standard.heart_rate))
+        for uuid in [BLEUUID(BLEUUID.Standard.battery_level), BLEUUID(BLEUUID.Standard.heart_rate)]:
+            self.adapter.subscribe(new_conn, uuid, self.on_value)
+            self.adapter.enable_notification(new_conn, uuid)
         return new_conn
 
 
@@ -129,8 +129,8 @@ class HRCollector(BLEDriverObserver, BLEAdapterObserver):
             self.adapter.connect(peer_addr)
 
 
-    def on_notification(self, ble_adapter, conn_handle, uuid, data):
-        print('Connection: {}, {} = {}'.format(conn_handle, uuid, data))
+    def on_value(self, conn_handle, uuid, data):
+        print('Connection: {}, {} = {}'.format(conn_handle, uuid, gatt_codecs.decode(uuid, data)))
 
 
     def on_att_mtu_exchanged(self, ble_driver, conn_handle, att_mtu):
@@ -144,7 +144,7 @@ class HRCollector(BLEDriverObserver, BLEAdapterObserver):
 def main(serial_port):
     print('Serial port used: {}'.format(serial_port))
     driver    = BLEDriver(serial_port=serial_port, auto_flash=True)
-    adapter   = BLEAdapter(driver)
+    adapter   = BLEAdapter(driver, conn_policy = ConnectionPolicy())
     collector = HRCollector(adapter)
     collector.open()
     for i in xrange(CONNECTIONS):
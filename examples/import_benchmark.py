@@ -0,0 +1,84 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import sys
+import json
+import subprocess
+
+RUNS = 10
+
+IMPORT_STMT = """
+import time
+t0 = time.time()
+from pc_ble_driver_py import config
+config.__conn_ic_id__ = '{}'
+import pc_ble_driver_py.ble_driver as ble_driver
+t1 = time.time()
+ble_driver.driver_load()
+t2 = time.time()
+print('{{}} {{}}'.format(t1 - t0, t2 - t1))
+"""
+
+def measure(conn_ic_id, runs):
+    imports = list()
+    loads   = list()
+    for i in range(runs):
+        # Each run uses a fresh interpreter so that nothing is cached in sys.modules
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_STMT.format(conn_ic_id)])
+        t_import, t_load = output.split()
+        imports.append(float(t_import) * 1000)
+        loads.append(float(t_load) * 1000)
+    return {'import_ms'  : sorted(imports)[len(imports) // 2],
+            'load_ms'    : sorted(loads)[len(loads) // 2]}
+
+
+def main(conn_ic_id, output_file):
+    result = measure(conn_ic_id, RUNS)
+    print("Import of pc_ble_driver_py.ble_driver: {:.1f} ms (median of {} runs)".format(result['import_ms'], RUNS))
+    print("Loading of native layer:               {:.1f} ms (median of {} runs)".format(result['load_ms'], RUNS))
+    if output_file:
+        with open(output_file, 'a') as f:
+            f.write(json.dumps(dict(result, conn_ic_id=conn_ic_id)) + '\n')
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Please specify connectivity IC identifier (NRF51, NRF52)")
+        exit(1)
+    output_file = sys.argv[2] if len(sys.argv) == 3 else None
+    main(sys.argv[1], output_file)
+    quit()
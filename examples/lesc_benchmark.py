@@ -0,0 +1,106 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import sys
+import json
+import time
+from threading import Event
+
+from pc_ble_driver_py.lesc import EccKeypair, EccKeypairPool, DhkeyWorkers
+
+PAIRINGS    = 32
+WORKERS     = 4
+
+
+def measure_inline(pairings):
+    """Key pair and DH key computed one pairing after the other, as on a single shared instance."""
+    peer        = EccKeypair()
+    t_keygen    = 0.0
+    t_start     = time.time()
+    for i in range(pairings):
+        t0          = time.time()
+        keypair     = EccKeypair()
+        t_keygen   += time.time() - t0
+        keypair.dhkey(peer.public_key)
+    elapsed = time.time() - t_start
+    return dict(mode = 'inline', keypair_ms = t_keygen / pairings * 1000, pairings_s = pairings / elapsed)
+
+
+def measure_pooled(pairings, workers):
+    peer    = EccKeypair()
+    pool    = EccKeypairPool(size = pairings)
+    dhkeys  = DhkeyWorkers(workers)
+    pool.get()
+    # Let the pool fill up, as it does between connections
+    while pool.keypairs.qsize() < pairings:
+        time.sleep(0.01)
+
+    done        = list()
+    all_done    = Event()
+    def callback(dhkey):
+        done.append(dhkey)
+        if len(done) == pairings:
+            all_done.set()
+    def errback(e):
+        print('DH key computation failed: {}'.format(e))
+
+    t_keygen    = 0.0
+    t_start     = time.time()
+    for i in range(pairings):
+        t0          = time.time()
+        keypair     = pool.get()
+        t_keygen   += time.time() - t0
+        dhkeys.submit(keypair, peer.public_key, callback, errback)
+    all_done.wait(60)
+    elapsed = time.time() - t_start
+    return dict(mode = 'pooled', keypair_ms = t_keygen / pairings * 1000, pairings_s = pairings / elapsed,
+                pool_misses = pool.misses)
+
+
+def main(output_file):
+    for result in [measure_inline(PAIRINGS), measure_pooled(PAIRINGS, WORKERS)]:
+        print("{:6}: key pair ready in {:6.2f} ms, {:6.1f} pairings/s".format(
+              result['mode'], result['keypair_ms'], result['pairings_s']))
+        if output_file:
+            with open(output_file, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+
+
+if __name__ == "__main__":
+    output_file = sys.argv[1] if len(sys.argv) == 2 else None
+    main(output_file)
+    quit()
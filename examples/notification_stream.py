@@ -0,0 +1,109 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import sys
+import time
+from threading                      import Condition, Lock
+from pc_ble_driver_py.observers     import BLEDriverObserver
+
+PACKETS     = 10000
+PACKET_SIZE = 20
+
+def init(conn_ic_id):
+    global BLEDriver, BLEAdvData, BLEUUID, BLEGattCharProps, BLEGattsCharacteristic, BLEGattsService, GattServer
+    from pc_ble_driver_py import config
+    config.__conn_ic_id__ = conn_ic_id
+    from pc_ble_driver_py.ble_driver    import BLEDriver, BLEAdvData, BLEUUID, BLEGattCharProps
+    from pc_ble_driver_py.ble_driver    import BLEGattsCharacteristic, BLEGattsService
+    from pc_ble_driver_py.gatt_server   import GattServer
+
+
+def main(serial_port):
+    print("Serial port used: {}".format(serial_port))
+    driver      = BLEDriver(serial_port=serial_port, auto_flash=True)
+    waiter      = SubscriptionWaiter()
+    driver.observer_register(waiter)
+    driver.open()
+    driver.ble_enable()
+
+    stream_char = BLEGattsCharacteristic(BLEUUID(0x2A3D),
+                                         BLEGattCharProps(notify = True),
+                                         max_len = PACKET_SIZE)
+    server      = GattServer(driver, [BLEGattsService(BLEUUID(0x180C), [stream_char])])
+    server.build()
+
+    driver.ble_gap_adv_data_set(BLEAdvData(complete_local_name='Stream'))
+    driver.ble_gap_adv_start()
+    print("Waiting for a client to enable notifications")
+    conn_handle = waiter.wait_for_subscription(server, stream_char)
+
+    t_start = time.time()
+    sent    = server.notify_stream(conn_handle, stream_char,
+                                   ([i & 0xFF] * PACKET_SIZE for i in xrange(PACKETS)))
+    elapsed = time.time() - t_start
+    print("Sent {} notifications in {:.2f} s: {:.0f} packets/s, {:.1f} kbit/s".format(
+          sent, elapsed, sent / elapsed, sent * PACKET_SIZE * 8 / elapsed / 1000))
+
+    print("Closing")
+    driver.close()
+
+
+class SubscriptionWaiter(BLEDriverObserver):
+    def __init__(self):
+        self.cond           = Condition(Lock())
+        self.conn_handle    = None
+
+    def on_gatts_evt_write(self, ble_driver, conn_handle, **kwargs):
+        with self.cond:
+            self.conn_handle = conn_handle
+            self.cond.notify_all()
+
+    def wait_for_subscription(self, server, char):
+        with self.cond:
+            while self.conn_handle is None or not server.notification_enabled(self.conn_handle, char):
+                self.cond.wait(1)
+            return self.conn_handle
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        init(sys.argv[1])
+        main(sys.argv[2])
+    else:
+        print("Usage: notification_stream.py <NRF51|NRF52> <serial port>")
+        exit(1)
+    quit()
@@ -0,0 +1,98 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import time
+import Queue
+import thread
+from threading import Thread
+
+from pc_ble_driver_py.ble_driver    import *
+
+
+class SimulatedBackend(object):
+    """Stands in for BLEDriverBackend, there is no SWIG module to call into."""
+    def __init__(self, sd_api_ver):
+        self.driver     = None
+        self.sd_api_ver = sd_api_ver
+
+
+
+class SimulatedDriver(BLEDriver):
+    """BLEDriver with the connectivity IC replaced by an event thread.
+
+    The driver state is set up by BLEDriver.state_init. Subclasses implement
+    the API calls they use and answer them with post, which dispatches an
+    event to the observers from the event thread after delay_s, the way the
+    native layer delivers SoftDevice events. Events are dispatched in the
+    order they are posted.
+    """
+    def __init__(self, sd_api_ver = 3):
+        self.state_init('simulated', SimulatedBackend(sd_api_ver))
+        self.events             = Queue.Queue()
+        self.evt_thread         = Thread(target = self.evt_loop, name = 'SimulatedEvents')
+        self.evt_thread.daemon  = True
+        self.evt_thread.start()
+
+
+    def close(self):
+        self.events.put(None)
+        self.evt_thread.join()
+
+
+    def evt_loop(self):
+        self.evt_thread_id = thread.get_ident()
+        while True:
+            item = self.events.get()
+            if item is None:
+                return
+            (t_due, func, args, kwargs) = item
+            time.sleep(max(0, t_due - time.time()))
+            func(*args, **kwargs)
+
+
+    def schedule(self, delay_s, func, *args, **kwargs):
+        """Call func from the event thread after delay_s."""
+        self.events.put((time.time() + delay_s, func, args, kwargs))
+
+
+    def post(self, delay_s, callback, **kwargs):
+        self.schedule(delay_s, self.observers_notify, callback, ble_driver = self, **kwargs)
+
+
+    def connect(self, conn_handle, role, conn_params = None):
+        """Report a new connection to the observers, from the calling thread."""
+        self.observers_notify('on_gap_evt_connected', ble_driver = self, conn_handle = conn_handle,
+                              peer_addr = None, role = role, conn_params = conn_params)
@@ -0,0 +1,247 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import sys
+import json
+import time
+
+from pc_ble_driver_py.ble_driver    import *
+from pc_ble_driver_py.gatt_server   import GattServer
+from simulated_driver               import SimulatedDriver
+
+PACKETS         = 2000
+PACKET_SIZE     = 20
+CONN_INTERVAL_S = 0.0075
+
+# Model of the link, not measured values: application TX buffers per
+# bandwidth class, the class links get when none is reserved and selected,
+# and the air time of one packet with its empty ack.
+TX_BUFFERS      = {BLEConnBw.low: 1, BLEConnBw.mid: 3, BLEConnBw.high: 6}
+DEFAULT_CONN_BW = BLEConnBw.mid
+PACKET_TIME_S   = 0.0004
+
+
+class SimulatedLink(SimulatedDriver):
+    """Peripheral with one connection.
+
+    The link is configured from the calls BLEThroughputProfile makes:
+    ble_enable reserves bandwidth, the ble_opt_* calls select it per role and
+    turn on connection event extension and data length extension, and
+    connect sets the link up from what was selected.
+
+    Each connection interval the radio sends the queued notifications.
+    Without connection event extension the event ends once the packets
+    queued at its start are sent, and they are reported in one TX complete
+    event. With it every packet is reported right away and the event goes
+    on while the application keeps the queue filled, until the next
+    interval.
+    """
+    def __init__(self):
+        super(SimulatedLink, self).__init__()
+        self.ble_enable_params  = None
+        self.conn_bws           = dict()
+        self.conn_evt_ext       = False
+        self.ext_len            = None
+        self.conn_bw            = None
+        self.tx_buffers         = None
+        self.queue              = list()
+        self.sent               = list()
+        self.running            = False
+
+
+    def start(self):
+        self.running = True
+        self.schedule(CONN_INTERVAL_S, self.conn_event, time.time() + CONN_INTERVAL_S)
+
+
+    def close(self):
+        self.running = False
+        super(SimulatedLink, self).close()
+
+
+    @NordicSemiAPICall
+    def ble_enable(self, ble_enable_params=None):
+        if not ble_enable_params:
+            ble_enable_params = self.ble_enable_params_setup()
+        assert isinstance(ble_enable_params, BLEEnableParams), 'Invalid argument type'
+        self.ble_enable_params = ble_enable_params
+        return const.NRF_SUCCESS
+
+
+    @NordicSemiAPICall
+    def ble_opt_conn_bw_set(self, role, conn_bw_tx, conn_bw_rx):
+        assert isinstance(role, BLEGapRoles),     'Invalid argument type'
+        assert isinstance(conn_bw_tx, BLEConnBw), 'Invalid argument type'
+        assert isinstance(conn_bw_rx, BLEConnBw), 'Invalid argument type'
+        self.conn_bws[role] = conn_bw_tx
+        return const.NRF_SUCCESS
+
+
+    @NordicSemiAPICall
+    def ble_opt_conn_evt_ext_set(self, enable):
+        self.conn_evt_ext = enable
+        return const.NRF_SUCCESS
+
+
+    @NordicSemiAPICall
+    def ble_opt_ext_len_set(self, rxtx_max_pdu_payload_size):
+        self.ext_len = rxtx_max_pdu_payload_size
+        return const.NRF_SUCCESS
+
+
+    def reserved(self, conn_bw):
+        conn_bw_counts = self.ble_enable_params.conn_bw_counts
+        if not conn_bw_counts:
+            return False
+        return getattr(conn_bw_counts.tx_counts, '{}_count'.format(conn_bw.name)) > 0
+
+
+    def connect(self, conn_handle, role, conn_params = None):
+        # A bandwidth only applies to links it was reserved for in ble_enable
+        conn_bw = self.conn_bws.get(role)
+        if not (conn_bw and self.reserved(conn_bw)):
+            conn_bw = DEFAULT_CONN_BW
+        self.conn_bw    = conn_bw
+        self.tx_buffers = TX_BUFFERS[conn_bw]
+        super(SimulatedLink, self).connect(conn_handle, role, conn_params)
+        if self.ext_len:
+            # The peer accepts the longest PDU offered
+            self.schedule(CONN_INTERVAL_S, self.data_length_changed, conn_handle, self.ext_len + 4)
+
+
+    def data_length_changed(self, conn_handle, octets):
+        self.data_lengths[conn_handle] = (octets, octets)
+        self.observers_notify('on_evt_data_length_changed',
+                              ble_driver    = self,
+                              conn_handle   = conn_handle,
+                              max_tx_octets = octets,
+                              max_tx_time   = (octets + 14) * 8,
+                              max_rx_octets = octets,
+                              max_rx_time   = (octets + 14) * 8)
+
+
+    @NordicSemiAPICall
+    def ble_tx_packet_count_get(self, conn_handle):
+        self.tx_packet_counts[conn_handle] = self.tx_buffers
+        return const.NRF_SUCCESS
+
+
+    @NordicSemiAPICall
+    def ble_gatts_hvx(self, conn_handle, hvx_params):
+        if len(self.queue) >= self.tx_buffers:
+            return BLE_ERROR_NO_TX_PACKETS
+        self.queue.append(hvx_params.data)
+        self.tx_in_flight_update(conn_handle, 1)
+        return const.NRF_SUCCESS
+
+
+    def tx_complete(self, count):
+        self.tx_in_flight_update(0, -count)
+        self.observers_notify('on_evt_tx_complete', ble_driver = self, conn_handle = 0, count = count)
+
+
+    def conn_event(self, t_event):
+        sent = 0
+        if self.conn_evt_ext:
+            while self.queue and time.time() + PACKET_TIME_S < t_event + CONN_INTERVAL_S:
+                time.sleep(PACKET_TIME_S)
+                self.queue.pop(0)
+                sent += 1
+                self.tx_complete(1)
+        else:
+            count = len(self.queue)
+            time.sleep(count * PACKET_TIME_S)
+            del self.queue[:count]
+            sent = count
+            if count:
+                self.tx_complete(count)
+        self.sent.append(sent)
+        if self.running:
+            t_next = t_event + CONN_INTERVAL_S
+            self.schedule(t_next - time.time(), self.conn_event, t_next)
+
+
+
+def measure(profile, packets):
+    link    = SimulatedLink()
+    params  = link.ble_enable_params_setup()
+    if profile:
+        params = profile.enable_params_setup(params)
+    link.ble_enable(params)
+    if profile:
+        profile.apply(link)
+    char    = BLEGattsCharacteristic(BLEUUID(0x2A3D), BLEGattCharProps(notify = True), max_len = PACKET_SIZE)
+    char.handles = BLEGattsCharHandles(value_handle = 0x10, user_desc_handle = 0, cccd_handle = 0x11, sccd_handle = 0)
+    server  = GattServer(link, [])
+    link.connect(0, BLEGapRoles.periph)
+    link.start()
+
+    t_start = time.time()
+    server.notify_stream(0, char, ([i & 0xFF] * PACKET_SIZE for i in xrange(packets)))
+    while link.tx_in_flight.get(0):
+        time.sleep(CONN_INTERVAL_S)
+    elapsed = time.time() - t_start
+    link.close()
+
+    events = [n for n in link.sent if n]
+    return dict(conn_bw             = link.conn_bw.name,
+                conn_evt_ext        = link.conn_evt_ext,
+                data_length         = link.data_lengths.get(0),
+                packets_per_event   = float(sum(events)) / len(events),
+                packets_s           = packets / elapsed,
+                kbit_s              = packets * PACKET_SIZE * 8 / elapsed / 1000)
+
+
+def main(output_file):
+    profiles = [None,
+                BLEThroughputProfile(BLEConnBw.low,  conn_evt_ext = False, max_pdu_payload_size = 0),
+                BLEThroughputProfile(BLEConnBw.high, conn_evt_ext = False, max_pdu_payload_size = 0),
+                BLEThroughputProfile()]
+    for profile in profiles:
+        result = measure(profile, PACKETS)
+        print("conn_bw {:4} conn_evt_ext {:5} data length {:10}: {:5.1f} packets per connection event, {:6.0f} packets/s, {:5.0f} kbit/s".format(
+              result['conn_bw'], str(result['conn_evt_ext']), str(result['data_length']),
+              result['packets_per_event'], result['packets_s'], result['kbit_s']))
+        if output_file:
+            with open(output_file, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+
+
+if __name__ == "__main__":
+    output_file = sys.argv[1] if len(sys.argv) == 2 else None
+    main(output_file)
+    quit()
@@ -34,22 +34,76 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
+import time
 import Queue
+import thread
 import logging
 import wrapt
-import pyelliptic
-from threading  import Condition, Lock
+import functools
+from threading  import Condition, Event, Lock, RLock
 from ble_driver import *
 from exceptions import NordicSemiException
+from bond_store import Bond, BondStore
+from lesc       import EccKeypair, EccKeypairPool, DhkeyWorkers
+from pairing    import PairingEngine, PairingPolicy
+import metrics
 
 from observers import *
 
 logger  = logging.getLogger(__name__)
 
+ATT_MTU_READY_TIMEOUT_S = 5
+ATT_VALUE_MAX_LEN       = 512   # Longest attribute value ATT allows
+
+
+def GattProcedureTimer(wrapped):
+    """Record the round-trip time of a GATT procedure while metrics are enabled."""
+    @wrapt.decorator
+    def wrapper(wrapped, instance, args, kwargs):
+        if not metrics.registry.enabled:
+            return wrapped(*args, **kwargs)
+
+        t_start = time.time()
+        try:
+            return wrapped(*args, **kwargs)
+        finally:
+            metrics.gatt_procedure_seconds.labels(instance.driver.serial_port,
+                                                  wrapped.__name__).observe(time.time() - t_start)
+
+    return wrapper(wrapped)
+
+
+def ConnectionSynchronized(wrapped):
+    """Run a GATT procedure under the lock of its connection.
+
+    Procedures on one connection share the EvtSync of that connection and are
+    serialized, procedures on different connections run concurrently. A
+    procedure started while the automatic ATT MTU exchange of the connection
+    is outstanding is held back until the response, as ATT allows only one
+    request at a time.
+    """
+    @wrapt.decorator
+    def wrapper(wrapped, instance, args, kwargs):
+        if instance.driver.evt_thread_id == thread.get_ident():
+            raise NordicSemiException('{} waits for events and cannot be called from an event callback'.format(
+                                      wrapped.__name__))
+        conn_handle = args[0] if args else kwargs['conn_handle']
+        with instance.conn_locks[conn_handle]:
+            if not instance.db_conns[conn_handle].att_mtu_ready.wait(ATT_MTU_READY_TIMEOUT_S):
+                logger.warning('ATT MTU exchange on connection {} timed out'.format(conn_handle))
+            return wrapped(*args, **kwargs)
+
+    return wrapper(wrapped)
+
+
 class DbConnection(object):
-    def __init__(self):
-        self.services     = list()
-        self.att_mtu      = ATT_MTU_DEFAULT
+    def __init__(self, peer_addr = None):
+        self.services           = list()
+        self.peer_addr          = peer_addr
+        self.att_mtu            = ATT_MTU_DEFAULT
+        self.att_mtu_exchanged  = False
+        self.att_mtu_ready      = Event()
+        self.att_mtu_ready.set()
 
 
     def get_char_value_handle(self, uuid):
@@ -57,7 +111,7 @@ class DbConnection(object):
 
         for s in self.services:
             for c in s.chars:
-                if (c.uuid.value == uuid.value) and (c.uuid.base.type == uuid.base.type):
+                if c.uuid == uuid:
                     for d in c.descs:
                         if d.uuid.value == uuid.value:
                             return d.handle
@@ -69,7 +123,7 @@ class DbConnection(object):
 
         for s in self.services:
             for c in s.chars:
-                if (c.uuid.value == uuid.value) and (c.uuid.base.type == uuid.base.type):
+                if c.uuid == uuid:
                     for d in c.descs:
                         if (d.uuid.value == BLEUUID.Standard.cccd):
                             return d.handle
@@ -82,7 +136,7 @@ class DbConnection(object):
 
         for s in self.services:
             for c in s.chars:
-                if (c.uuid.value == uuid.value) and (c.uuid.base.type == uuid.base.type):
+                if c.uuid == uuid:
                     return c.handle_decl
         return None
 
@@ -94,37 +148,80 @@ class DbConnection(object):
                     return c.uuid
 
 
+class ConnectionPolicy(object):
+    """Procedures BLEAdapter starts by itself on every new connection.
+
+    With att_mtu_exchange the ATT MTU exchange is requested as soon as the
+    connection is up, with att_mtu as client RX MTU (None for the value given
+    to ble_enable). With conn_params a connection parameter update is requested
+    as well, it runs in the link layer alongside GATT procedures.
+    """
+    def __init__(self, att_mtu_exchange = True, att_mtu = None, conn_params = None):
+        assert isinstance(conn_params, (BLEGapConnParams, type(None))), 'Invalid argument type'
+        self.att_mtu_exchange   = att_mtu_exchange
+        self.att_mtu            = att_mtu
+        self.conn_params        = conn_params
+
+
+
 class EvtSync(object):
     def __init__(self, events):
-        self.conds = dict()
+        self.conds  = dict()
+        self.seqs   = dict()
+        self.data   = dict()
         for evt in events:
             self.conds[evt] = Condition(Lock())
-        self.data = None
+            self.seqs[evt]  = 0
+            self.data[evt]  = None
 
 
-    def wait(self, evt, timeout = 5):
+    def snapshot(self, evt):
+        """Return the sequence number of evt, to be taken before the request is sent."""
         with self.conds[evt]:
-            self.conds[evt].wait(timeout=timeout)
-            return self.data
+            return self.seqs[evt]
+
+
+    def wait(self, evt, seq, timeout = 5):
+        # Only data notified after the snapshot seq is returned, None on timeout
+        deadline = time.time() + timeout
+        with self.conds[evt]:
+            while self.seqs[evt] == seq:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.conds[evt].wait(timeout=remaining)
+            return self.data[evt]
 
 
     def notify(self, evt, data=None):
         with self.conds[evt]:
-            self.data = data
+            self.seqs[evt] += 1
+            self.data[evt]  = data
             self.conds[evt].notify_all()
 
 
 class BLEAdapter(BLEDriverObserver):
-    observer_lock   = Lock()
-    def __init__(self, ble_driver):
+    def __init__(self, ble_driver, conn_policy = None, bond_store = None):
+        assert isinstance(conn_policy, (ConnectionPolicy, type(None))), 'Invalid argument type'
+        assert isinstance(bond_store, (BondStore, type(None))),         'Invalid argument type'
         super(BLEAdapter, self).__init__()
         self.driver             = ble_driver
         self.driver.observer_register(self)
 
+        self.conn_policy        = conn_policy
+        self.bond_store         = bond_store
         self.conn_in_progress   = False
-        self.observers          = list()
+        self.observer_lock      = Lock()
+        self.observers          = tuple()
         self.db_conns           = dict()
         self.evt_sync           = dict()
+        self.conn_locks         = dict()
+        self.subscribers        = dict()
+        self.ecc_keypairs       = dict()
+        self.keypair_pool       = EccKeypairPool()
+        self.dhkey_workers      = DhkeyWorkers()
+        self.pairing_engine     = PairingEngine(self)
+        self.known_devices      = BLEGapWhitelist()
 
 
     def open(self):
@@ -133,12 +230,17 @@ class BLEAdapter(BLEDriverObserver):
 
     def close(self):
         self.driver.close()
+        if self.bond_store is not None:
+            self.bond_store.flush()
         self.conn_in_progress   = False
         self.db_conns           = dict()
         self.evt_sync           = dict()
+        self.conn_locks         = dict()
+        self.subscribers        = dict()
 
 
-    def connect(self, address, scan_params=None, conn_params=None):
+    def connect(self, address=None, scan_params=None, conn_params=None):
+        # Without address the SoftDevice connects to the first known device it sees
         if self.conn_in_progress:
             return
         self.driver.ble_gap_connect(address     = address,
@@ -151,28 +253,96 @@ class BLEAdapter(BLEDriverObserver):
         self.driver.ble_gap_disconnect(conn_handle)
 
 
-    @wrapt.synchronized(observer_lock)
+    def known_device_add(self, address):
+        known_devices = BLEGapWhitelist(self.known_devices.addrs)
+        known_devices.add(address)
+        self.whitelist_update(known_devices)
+
+
+    def known_device_remove(self, address):
+        known_devices = BLEGapWhitelist(self.known_devices.addrs)
+        known_devices.remove(address)
+        self.whitelist_update(known_devices)
+
+
+    def whitelist_update(self, known_devices=None):
+        # The known devices only change once the SoftDevice accepted them
+        if known_devices is None:
+            known_devices = self.known_devices
+        self.driver.ble_gap_whitelist_set(known_devices)
+        self.known_devices = known_devices
+
+
+    def scan_start(self, selective=False):
+        scan_params                 = self.driver.scan_params_setup()
+        scan_params.use_whitelist   = selective
+        self.driver.ble_gap_scan_start(scan_params)
+
+
     def observer_register(self, observer):
-        self.observers.append(observer)
+        with self.observer_lock:
+            self.observers = self.observers + (observer,)
 
 
-    @wrapt.synchronized(observer_lock)
     def observer_unregister(self, observer):
-        self.observers.remove(observer)
+        with self.observer_lock:
+            observers = list(self.observers)
+            observers.remove(observer)
+            self.observers = tuple(observers)
+
+
+    def subscribe(self, conn_handle, uuid, callback):
+        """Call callback(conn_handle, uuid, data) for every notification or indication of uuid.
+
+        The value handle is resolved once from the discovered database, so
+        service_discovery has to be done first. Notifications or indications
+        still need to be enabled on the peer with enable_notification.
+        """
+        handle = self.db_conns[conn_handle].get_char_value_handle(uuid)
+        if handle == None:
+            raise NordicSemiException('Characteristic value handler not found')
 
+        key = (conn_handle, handle)
+        with self.observer_lock:
+            (_, callbacks) = self.subscribers.get(key, (uuid, tuple()))
+            self.subscribers[key] = (uuid, callbacks + (callback,))
 
+
+    def unsubscribe(self, conn_handle, uuid, callback):
+        handle = self.db_conns[conn_handle].get_char_value_handle(uuid)
+        key    = (conn_handle, handle)
+        with self.observer_lock:
+            (_, callbacks) = self.subscribers[key]
+            callbacks = list(callbacks)
+            callbacks.remove(callback)
+            if callbacks:
+                self.subscribers[key] = (uuid, tuple(callbacks))
+            else:
+                del self.subscribers[key]
+
+
+    @GattProcedureTimer
+    @ConnectionSynchronized
     def att_mtu_exchange(self, conn_handle):
+        # The client may request the exchange only once per connection
+        if self.db_conns[conn_handle].att_mtu_exchanged:
+            return self.db_conns[conn_handle].att_mtu
+        seq = self.evt_sync[conn_handle].snapshot(BLEEvtID.gattc_evt_exchange_mtu_rsp)
         self.driver.ble_gattc_exchange_mtu_req(conn_handle)
-        response = self.evt_sync[conn_handle].wait(evt = BLEEvtID.gattc_evt_exchange_mtu_rsp)
+        self.gattc_rsp_wait(conn_handle, BLEEvtID.gattc_evt_exchange_mtu_rsp, seq)
         return self.db_conns[conn_handle].att_mtu
 
 
+    @GattProcedureTimer
+    @ConnectionSynchronized
     @NordicSemiErrorCheck(expected = BLEGattStatusCode.success)
     def service_discovery(self, conn_handle, uuid=None):
+        evt_sync    = self.evt_sync[conn_handle]
+        seq         = evt_sync.snapshot(BLEEvtID.gattc_evt_prim_srvc_disc_rsp)
         self.driver.ble_gattc_prim_srvc_disc(conn_handle, uuid, 0x0001)
 
         while True:
-            response = self.evt_sync[conn_handle].wait(evt = BLEEvtID.gattc_evt_prim_srvc_disc_rsp)
+            response = self.gattc_rsp_wait(conn_handle, BLEEvtID.gattc_evt_prim_srvc_disc_rsp, seq)
 
             if response['status'] == BLEGattStatusCode.success:
                 self.db_conns[conn_handle].services.extend(response['services'])
@@ -184,14 +354,16 @@ class BLEAdapter(BLEDriverObserver):
             if response['services'][-1].end_handle == 0xFFFF:
                 break
             else:
+                seq = evt_sync.snapshot(BLEEvtID.gattc_evt_prim_srvc_disc_rsp)
                 self.driver.ble_gattc_prim_srvc_disc(conn_handle,
                                                      uuid,
                                                      response['services'][-1].end_handle + 1)
 
         for s in self.db_conns[conn_handle].services:
+            seq = evt_sync.snapshot(BLEEvtID.gattc_evt_char_disc_rsp)
             self.driver.ble_gattc_char_disc(conn_handle, s.start_handle, s.end_handle)
             while True:
-                response = self.evt_sync[conn_handle].wait(evt = BLEEvtID.gattc_evt_char_disc_rsp)
+                response = self.gattc_rsp_wait(conn_handle, BLEEvtID.gattc_evt_char_disc_rsp, seq)
 
                 if response['status'] == BLEGattStatusCode.success:
                     map(s.char_add, response['characteristics'])
@@ -200,14 +372,16 @@ class BLEAdapter(BLEDriverObserver):
                 else:
                     return response['status']
 
+                seq = evt_sync.snapshot(BLEEvtID.gattc_evt_char_disc_rsp)
                 self.driver.ble_gattc_char_disc(conn_handle,
                                                 response['characteristics'][-1].handle_decl + 1,
                                                 s.end_handle)
 
             for ch in s.chars:
+                seq = evt_sync.snapshot(BLEEvtID.gattc_evt_desc_disc_rsp)
                 self.driver.ble_gattc_desc_disc(conn_handle, ch.handle_value, ch.end_handle)
                 while True:
-                    response = self.evt_sync[conn_handle].wait(evt = BLEEvtID.gattc_evt_desc_disc_rsp)
+                    response = self.gattc_rsp_wait(conn_handle, BLEEvtID.gattc_evt_desc_disc_rsp, seq)
 
                     if response['status'] == BLEGattStatusCode.success:
                         ch.descs.extend(response['descriptions'])
@@ -219,15 +393,18 @@ class BLEAdapter(BLEDriverObserver):
                     if response['descriptions'][-1].handle == ch.end_handle:
                         break
                     else:
+                        seq = evt_sync.snapshot(BLEEvtID.gattc_evt_desc_disc_rsp)
                         self.driver.ble_gattc_desc_disc(conn_handle,
                                                         response['descriptions'][-1].handle + 1,
                                                         ch.end_handle)
         return BLEGattStatusCode.success
 
 
+    @GattProcedureTimer
+    @ConnectionSynchronized
     @NordicSemiErrorCheck(expected = BLEGattStatusCode.success)
-    def enable_notification(self, conn_handle, uuid):
-        cccd_list = [1, 0]
+    def enable_notification(self, conn_handle, uuid, indication=False):
+        cccd_list = [2, 0] if indication else [1, 0]
 
         handle = self.db_conns[conn_handle].get_cccd_handle(uuid)
         if handle == None:
@@ -239,11 +416,14 @@ class BLEAdapter(BLEDriverObserver):
                                            cccd_list,
                                            0)
 
+        seq = self.evt_sync[conn_handle].snapshot(BLEEvtID.gattc_evt_write_rsp)
         self.driver.ble_gattc_write(conn_handle, write_params)
-        result = self.evt_sync[conn_handle].wait(evt = BLEEvtID.gattc_evt_write_rsp)
+        result = self.gattc_rsp_wait(conn_handle, BLEEvtID.gattc_evt_write_rsp, seq)
         return result['status']
 
 
+    @GattProcedureTimer
+    @ConnectionSynchronized
     @NordicSemiErrorCheck(expected = BLEGattStatusCode.success)
     def disable_notification(self, conn_handle, uuid):
         cccd_list = [0, 0]
@@ -258,8 +438,9 @@ class BLEAdapter(BLEDriverObserver):
                                            cccd_list,
                                            0)
 
+        seq = self.evt_sync[conn_handle].snapshot(BLEEvtID.gattc_evt_write_rsp)
         self.driver.ble_gattc_write(conn_handle, write_params)
-        result = self.evt_sync[conn_handle].wait(evt = BLEEvtID.gattc_evt_write_rsp)
+        result = self.gattc_rsp_wait(conn_handle, BLEEvtID.gattc_evt_write_rsp, seq)
         return result['status']
 
 
@@ -267,145 +448,208 @@ class BLEAdapter(BLEDriverObserver):
         self.driver.ble_gap_conn_param_update(conn_handle, conn_params)
 
 
+    @GattProcedureTimer
+    @ConnectionSynchronized
     @NordicSemiErrorCheck(expected = BLEGattStatusCode.success)
     def write_req(self, conn_handle, uuid, data):
         handle = self.db_conns[conn_handle].get_char_value_handle(uuid)
         if handle == None:
             raise NordicSemiException('Characteristic value handler not found')
+
+        # Values that do not fit in one Write Request are sent as a long write
+        att_mtu = self.db_conns[conn_handle].att_mtu
+        if len(data) > att_mtu - 3:
+            return self.write_long(conn_handle, handle, data, att_mtu)
+
         write_params = BLEGattcWriteParams(BLEGattWriteOperation.write_req,
                                            BLEGattExecWriteFlag.unused,
                                            handle,
                                            data,
                                            0)
+        seq = self.evt_sync[conn_handle].snapshot(BLEEvtID.gattc_evt_write_rsp)
         self.driver.ble_gattc_write(conn_handle, write_params)
-        result = self.evt_sync[conn_handle].wait(evt = BLEEvtID.gattc_evt_write_rsp)
+        result = self.gattc_rsp_wait(conn_handle, BLEEvtID.gattc_evt_write_rsp, seq)
         return result['status']
 
+
+    def gattc_rsp_wait(self, conn_handle, evt, seq):
+        result = self.evt_sync[conn_handle].wait(evt = evt, seq = seq)
+        if result is None:
+            raise NordicSemiException('Timeout waiting for {} on connection {}'.format(evt.name, conn_handle))
+        return result
+
+
+    def write_long(self, conn_handle, handle, data, att_mtu):
+        if len(data) > ATT_VALUE_MAX_LEN:
+            raise NordicSemiException('Value of {} bytes exceeds the ATT maximum'.format(len(data)))
+
+        # Prepare Write Request carries handle and offset besides the opcode
+        chunk_len = att_mtu - 5
+        for offset in range(0, len(data), chunk_len):
+            write_params = BLEGattcWriteParams(BLEGattWriteOperation.prepare_write_req,
+                                               BLEGattExecWriteFlag.unused,
+                                               handle,
+                                               data[offset:offset + chunk_len],
+                                               offset)
+            seq = self.evt_sync[conn_handle].snapshot(BLEEvtID.gattc_evt_write_rsp)
+            self.driver.ble_gattc_write(conn_handle, write_params)
+            result = self.gattc_rsp_wait(conn_handle, BLEEvtID.gattc_evt_write_rsp, seq)
+            if result['status'] != BLEGattStatusCode.success:
+                flags = BLEGattExecWriteFlag.prepared_cancel
+                break
+        else:
+            flags = BLEGattExecWriteFlag.prepared_write
+
+        write_params = BLEGattcWriteParams(BLEGattWriteOperation.execute_write_req,
+                                           flags,
+                                           handle,
+                                           [],
+                                           0)
+        seq = self.evt_sync[conn_handle].snapshot(BLEEvtID.gattc_evt_write_rsp)
+        self.driver.ble_gattc_write(conn_handle, write_params)
+        response = self.gattc_rsp_wait(conn_handle, BLEEvtID.gattc_evt_write_rsp, seq)
+        if flags == BLEGattExecWriteFlag.prepared_cancel:
+            return result['status']
+        return response['status']
+
+
+    @GattProcedureTimer
+    @ConnectionSynchronized
     def read_req(self, conn_handle, uuid):
         handle = self.db_conns[conn_handle].get_char_value_handle(uuid)
         if handle == None:
             raise NordicSemiException('Characteristic value handler not found')
+        seq = self.evt_sync[conn_handle].snapshot(BLEEvtID.gattc_evt_read_rsp)
         self.driver.ble_gattc_read(conn_handle, handle,0)
-        result = self.evt_sync[conn_handle].wait(evt = BLEEvtID.gattc_evt_read_rsp)
+        result = self.gattc_rsp_wait(conn_handle, BLEEvtID.gattc_evt_read_rsp, seq)
         gatt_res = result['status']
-        if gatt_res == BLEGattStatusCode.success:
-             return (gatt_res, result['data'])
-        else:
+        if gatt_res != BLEGattStatusCode.success:
              return (gatt_res, None)
- 	
+
+        # A full Read Response may be the start of a long value, the rest is
+        # read with Read Blob Requests until a shorter or failed response
+        data     = list(result['data'])
+        att_mtu  = self.db_conns[conn_handle].att_mtu
+        while len(result['data']) == att_mtu - 1 and len(data) < ATT_VALUE_MAX_LEN:
+            seq = self.evt_sync[conn_handle].snapshot(BLEEvtID.gattc_evt_read_rsp)
+            self.driver.ble_gattc_read(conn_handle, handle, len(data))
+            result = self.gattc_rsp_wait(conn_handle, BLEEvtID.gattc_evt_read_rsp, seq)
+            if result['status'] != BLEGattStatusCode.success:
+                break
+            data.extend(result['data'])
+        return (gatt_res, data[:ATT_VALUE_MAX_LEN])
+
+
+    @GattProcedureTimer
+    @ConnectionSynchronized
     def write_cmd(self, conn_handle, uuid, data):
         handle = self.db_conns[conn_handle].get_char_value_handle(uuid)
         if handle == None:
             raise NordicSemiException('Characteristic value handler not found')
-        write_params = BLEGattcWriteParams(BLEGattWriteOperation.write_cmd,
-                                           BLEGattExecWriteFlag.unused,
-                                           handle,
-                                           data,
-                                           0)
-        self.driver.ble_gattc_write(conn_handle, write_params)
-        self.evt_sync[conn_handle].wait(evt = BLEEvtID.evt_tx_complete)
+
+        # Write Command has no long variant, data is split over several commands
+        chunk_len = self.db_conns[conn_handle].att_mtu - 3
+        for offset in range(0, max(len(data), 1), chunk_len):
+            write_params = BLEGattcWriteParams(BLEGattWriteOperation.write_cmd,
+                                               BLEGattExecWriteFlag.unused,
+                                               handle,
+                                               data[offset:offset + chunk_len],
+                                               0)
+            seq = self.evt_sync[conn_handle].snapshot(BLEEvtID.evt_tx_complete)
+            self.driver.ble_gattc_write(conn_handle, write_params)
+            self.gattc_rsp_wait(conn_handle, BLEEvtID.evt_tx_complete, seq)
 
     def ecc_create_keys(self, curve='prime256v1'):
-        self.ecc = pyelliptic.ECC(curve=curve)
-        pk_hex = self.ecc.get_pubkey(_format='hex')
-        pk_str = pk_hex.decode('hex')
-        pk_list = map(ord, pk_str)[1:]
-        pk_x = pk_list[0:32]
-        pk_y = pk_list[32:64]
-        return pk_x[::-1] + pk_y[::-1]
+        self.ecc = EccKeypair(curve)
+        return self.ecc.public_key
 
     def ecc_get_dhkey(self, peer_pk):
-        peer_pk_x = peer_pk[0:32]
-        peer_pk_y = peer_pk[32:64]
-        peer_pk = peer_pk_x[::-1] + peer_pk_y[::-1]
-        peer_pk_str = b'04' + ''.join('{:02x}'.format(x) for x in peer_pk)
-        dhkey = self.ecc.get_ecdh_key(peer_pk_str, format='hex')
-        return map(ord, dhkey)[::-1]
+        return self.ecc.dhkey(peer_pk)
+
+
+    def dhkey_reply(self, conn_handle, dhkey):
+        self.driver.ble_gap_lesc_dhkey_reply(conn_handle, BLEGapLESCdhkey(key = dhkey))
+
+
+    def dhkey_failed(self, conn_handle, e):
+        # A DH key that cannot match lets the pairing fail right away
+        logger.error('DH key computation for connection {} failed: {}'.format(conn_handle, e))
+        self.dhkey_reply(conn_handle, [0] * 32)
+
+
+    @ConnectionSynchronized
+    def encrypt(self, conn_handle):
+        """Encrypt the link with the LTK stored for a bonded peer.
+
+        Returns False if the peer is not bonded, or did not accept the key, in
+        which case the bond is removed and the peer has to be paired again.
+        """
+        pairing = self.pairing_engine.encrypt(conn_handle)
+        if pairing is None:
+            return False
+        return pairing.wait() == BLEGapSecStatus.success
 
 
+    def bond_save(self, conn_handle):
+        keys = self.driver.sec_keys.pop(conn_handle, None)
+        if (self.bond_store is not None) and keys and keys.peer_enc_key:
+            self.bond_store.add(Bond(self.db_conns[conn_handle].peer_addr, keys))
+
+
+    @ConnectionSynchronized
     @NordicSemiErrorCheck(expected = BLEGapSecStatus.success)
-    def authenticate(self, conn_handle):
-        kdist_own   = BLEGapSecKDist(enc  = False,
-                                     id   = False,
-                                     sign = False,
-                                     link = False)
-        kdist_peer  = BLEGapSecKDist(enc  = False,
-                                     id   = False,
-                                     sign = False,
-                                     link = False)
-        sec_params  = BLEGapSecParams(bond          = False,
-                                      mitm          = False,
-                                      lesc          = False,
-                                      keypress      = False,
-                                      io_caps       = BLEGapIOCaps.none,
-                                      oob           = False,
-                                      min_key_size  = 7,
-                                      max_key_size  = 16,
-                                      kdist_own     = kdist_own,
-                                      kdist_peer    = kdist_peer)
-
-        self.driver.ble_gap_authenticate(conn_handle, sec_params)
-        self.evt_sync[conn_handle].wait(evt = BLEEvtID.gap_evt_sec_params_request)
-
-        self.driver.ble_gap_sec_params_reply(conn_handle, BLEGapSecStatus.success, None, None, None)
-        result = self.evt_sync[conn_handle].wait(evt = BLEEvtID.gap_evt_auth_status)
-        return result['auth_status']
+    def authenticate(self, conn_handle, bond=False):
+        # A bonded peer only gets the link encrypted, without pairing again
+        policy = PairingPolicy(lesc = False, bond = bond)
+        return self.pairing_engine.pair(conn_handle, policy).wait()
 
 
+    @ConnectionSynchronized
     @NordicSemiErrorCheck(expected = BLEGapSecStatus.success)
-    def authenticate_lesc(self, conn_handle, mitm=False, bond=False):
-        kdist_own   = BLEGapSecKDist(enc  = False,
-                                     id   = False,
-                                     sign = False,
-                                     link = False)
-        kdist_peer  = BLEGapSecKDist(enc  = False,
-                                     id   = False,
-                                     sign = False,
-                                     link = False)
-        sec_params  = BLEGapSecParams(bond          = bond,
-                                      mitm          = mitm,
-                                      lesc          = True,
-                                      keypress      = False,
-                                      io_caps       = BLEGapIOCaps.yesno if mitm else BLEGapIOCaps.none,
-                                      oob           = False,
-                                      min_key_size  = 7,
-                                      max_key_size  = 16,
-                                      kdist_own     = kdist_own,
-                                      kdist_peer    = kdist_peer)
-
-        self.driver.ble_gap_authenticate(conn_handle, sec_params)
-        result = self.evt_sync[conn_handle].wait(evt = BLEEvtID.gap_evt_sec_params_request)
-        print result['peer_params']
-
-        #Get public key
-        pub_key = BLEGapLESCp256pk(pk = self.ecc_create_keys())
-        self.driver.ble_gap_sec_params_reply(conn_handle, BLEGapSecStatus.success, None, pub_key, None)
-        result = self.evt_sync[conn_handle].wait(evt = BLEEvtID.gap_evt_lesc_dhkey_request)
-        #Get shared secret
-        dhkey = BLEGapLESCdhkey(key = self.ecc_get_dhkey(result['p_pk_peer'].pk))
-
-        if mitm:
-            result = self.evt_sync[conn_handle].wait(evt = BLEEvtID.gap_evt_passkey_display)
-            response = raw_input('PASSKEY: ' + ''.join([str(x-48) for x in result['passkey']]) + '\ny/n: ')
-            if response == 'y':
-                self.driver.ble_gap_auth_key_reply(conn_handle, 1, None)
-            else:
-                self.driver.ble_gap_auth_key_reply(conn_handle, 0, None)
+    def authenticate_lesc(self, conn_handle, mitm=False, bond=False, confirm=None):
+        """Pair with LE Secure Connections.
 
-        self.driver.ble_gap_lesc_dhkey_reply(conn_handle, dhkey)
-        result = self.evt_sync[conn_handle].wait(evt = BLEEvtID.gap_evt_auth_status)
-        return result['auth_status']
+        With mitm the passkeys are compared by confirm(pairing), which returns
+        True if pairing.passkey matches the one shown by the peer.
+        """
+        policy = PairingPolicy(lesc = True, mitm = mitm, bond = bond)
+        return self.pairing_engine.pair(conn_handle, policy, confirm = confirm).wait()
 
 
     def on_gap_evt_connected(self, ble_driver, conn_handle, peer_addr, role, conn_params):
-        self.db_conns[conn_handle]  = DbConnection()
-        self.evt_sync[conn_handle]  = EvtSync(events = BLEEvtID)
-        self.conn_in_progress       = False
+        self.db_conns[conn_handle]      = DbConnection(peer_addr)
+        self.evt_sync[conn_handle]      = EvtSync(events = BLEEvtID)
+        self.conn_locks[conn_handle]    = RLock()
+        self.conn_in_progress           = False
+
+        policy = self.conn_policy
+        if policy is None:
+            return
+
+        # Only non-blocking calls here, this runs on the event thread
+        if policy.att_mtu_exchange and ble_driver.backend.sd_api_ver >= 3:
+            self.db_conns[conn_handle].att_mtu_ready.clear()
+            try:
+                ble_driver.ble_gattc_exchange_mtu_req(conn_handle, policy.att_mtu)
+            except NordicSemiException as e:
+                logger.error('ATT MTU exchange on connection {} failed: {}'.format(conn_handle, e))
+                self.db_conns[conn_handle].att_mtu_ready.set()
+
+        if policy.conn_params:
+            try:
+                ble_driver.ble_gap_conn_param_update(conn_handle, policy.conn_params)
+            except NordicSemiException as e:
+                logger.error('Connection parameter update on connection {} failed: {}'.format(conn_handle, e))
 
 
     def on_gap_evt_disconnected(self, ble_driver, conn_handle, reason):
         del self.db_conns[conn_handle]
         del self.evt_sync[conn_handle]
+        del self.conn_locks[conn_handle]
+        self.ecc_keypairs.pop(conn_handle, None)
+        with self.observer_lock:
+            for key in [k for k in self.subscribers if k[0] == conn_handle]:
+                del self.subscribers[key]
 
 
     def on_gap_evt_timeout(self, ble_driver, conn_handle, src):
@@ -417,6 +661,12 @@ class BLEAdapter(BLEDriverObserver):
         self.evt_sync[conn_handle].notify(evt = BLEEvtID.gap_evt_sec_params_request, data = kwargs)
 
     def on_gap_evt_lesc_dhkey_request(self, ble_driver, conn_handle, **kwargs):
+        keypair = self.ecc_keypairs.get(conn_handle)
+        if keypair:
+            self.dhkey_workers.submit(keypair,
+                                      kwargs['p_pk_peer'].pk,
+                                      functools.partial(self.dhkey_reply, conn_handle),
+                                      functools.partial(self.dhkey_failed, conn_handle))
         self.evt_sync[conn_handle].notify(evt = BLEEvtID.gap_evt_lesc_dhkey_request, data = kwargs)
 
     def on_gap_evt_passkey_display(self, ble_driver, conn_handle, **kwargs):
@@ -453,10 +703,11 @@ class BLEAdapter(BLEDriverObserver):
 
 
     def on_gattc_evt_exchange_mtu_rsp(self, ble_driver, conn_handle, **kwargs):
+        self.db_conns[conn_handle].att_mtu_exchanged = True
+        self.db_conns[conn_handle].att_mtu_ready.set()
         self.evt_sync[conn_handle].notify(evt = BLEEvtID.gattc_evt_exchange_mtu_rsp, data = kwargs)
     
 
-    @wrapt.synchronized(observer_lock)
     def on_gap_evt_conn_param_update_request(self, ble_driver, conn_handle, conn_params):
         for obs in self.observers:
             obs.on_conn_param_update_request(ble_adapter = self,
@@ -464,13 +715,21 @@ class BLEAdapter(BLEDriverObserver):
                                              conn_params = conn_params)
 
 
-    @wrapt.synchronized(observer_lock)
     def on_gattc_evt_hvx(self, ble_driver, conn_handle, status, error_handle, attr_handle, hvx_type, data):
         if status != BLEGattStatusCode.success:
             logger.error("Error. Handle value notification failed. Status {}.".format(status))
             return
 
-        if hvx_type == BLEGattHVXType.notification:
+        if hvx_type == BLEGattHVXType.indication:
+            self.driver.ble_gattc_hv_confirm(conn_handle, attr_handle)
+
+        subscription = self.subscribers.get((conn_handle, attr_handle))
+        if subscription is not None:
+            (uuid, callbacks) = subscription
+            for callback in callbacks:
+                callback(conn_handle, uuid, data)
+
+        if self.observers and hvx_type == BLEGattHVXType.notification:
             uuid = self.db_conns[conn_handle].get_char_uuid(attr_handle)
             if uuid == None:
                 raise NordicSemiException('UUID not found')
@@ -35,14 +35,17 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 import re
+import thread
 import time
 import wrapt
 import logging
 import functools
+import inspect
 import traceback
 import subprocess
 import pprint
 from enum       import Enum
+from operator   import itemgetter
 from types      import NoneType
 from threading  import Lock
 
@@ -55,16 +58,15 @@ import importlib
 
 from observers import *
 
-logging.basicConfig(filename='logger.txt', level=logging.DEBUG)
 logger  = logging.getLogger(__name__)
 
-driver = None
-
 import config
-nrf_sd_ble_api_ver = config.sd_api_ver_get()
-# Load pc_ble_driver
-SWIG_MODULE_NAME = "pc_ble_driver_sd_api_v{}".format(nrf_sd_ble_api_ver)
-SHLIB_NAME = "pc_ble_driver_shared_sd_api_v{}".format(nrf_sd_ble_api_ver)
+import ble_driver_constants as const
+import ble_driver_types as util
+from exceptions import NordicSemiException
+from tracing    import tracer, TRACE_EVT, TRACE_HVX, TRACE_API, CONN_HANDLE_INVALID
+import metrics
+import profiling
 
 if getattr(sys, 'frozen', False):
     # we are running in a bundle
@@ -93,65 +95,246 @@ elif sys.platform.startswith('dar'):
     # OS X uses a single library for both archs
     shlib_arch = ""
 
-shlib_file = '{}{}{}'.format(shlib_prefix, SHLIB_NAME, shlib_postfix)
 shlib_dir = os.path.join(os.path.abspath(this_dir), 'lib', shlib_plat, shlib_arch)
-shlib_path = os.path.join(shlib_dir, shlib_file)
 
-if not os.path.exists(shlib_path):
-    raise RuntimeError('Failed to locate the pc_ble_driver shared library: {}.'.format(shlib_path))
 
-try:
-    _shlib = ctypes.cdll.LoadLibrary(shlib_path)
-except Exception as error:
-    raise RuntimeError("Could not load shared library {} : '{}'.".format(shlib_path, error))
+class BLEDriverBackend(object):
+    """pc_ble_driver shared library and SWIG module for one SoftDevice API version."""
+    def __init__(self, sd_api_ver):
+        SWIG_MODULE_NAME    = "pc_ble_driver_sd_api_v{}".format(sd_api_ver)
+        SHLIB_NAME          = "pc_ble_driver_shared_sd_api_v{}".format(sd_api_ver)
 
-logger.info('Shared library: {}'.format(shlib_path))
-logger.info('Swig module name: {}'.format(SWIG_MODULE_NAME))
+        shlib_file = '{}{}{}'.format(shlib_prefix, SHLIB_NAME, shlib_postfix)
+        shlib_path = os.path.join(shlib_dir, shlib_file)
 
-sys.path.append(shlib_dir)
-driver = importlib.import_module(SWIG_MODULE_NAME)
+        if not os.path.exists(shlib_path):
+            raise RuntimeError('Failed to locate the pc_ble_driver shared library: {}.'.format(shlib_path))
 
-import ble_driver_types as util
-from exceptions import NordicSemiException
+        try:
+            self.shlib = ctypes.cdll.LoadLibrary(shlib_path)
+        except Exception as error:
+            raise RuntimeError("Could not load shared library {} : '{}'.".format(shlib_path, error))
+
+        logger.info('Shared library: {}'.format(shlib_path))
+        logger.info('Swig module name: {}'.format(SWIG_MODULE_NAME))
+
+        if shlib_dir not in sys.path:
+            sys.path.append(shlib_dir)
+        # SWIG modules register their types in a runtime table shared through
+        # sys.modules. The API versions define structs with equal names but
+        # different layouts, so every module gets a table of its own.
+        sys.modules.pop(SWIG_RUNTIME_MODULE, None)
+        self.driver     = importlib.import_module(SWIG_MODULE_NAME)
+        self.sd_api_ver = sd_api_ver
+
+        if sd_api_ver >= 3:
+            # SWIG does not wrap ble_gap_addr_t pointer arrays, this one is called through ctypes
+            whitelist_set           = self.shlib.sd_ble_gap_whitelist_set
+            whitelist_set.argtypes  = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_void_p), ctypes.c_uint8]
+            whitelist_set.restype   = ctypes.c_uint32
 
-ATT_MTU_DEFAULT                 = driver.GATT_MTU_SIZE_DEFAULT
 
-def NordicSemiErrorCheck(wrapped=None, expected = driver.NRF_SUCCESS):
+SWIG_RUNTIME_MODULE = 'swig_runtime_data4'
+backends            = dict()
+_backends_lock      = Lock()
+
+
+def driver_load(conn_ic_id=None):
+    """Return the backend for a connectivity IC, loading it on first use.
+
+    conn_ic_id defaults to config.__conn_ic_id__.
+    """
+    sd_api_ver = config.sd_api_ver_get(conn_ic_id)
+    with _backends_lock:
+        if sd_api_ver not in backends:
+            backends[sd_api_ver] = BLEDriverBackend(sd_api_ver)
+        return backends[sd_api_ver]
+
+
+ATT_MTU_DEFAULT                 = const.GATT_MTU_SIZE_DEFAULT
+BLE_ERROR_NO_TX_PACKETS         = 0x3004    # Not exported by the SWIG modules
+SERIAL_PORTS_MAX                = 64
+SERIAL_PORT_CACHE_TTL_S         = 2.0
+
+def NordicSemiErrorCheck(wrapped=None, expected = const.NRF_SUCCESS):
     if wrapped is None:
         return functools.partial(NordicSemiErrorCheck, expected=expected)
 
+    conn_handle_index = profiling.arg_index(wrapped, 'conn_handle')
+
     @wrapt.decorator
     def wrapper(wrapped, instance, args, kwargs):
-        err_code = wrapped(*args, **kwargs)
-        if err_code != expected:
-            raise NordicSemiException('Failed to {}. Error code: {}'.format(wrapped.__name__, err_code))
+        if profiling.hooks:
+            if conn_handle_index is not None and conn_handle_index < len(args):
+                conn_handle = args[conn_handle_index]
+            else:
+                conn_handle = kwargs.get('conn_handle')
+            err_code = profiling.call_profiled(profiling.hooks, profiling.PROFILE_API, wrapped.__name__,
+                                               conn_handle, wrapped, args, kwargs)
+        else:
+            err_code = wrapped(*args, **kwargs)
+        err_code_check(wrapped.__name__, err_code, expected)
 
     return wrapper(wrapped)
 
 
+def err_code_check(name, err_code, expected):
+    if tracer.enabled:
+        # BLEAdapter procedures return a BLEGattStatusCode, or None when they timed out
+        if err_code is None:
+            record_id = 0xFFFF
+        else:
+            record_id = getattr(err_code, 'value', err_code) & 0xFFFF
+        tracer.record(TRACE_API, CONN_HANDLE_INVALID, record_id, name)
+    if err_code != expected:
+        raise NordicSemiException('Failed to {}. Error code: {}'.format(name, err_code))
+
+
+API_CALL_TEMPLATE = """
+def {name}({params}):
+    if _profiling.hooks or _metrics.registry.enabled or _tracer.enabled:
+        return _api_call_instrumented({args})
+    with {instance}.api_lock:
+        err_code = _func({args})
+    if err_code != _expected:
+        raise _NordicSemiException('Failed to {name}. Error code: {{}}'.format(err_code))
+"""
+
+def NordicSemiAPICall(wrapped=None, expected = const.NRF_SUCCESS):
+    """Same as NordicSemiErrorCheck over holding the api_lock of the instance, for BLEDriver API methods.
+
+    The method is replaced by a function generated with the same signature,
+    which takes the lock and checks the error code inline. Tracing, metrics
+    and profiling hooks are handled on a separate path that is only taken
+    while one of them is active.
+    """
+    if wrapped is None:
+        return functools.partial(NordicSemiAPICall, expected=expected)
+
+    func                = wrapped
+    name                = func.__name__
+    spec                = inspect.getargspec(func)
+    conn_handle_index   = profiling.arg_index(func, 'conn_handle')
+
+    def call_locked(self, *args, **kwargs):
+        if not metrics.registry.enabled:
+            with self.api_lock:
+                return func(self, *args, **kwargs)
+
+        t_wait = time.time()
+        with self.api_lock:
+            t_hold = time.time()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                t_done = time.time()
+                metrics.api_lock_wait_seconds.labels(self.serial_port, name).observe(t_hold - t_wait)
+                metrics.api_lock_hold_seconds.labels(self.serial_port, name).observe(t_done - t_hold)
+
+
+    def api_call_instrumented(self, *args, **kwargs):
+        if profiling.hooks:
+            if conn_handle_index is not None and conn_handle_index < len(args):
+                conn_handle = args[conn_handle_index]
+            else:
+                conn_handle = kwargs.get('conn_handle')
+            err_code = profiling.call_profiled(profiling.hooks, profiling.PROFILE_API, name,
+                                               conn_handle, call_locked, (self,) + args, kwargs)
+        else:
+            err_code = call_locked(self, *args, **kwargs)
+        err_code_check(name, err_code, expected)
+
+
+    namespace = dict(_profiling             = profiling,
+                     _metrics               = metrics,
+                     _tracer                = tracer,
+                     _func                  = func,
+                     _expected              = expected,
+                     _NordicSemiException   = NordicSemiException,
+                     _api_call_instrumented = api_call_instrumented)
+    params = list(spec.args)
+    if spec.varargs:
+        params.append('*' + spec.varargs)
+    if spec.keywords:
+        params.append('**' + spec.keywords)
+    assert spec.args, 'NordicSemiAPICall is for methods only'
+    assert not set(spec.args) & set(namespace), 'Argument name reserved by NordicSemiAPICall'
+
+    source = API_CALL_TEMPLATE.format(name      = name,
+                                      instance  = spec.args[0],
+                                      params    = ', '.join(params),
+                                      args      = ', '.join(params))
+    exec compile(source, '<NordicSemiAPICall {}>'.format(name), 'exec') in namespace
+    api_call                = namespace[name]
+    api_call.func_defaults  = func.func_defaults
+    return functools.wraps(func)(api_call)
+
+
 
 class BLEEvtID(Enum):
-    gap_evt_connected                 = driver.BLE_GAP_EVT_CONNECTED
-    gap_evt_disconnected              = driver.BLE_GAP_EVT_DISCONNECTED
-    gap_evt_lesc_dhkey_request        = driver.BLE_GAP_EVT_LESC_DHKEY_REQUEST
-    gap_evt_sec_params_request        = driver.BLE_GAP_EVT_SEC_PARAMS_REQUEST
-    gap_evt_adv_report                = driver.BLE_GAP_EVT_ADV_REPORT
-    gap_evt_timeout                   = driver.BLE_GAP_EVT_TIMEOUT
-    gap_evt_conn_param_update_request = driver.BLE_GAP_EVT_CONN_PARAM_UPDATE_REQUEST
-    gap_evt_conn_param_update         = driver.BLE_GAP_EVT_CONN_PARAM_UPDATE
-    gap_evt_auth_status               = driver.BLE_GAP_EVT_AUTH_STATUS
-    gap_evt_passkey_display           = driver.BLE_GAP_EVT_PASSKEY_DISPLAY
-    gap_evt_conn_sec_update           = driver.BLE_GAP_EVT_CONN_SEC_UPDATE
-    evt_tx_complete                   = driver.BLE_EVT_TX_COMPLETE
-    gattc_evt_write_rsp               = driver.BLE_GATTC_EVT_WRITE_RSP
-    gattc_evt_read_rsp                = driver.BLE_GATTC_EVT_READ_RSP
-    gattc_evt_hvx                     = driver.BLE_GATTC_EVT_HVX
-    gattc_evt_prim_srvc_disc_rsp      = driver.BLE_GATTC_EVT_PRIM_SRVC_DISC_RSP
-    gattc_evt_char_disc_rsp           = driver.BLE_GATTC_EVT_CHAR_DISC_RSP
-    gattc_evt_desc_disc_rsp           = driver.BLE_GATTC_EVT_DESC_DISC_RSP
-    if nrf_sd_ble_api_ver >= 3:
-        gatts_evt_exchange_mtu_request    = driver.BLE_GATTS_EVT_EXCHANGE_MTU_REQUEST
-        gattc_evt_exchange_mtu_rsp        = driver.BLE_GATTC_EVT_EXCHANGE_MTU_RSP
+    gap_evt_connected                 = const.BLE_GAP_EVT_CONNECTED
+    gap_evt_disconnected              = const.BLE_GAP_EVT_DISCONNECTED
+    gap_evt_lesc_dhkey_request        = const.BLE_GAP_EVT_LESC_DHKEY_REQUEST
+    gap_evt_sec_params_request        = const.BLE_GAP_EVT_SEC_PARAMS_REQUEST
+    gap_evt_adv_report                = const.BLE_GAP_EVT_ADV_REPORT
+    gap_evt_timeout                   = const.BLE_GAP_EVT_TIMEOUT
+    gap_evt_conn_param_update_request = const.BLE_GAP_EVT_CONN_PARAM_UPDATE_REQUEST
+    gap_evt_conn_param_update         = const.BLE_GAP_EVT_CONN_PARAM_UPDATE
+    gap_evt_auth_status               = const.BLE_GAP_EVT_AUTH_STATUS
+    gap_evt_passkey_display           = const.BLE_GAP_EVT_PASSKEY_DISPLAY
+    gap_evt_conn_sec_update           = const.BLE_GAP_EVT_CONN_SEC_UPDATE
+    evt_tx_complete                   = const.BLE_EVT_TX_COMPLETE
+    evt_data_length_changed           = const.BLE_EVT_DATA_LENGTH_CHANGED         # API v3 only
+    gattc_evt_write_rsp               = const.BLE_GATTC_EVT_WRITE_RSP
+    gattc_evt_read_rsp                = const.BLE_GATTC_EVT_READ_RSP
+    gattc_evt_hvx                     = const.BLE_GATTC_EVT_HVX
+    gattc_evt_prim_srvc_disc_rsp      = const.BLE_GATTC_EVT_PRIM_SRVC_DISC_RSP
+    gattc_evt_char_disc_rsp           = const.BLE_GATTC_EVT_CHAR_DISC_RSP
+    gattc_evt_desc_disc_rsp           = const.BLE_GATTC_EVT_DESC_DISC_RSP
+    gatts_evt_write                   = const.BLE_GATTS_EVT_WRITE
+    gatts_evt_sys_attr_missing        = const.BLE_GATTS_EVT_SYS_ATTR_MISSING
+    gatts_evt_hvc                     = const.BLE_GATTS_EVT_HVC
+    gatts_evt_exchange_mtu_request    = const.BLE_GATTS_EVT_EXCHANGE_MTU_REQUEST  # API v3 only
+    gattc_evt_exchange_mtu_rsp        = const.BLE_GATTC_EVT_EXCHANGE_MTU_RSP      # API v3 only
+
+
+class BLEConnBw(Enum):
+    low     = const.BLE_CONN_BW_LOW
+    mid     = const.BLE_CONN_BW_MID
+    high    = const.BLE_CONN_BW_HIGH
+
+
+
+class BLEConnBwCount(object):
+    def __init__(self, high_count = 0, mid_count = 0, low_count = 0):
+        self.high_count = high_count
+        self.mid_count  = mid_count
+        self.low_count  = low_count
+
+
+    def to_c(self, backend):
+        conn_bw_count               = backend.driver.ble_conn_bw_count_t()
+        conn_bw_count.high_count    = self.high_count
+        conn_bw_count.mid_count     = self.mid_count
+        conn_bw_count.low_count     = self.low_count
+        return conn_bw_count
+
+
+
+class BLEConnBwCounts(object):
+    def __init__(self, tx_counts, rx_counts):
+        assert isinstance(tx_counts, BLEConnBwCount), 'Invalid argument type'
+        assert isinstance(rx_counts, BLEConnBwCount), 'Invalid argument type'
+        self.tx_counts  = tx_counts
+        self.rx_counts  = rx_counts
+
+
+    def to_c(self, backend):
+        conn_bw_counts              = backend.driver.ble_conn_bw_counts_t()
+        conn_bw_counts.tx_counts    = self.tx_counts.to_c(backend)
+        conn_bw_counts.rx_counts    = self.rx_counts.to_c(backend)
+        return conn_bw_counts
+
 
 
 class BLEEnableParams(object):
@@ -161,84 +344,123 @@ class BLEEnableParams(object):
                  periph_conn_count,
                  central_conn_count,
                  central_sec_count,
-                 attr_tab_size = driver.BLE_GATTS_ATTR_TAB_SIZE_DEFAULT,
-                 att_mtu = ATT_MTU_DEFAULT):
+                 attr_tab_size = const.BLE_GATTS_ATTR_TAB_SIZE_DEFAULT,
+                 att_mtu = ATT_MTU_DEFAULT,
+                 conn_bw_counts = None):
+        assert isinstance(conn_bw_counts, (BLEConnBwCounts, NoneType)), 'Invalid argument type'
         self.vs_uuid_count      = vs_uuid_count
         self.attr_tab_size      = attr_tab_size
         self.service_changed    = service_changed
         self.periph_conn_count  = periph_conn_count
         self.central_conn_count = central_conn_count
         self.central_sec_count  = central_sec_count
-        if nrf_sd_ble_api_ver >= 3:
-            self.att_mtu = att_mtu
+        self.att_mtu            = att_mtu
+        self.conn_bw_counts     = conn_bw_counts
 
 
-    def to_c(self):
-        ble_enable_params                                       = driver.ble_enable_params_t()
-        ble_enable_params.common_enable_params.p_conn_bw_counts = None
+    def to_c(self, backend):
+        self.__conn_bw_counts   = self.conn_bw_counts.to_c(backend) if self.conn_bw_counts else None
+        ble_enable_params                                       = backend.driver.ble_enable_params_t()
+        ble_enable_params.common_enable_params.p_conn_bw_counts = self.__conn_bw_counts
         ble_enable_params.common_enable_params.vs_uuid_count    = self.vs_uuid_count
         ble_enable_params.gatts_enable_params.attr_tab_size     = self.attr_tab_size
         ble_enable_params.gatts_enable_params.service_changed   = self.service_changed
         ble_enable_params.gap_enable_params.periph_conn_count   = self.periph_conn_count
         ble_enable_params.gap_enable_params.central_conn_count  = self.central_conn_count
         ble_enable_params.gap_enable_params.central_sec_count   = self.central_sec_count
-        if nrf_sd_ble_api_ver >= 3:
+        if backend.sd_api_ver >= 3:
             ble_enable_params.gatt_enable_params.att_mtu        = self.att_mtu
 
         return ble_enable_params
 
 
 
+class BLEThroughputProfile(object):
+    """Link configuration for high throughput.
+
+    enable_params_setup reserves conn_bw buffers for every connection in the
+    BLEEnableParams given to ble_enable. apply, called after ble_enable and
+    before connecting, selects that bandwidth for new links and on SoftDevice
+    API v3 enables connection event extension and data length extension up
+    to max_pdu_payload_size. Data lengths negotiated per connection are kept
+    in BLEDriver.data_lengths.
+    """
+    def __init__(self, conn_bw = BLEConnBw.high, conn_evt_ext = True, max_pdu_payload_size = 251):
+        assert isinstance(conn_bw, BLEConnBw), 'Invalid argument type'
+        self.conn_bw                = conn_bw
+        self.conn_evt_ext           = conn_evt_ext
+        self.max_pdu_payload_size   = max_pdu_payload_size
+
+
+    def enable_params_setup(self, ble_enable_params):
+        conn_count                          = ble_enable_params.periph_conn_count + ble_enable_params.central_conn_count
+        count                               = BLEConnBwCount(**{'{}_count'.format(self.conn_bw.name): conn_count})
+        ble_enable_params.conn_bw_counts    = BLEConnBwCounts(tx_counts = count, rx_counts = count)
+        return ble_enable_params
+
+
+    def apply(self, ble_driver):
+        if ble_driver.ble_enable_params.periph_conn_count:
+            ble_driver.ble_opt_conn_bw_set(BLEGapRoles.periph, self.conn_bw, self.conn_bw)
+        if ble_driver.ble_enable_params.central_conn_count:
+            ble_driver.ble_opt_conn_bw_set(BLEGapRoles.central, self.conn_bw, self.conn_bw)
+        if ble_driver.backend.sd_api_ver >= 3:
+            ble_driver.ble_opt_conn_evt_ext_set(self.conn_evt_ext)
+            if self.max_pdu_payload_size:
+                ble_driver.ble_opt_ext_len_set(self.max_pdu_payload_size)
+
+
+
 class BLEGapAdvType(Enum):
-    connectable_undirected      = driver.BLE_GAP_ADV_TYPE_ADV_IND
-    connectable_directed        = driver.BLE_GAP_ADV_TYPE_ADV_DIRECT_IND
-    scanable_undirected         = driver.BLE_GAP_ADV_TYPE_ADV_SCAN_IND
-    non_connectable_undirected  = driver.BLE_GAP_ADV_TYPE_ADV_NONCONN_IND
+    connectable_undirected      = const.BLE_GAP_ADV_TYPE_ADV_IND
+    connectable_directed        = const.BLE_GAP_ADV_TYPE_ADV_DIRECT_IND
+    scanable_undirected         = const.BLE_GAP_ADV_TYPE_ADV_SCAN_IND
+    non_connectable_undirected  = const.BLE_GAP_ADV_TYPE_ADV_NONCONN_IND
 
 
 
 class BLEGapRoles(Enum):
-    invalid = driver.BLE_GAP_ROLE_INVALID
-    periph  = driver.BLE_GAP_ROLE_PERIPH
-    central = driver.BLE_GAP_ROLE_CENTRAL
+    invalid = const.BLE_GAP_ROLE_INVALID
+    periph  = const.BLE_GAP_ROLE_PERIPH
+    central = const.BLE_GAP_ROLE_CENTRAL
 
 
 
 class BLEGapTimeoutSrc(Enum):
-    advertising     = driver.BLE_GAP_TIMEOUT_SRC_ADVERTISING
-    security_req    = driver.BLE_GAP_TIMEOUT_SRC_SECURITY_REQUEST
-    scan            = driver.BLE_GAP_TIMEOUT_SRC_SCAN
-    conn            = driver.BLE_GAP_TIMEOUT_SRC_CONN
+    advertising     = const.BLE_GAP_TIMEOUT_SRC_ADVERTISING
+    security_req    = const.BLE_GAP_TIMEOUT_SRC_SECURITY_REQUEST
+    scan            = const.BLE_GAP_TIMEOUT_SRC_SCAN
+    conn            = const.BLE_GAP_TIMEOUT_SRC_CONN
 
 
 
 class BLEGapIOCaps(Enum):
-    display_only        = driver.BLE_GAP_IO_CAPS_DISPLAY_ONLY
-    yesno               = driver.BLE_GAP_IO_CAPS_DISPLAY_YESNO
-    keyboard_only       = driver.BLE_GAP_IO_CAPS_KEYBOARD_ONLY
-    none                = driver.BLE_GAP_IO_CAPS_NONE
-    keyboard_display    = driver.BLE_GAP_IO_CAPS_KEYBOARD_DISPLAY
+    display_only        = const.BLE_GAP_IO_CAPS_DISPLAY_ONLY
+    yesno               = const.BLE_GAP_IO_CAPS_DISPLAY_YESNO
+    keyboard_only       = const.BLE_GAP_IO_CAPS_KEYBOARD_ONLY
+    none                = const.BLE_GAP_IO_CAPS_NONE
+    keyboard_display    = const.BLE_GAP_IO_CAPS_KEYBOARD_DISPLAY
 
 
 
 class BLEGapSecStatus(Enum):
-    success                 = driver.BLE_GAP_SEC_STATUS_SUCCESS
-    timeout                 = driver.BLE_GAP_SEC_STATUS_TIMEOUT
-    pdu_invalid             = driver.BLE_GAP_SEC_STATUS_PDU_INVALID
-    passkey_entry_failed    = driver.BLE_GAP_SEC_STATUS_PASSKEY_ENTRY_FAILED
-    oob_not_available       = driver.BLE_GAP_SEC_STATUS_OOB_NOT_AVAILABLE
-    auth_req                = driver.BLE_GAP_SEC_STATUS_AUTH_REQ
-    confirm_value           = driver.BLE_GAP_SEC_STATUS_CONFIRM_VALUE
-    pairing_not_supp        = driver.BLE_GAP_SEC_STATUS_PAIRING_NOT_SUPP
-    enc_key_size            = driver.BLE_GAP_SEC_STATUS_ENC_KEY_SIZE
-    smp_cmd_unsupported     = driver.BLE_GAP_SEC_STATUS_SMP_CMD_UNSUPPORTED
-    unspecified             = driver.BLE_GAP_SEC_STATUS_UNSPECIFIED
-    repeated_attempts       = driver.BLE_GAP_SEC_STATUS_REPEATED_ATTEMPTS
-    invalid_params          = driver.BLE_GAP_SEC_STATUS_INVALID_PARAMS
-    dhkey_failure           = driver.BLE_GAP_SEC_STATUS_DHKEY_FAILURE
-    num_comp_failure        = driver.BLE_GAP_SEC_STATUS_NUM_COMP_FAILURE
-    br_edr_in_prog          = driver.BLE_GAP_SEC_STATUS_BR_EDR_IN_PROG
-    x_trans_key_disallowed  = driver.BLE_GAP_SEC_STATUS_X_TRANS_KEY_DISALLOWED
+    success                 = const.BLE_GAP_SEC_STATUS_SUCCESS
+    timeout                 = const.BLE_GAP_SEC_STATUS_TIMEOUT
+    pdu_invalid             = const.BLE_GAP_SEC_STATUS_PDU_INVALID
+    passkey_entry_failed    = const.BLE_GAP_SEC_STATUS_PASSKEY_ENTRY_FAILED
+    oob_not_available       = const.BLE_GAP_SEC_STATUS_OOB_NOT_AVAILABLE
+    auth_req                = const.BLE_GAP_SEC_STATUS_AUTH_REQ
+    confirm_value           = const.BLE_GAP_SEC_STATUS_CONFIRM_VALUE
+    pairing_not_supp        = const.BLE_GAP_SEC_STATUS_PAIRING_NOT_SUPP
+    enc_key_size            = const.BLE_GAP_SEC_STATUS_ENC_KEY_SIZE
+    smp_cmd_unsupported     = const.BLE_GAP_SEC_STATUS_SMP_CMD_UNSUPPORTED
+    unspecified             = const.BLE_GAP_SEC_STATUS_UNSPECIFIED
+    repeated_attempts       = const.BLE_GAP_SEC_STATUS_REPEATED_ATTEMPTS
+    invalid_params          = const.BLE_GAP_SEC_STATUS_INVALID_PARAMS
+    dhkey_failure           = const.BLE_GAP_SEC_STATUS_DHKEY_FAILURE
+    num_comp_failure        = const.BLE_GAP_SEC_STATUS_NUM_COMP_FAILURE
+    br_edr_in_prog          = const.BLE_GAP_SEC_STATUS_BR_EDR_IN_PROG
+    x_trans_key_disallowed  = const.BLE_GAP_SEC_STATUS_X_TRANS_KEY_DISALLOWED
 
 
 
@@ -248,11 +470,11 @@ class BLEGapAdvParams(object):
         self.timeout_s      = timeout_s
 
 
-    def to_c(self):
-        adv_params              = driver.ble_gap_adv_params_t()
+    def to_c(self, backend):
+        adv_params              = backend.driver.ble_gap_adv_params_t()
         adv_params.type         = BLEGapAdvType.connectable_undirected.value
         adv_params.p_peer_addr  = None  # Undirected advertisement.
-        adv_params.fp           = driver.BLE_GAP_ADV_FP_ANY
+        adv_params.fp           = const.BLE_GAP_ADV_FP_ANY
         adv_params.p_whitelist  = None
         adv_params.interval     = util.msec_to_units(self.interval_ms,
                                                                 util.UNIT_0_625_MS)
@@ -263,17 +485,28 @@ class BLEGapAdvParams(object):
 
 
 class BLEGapScanParams(object):
-    def __init__(self, interval_ms, window_ms, timeout_s):
+    def __init__(self, interval_ms, window_ms, timeout_s, use_whitelist=False, active=True):
         self.interval_ms    = interval_ms
         self.window_ms      = window_ms
         self.timeout_s      = timeout_s
+        self.use_whitelist  = use_whitelist
+        self.active         = active
 
 
-    def to_c(self):
-        scan_params             = driver.ble_gap_scan_params_t()
-        scan_params.active      = True
-        scan_params.selective   = False
-        scan_params.p_whitelist = None
+    def to_c(self, backend, whitelist=None):
+        scan_params             = backend.driver.ble_gap_scan_params_t()
+        scan_params.active      = self.active
+        if backend.sd_api_ver >= 3:
+            # Whitelist is configured with sd_ble_gap_whitelist_set on API v3
+            scan_params.use_whitelist   = self.use_whitelist
+            scan_params.adv_dir_report  = False
+        else:
+            scan_params.selective   = self.use_whitelist
+            scan_params.p_whitelist = None
+            if self.use_whitelist:
+                assert isinstance(whitelist, BLEGapWhitelist), 'Invalid argument type'
+                self.__whitelist        = whitelist.to_c(backend)
+                scan_params.p_whitelist = self.__whitelist
         scan_params.interval    = util.msec_to_units(self.interval_ms,
                                                                 util.UNIT_0_625_MS)
         scan_params.window      = util.msec_to_units(self.window_ms,
@@ -284,12 +517,36 @@ class BLEGapScanParams(object):
 
 
 
-class BLEGapConnParams(object):
-    def __init__(self, min_conn_interval_ms, max_conn_interval_ms, conn_sup_timeout_ms, slave_latency):
-        self.min_conn_interval_ms   = min_conn_interval_ms
-        self.max_conn_interval_ms   = max_conn_interval_ms
-        self.conn_sup_timeout_ms    = conn_sup_timeout_ms
-        self.slave_latency          = slave_latency
+class ValueTuple(tuple):
+    """Immutable value object. Equal only to values of the same class, not to plain tuples."""
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return (type(other) is type(self)) and tuple.__eq__(self, other)
+
+
+    def __ne__(self, other):
+        return not self == other
+
+
+    __hash__ = tuple.__hash__
+
+
+
+class BLEGapConnParams(ValueTuple):
+    __slots__ = ()
+
+    def __new__(cls, min_conn_interval_ms, max_conn_interval_ms, conn_sup_timeout_ms, slave_latency):
+        return tuple.__new__(cls, (min_conn_interval_ms,
+                                   max_conn_interval_ms,
+                                   conn_sup_timeout_ms,
+                                   slave_latency))
+
+
+    min_conn_interval_ms    = property(itemgetter(0))
+    max_conn_interval_ms    = property(itemgetter(1))
+    conn_sup_timeout_ms     = property(itemgetter(2))
+    slave_latency           = property(itemgetter(3))
 
 
     @classmethod
@@ -303,8 +560,8 @@ class BLEGapConnParams(object):
                    slave_latency        = conn_params.slave_latency)
 
 
-    def to_c(self):
-        conn_params                    = driver.ble_gap_conn_params_t()
+    def to_c(self, backend):
+        conn_params                    = backend.driver.ble_gap_conn_params_t()
         conn_params.min_conn_interval  = util.msec_to_units(self.min_conn_interval_ms,
                                                             util.UNIT_1_25_MS)
         conn_params.max_conn_interval  = util.msec_to_units(self.max_conn_interval_ms,
@@ -316,37 +573,105 @@ class BLEGapConnParams(object):
 
 
 
-class BLEGapAddr(object):
+class BLEGapAddr(ValueTuple):
     class Types(Enum):
-        public                          = driver.BLE_GAP_ADDR_TYPE_PUBLIC
-        random_static                   = driver.BLE_GAP_ADDR_TYPE_RANDOM_STATIC
-        random_private_resolvable       = driver.BLE_GAP_ADDR_TYPE_RANDOM_PRIVATE_RESOLVABLE
-        random_private_non_resolvable   = driver.BLE_GAP_ADDR_TYPE_RANDOM_PRIVATE_NON_RESOLVABLE
+        public                          = const.BLE_GAP_ADDR_TYPE_PUBLIC
+        random_static                   = const.BLE_GAP_ADDR_TYPE_RANDOM_STATIC
+        random_private_resolvable       = const.BLE_GAP_ADDR_TYPE_RANDOM_PRIVATE_RESOLVABLE
+        random_private_non_resolvable   = const.BLE_GAP_ADDR_TYPE_RANDOM_PRIVATE_NON_RESOLVABLE
+
 
+    __slots__ = ()
 
-    def __init__(self, addr_type, addr):
+    def __new__(cls, addr_type, addr):
         assert isinstance(addr_type, BLEGapAddr.Types), 'Invalid argument type'
-        self.addr_type  = addr_type
-        self.addr       = addr
+        return tuple.__new__(cls, (addr_type, bytes(bytearray(addr))))
+
+
+    addr_type   = property(itemgetter(0))
+    addr_bytes  = property(itemgetter(1))
+
+
+    @property
+    def addr(self):
+        return list(bytearray(self[1]))
+
+
+    def __str__(self):
+        return '{}:{}'.format(self[0].name, ':'.join('{:02X}'.format(b) for b in bytearray(self[1])))
 
 
     @classmethod
     def from_c(cls, addr):
-        addr_list = util.uint8_array_to_list(addr.addr, driver.BLE_GAP_ADDR_LEN)
+        addr_list = util.uint8_array_to_list(addr.addr, const.BLE_GAP_ADDR_LEN)
         addr_list.reverse()
         return cls(addr_type    = BLEGapAddr.Types(addr.addr_type),
                    addr         = addr_list)
 
 
-    def to_c(self):
-        addr_array      = util.list_to_uint8_array(self.addr[::-1])
-        addr            = driver.ble_gap_addr_t()
+    def to_c(self, backend):
+        addr_array      = util.list_to_uint8_array(backend.driver, list(bytearray(self[1]))[::-1])
+        addr            = backend.driver.ble_gap_addr_t()
         addr.addr_type  = self.addr_type.value
         addr.addr       = addr_array.cast()
         return addr
 
 
 
+class BLEGapWhitelistLayout(ctypes.Structure):
+    """Layout of ble_gap_whitelist_t in SoftDevice API v2, for the member SWIG cannot set."""
+    _fields_ = [('pp_addrs',    ctypes.POINTER(ctypes.c_void_p)),
+                ('addr_count',  ctypes.c_uint8),
+                ('pp_irks',     ctypes.POINTER(ctypes.c_void_p)),
+                ('irk_count',   ctypes.c_uint8)]
+
+
+
+class BLEGapWhitelist(object):
+    def __init__(self, addrs=None):
+        self.addrs = list()
+        for addr in (addrs or list()):
+            self.add(addr)
+
+
+    def __len__(self):
+        return len(self.addrs)
+
+
+    def __contains__(self, addr):
+        return addr in self.addrs
+
+
+    def add(self, addr):
+        assert isinstance(addr, BLEGapAddr), 'Invalid argument type'
+        if addr in self:
+            return
+        if len(self.addrs) >= const.BLE_GAP_WHITELIST_ADDR_MAX_COUNT:
+            raise NordicSemiException('Whitelist is full. Max count: {}'.format(const.BLE_GAP_WHITELIST_ADDR_MAX_COUNT))
+        self.addrs.append(addr)
+
+
+    def remove(self, addr):
+        self.addrs = [a for a in self.addrs if a != addr]
+
+
+    def to_c(self, backend):
+        # SWIG does not wrap ble_gap_addr_t pointer arrays, so the table is built with ctypes
+        self.__c_addrs  = [addr.to_c(backend) for addr in self.addrs]
+        self.__pp_addrs = util.list_to_pointer_array(self.__c_addrs)
+        if backend.sd_api_ver >= 3:
+            return self.__pp_addrs
+
+        whitelist           = backend.driver.ble_gap_whitelist_t()
+        layout              = ctypes.cast(int(whitelist.this), ctypes.POINTER(BLEGapWhitelistLayout)).contents
+        layout.pp_addrs     = self.__pp_addrs
+        layout.addr_count   = len(self.__c_addrs)
+        layout.pp_irks      = None
+        layout.irk_count    = 0
+        return whitelist
+
+
+
 class BLEGapSecKDist(object):
     def __init__(self, enc, id, sign, link):
         self.enc    = enc
@@ -363,8 +688,8 @@ class BLEGapSecKDist(object):
                    link = kdist.sign)
 
 
-    def to_c(self):
-        kdist       = driver.ble_gap_sec_kdist_t()
+    def to_c(self, backend):
+        kdist       = backend.driver.ble_gap_sec_kdist_t()
         kdist.enc   = self.enc
         kdist.id    = self.id
         kdist.sign  = self.sign
@@ -380,9 +705,9 @@ class BLEGapLESCp256pk(object):
     def from_c(cls, params):
         return cls(pk = util.uint8_array_to_list(params.pk, 64))
 
-    def to_c(self):
-        params = driver.ble_gap_lesc_p256_pk_t()
-        self.pk_array = util.list_to_uint8_array(self.pk)
+    def to_c(self, backend):
+        params = backend.driver.ble_gap_lesc_p256_pk_t()
+        self.pk_array = util.list_to_uint8_array(backend.driver, self.pk)
         params.pk = self.pk_array.cast()
         return params
 
@@ -394,13 +719,98 @@ class BLEGapLESCdhkey(object):
     def from_c(cls, params):
         return cls(key = util.uint8_array_to_list(params.key, 32))
 
-    def to_c(self):
-        params = driver.ble_gap_lesc_dhkey_t()
-        self.key_array = util.list_to_uint8_array(self.key)
+    def to_c(self, backend):
+        params = backend.driver.ble_gap_lesc_dhkey_t()
+        self.key_array = util.list_to_uint8_array(backend.driver, self.key)
         params.key = self.key_array.cast()
         return params
 
 
+class BLEGapEncKey(object):
+    def __init__(self, ltk, lesc, auth, ediv, rand):
+        self.ltk    = ltk
+        self.lesc   = lesc
+        self.auth   = auth
+        self.ediv   = ediv
+        self.rand   = rand
+
+
+    @classmethod
+    def from_c(cls, enc_key):
+        return cls(ltk  = util.uint8_array_to_list(enc_key.enc_info.ltk, enc_key.enc_info.ltk_len),
+                   lesc = bool(enc_key.enc_info.lesc),
+                   auth = bool(enc_key.enc_info.auth),
+                   ediv = enc_key.master_id.ediv,
+                   rand = util.uint8_array_to_list(enc_key.master_id.rand, const.BLE_GAP_SEC_RAND_LEN))
+
+
+    def enc_info_to_c(self, backend):
+        self.__ltk_array    = util.list_to_uint8_array(backend.driver, self.ltk)
+        enc_info            = backend.driver.ble_gap_enc_info_t()
+        enc_info.ltk        = self.__ltk_array.cast()
+        enc_info.ltk_len    = len(self.ltk)
+        enc_info.lesc       = self.lesc
+        enc_info.auth       = self.auth
+        return enc_info
+
+
+    def master_id_to_c(self, backend):
+        self.__rand_array   = util.list_to_uint8_array(backend.driver, self.rand)
+        master_id           = backend.driver.ble_gap_master_id_t()
+        master_id.ediv      = self.ediv
+        master_id.rand      = self.__rand_array.cast()
+        return master_id
+
+
+
+class BLEGapIdKey(object):
+    def __init__(self, irk, id_addr):
+        assert isinstance(id_addr, BLEGapAddr), 'Invalid argument type'
+        self.irk        = irk
+        self.id_addr    = id_addr
+
+
+    @classmethod
+    def from_c(cls, id_key):
+        return cls(irk      = util.uint8_array_to_list(id_key.id_info.irk, const.BLE_GAP_SEC_KEY_LEN),
+                   id_addr  = BLEGapAddr.from_c(id_key.id_addr_info))
+
+
+
+class BLEGapSecKeyset(object):
+    """Keys exchanged during bonding, None for keys that were not distributed."""
+    def __init__(self, own_enc_key, peer_enc_key, peer_id_key):
+        self.own_enc_key    = own_enc_key
+        self.peer_enc_key   = peer_enc_key
+        self.peer_id_key    = peer_id_key
+
+
+
+class BLEGapConnSec(ValueTuple):
+    __slots__ = ()
+
+    def __new__(cls, sec_mode, sec_level, encr_key_size):
+        return tuple.__new__(cls, (sec_mode, sec_level, encr_key_size))
+
+
+    sec_mode        = property(itemgetter(0))
+    sec_level       = property(itemgetter(1))
+    encr_key_size   = property(itemgetter(2))
+
+
+    @property
+    def encrypted(self):
+        return self.sec_mode == 1 and self.sec_level >= 2
+
+
+    @classmethod
+    def from_c(cls, conn_sec):
+        return cls(sec_mode         = conn_sec.sec_mode.sm,
+                   sec_level        = conn_sec.sec_mode.lv,
+                   encr_key_size    = conn_sec.encr_key_size)
+
+
+
 class BLEGapSecParams(object):
     def __init__(self,
                  bond,
@@ -442,8 +852,8 @@ class BLEGapSecParams(object):
                    kdist_peer   = BLEGapSecKDist.from_c(params.kdist_peer))
 
 
-    def to_c(self):
-        params              = driver.ble_gap_sec_params_t()
+    def to_c(self, backend):
+        params              = backend.driver.ble_gap_sec_params_t()
         params.bond         = self.bond
         params.mitm         = self.mitm
         params.lesc         = self.lesc
@@ -452,8 +862,8 @@ class BLEGapSecParams(object):
         params.oob          = self.oob
         params.max_key_size = self.max_key_size
         params.min_key_size = self.min_key_size
-        params.kdist_own    = self.kdist_own.to_c()
-        params.kdist_peer   = self.kdist_peer.to_c()
+        params.kdist_own    = self.kdist_own.to_c(backend)
+        params.kdist_peer   = self.kdist_peer.to_c(backend)
         return params
 
     def __str__(self):
@@ -465,40 +875,42 @@ class BLEGapSecParams(object):
 
 class BLEAdvData(object):
     class Types(Enum):
-        flags                               = driver.BLE_GAP_AD_TYPE_FLAGS
-        service_16bit_uuid_more_available   = driver.BLE_GAP_AD_TYPE_16BIT_SERVICE_UUID_MORE_AVAILABLE
-        service_16bit_uuid_complete         = driver.BLE_GAP_AD_TYPE_16BIT_SERVICE_UUID_COMPLETE
-        service_32bit_uuid_more_available   = driver.BLE_GAP_AD_TYPE_32BIT_SERVICE_UUID_MORE_AVAILABLE
-        service_32bit_uuid_complete         = driver.BLE_GAP_AD_TYPE_32BIT_SERVICE_UUID_COMPLETE
-        service_128bit_uuid_more_available  = driver.BLE_GAP_AD_TYPE_128BIT_SERVICE_UUID_MORE_AVAILABLE
-        service_128bit_uuid_complete        = driver.BLE_GAP_AD_TYPE_128BIT_SERVICE_UUID_COMPLETE
-        short_local_name                    = driver.BLE_GAP_AD_TYPE_SHORT_LOCAL_NAME
-        complete_local_name                 = driver.BLE_GAP_AD_TYPE_COMPLETE_LOCAL_NAME
-        tx_power_level                      = driver.BLE_GAP_AD_TYPE_TX_POWER_LEVEL
-        class_of_device                     = driver.BLE_GAP_AD_TYPE_CLASS_OF_DEVICE
-        simple_pairing_hash_c               = driver.BLE_GAP_AD_TYPE_SIMPLE_PAIRING_HASH_C
-        simple_pairing_randimizer_r         = driver.BLE_GAP_AD_TYPE_SIMPLE_PAIRING_RANDOMIZER_R
-        security_manager_tk_value           = driver.BLE_GAP_AD_TYPE_SECURITY_MANAGER_TK_VALUE
-        security_manager_oob_flags          = driver.BLE_GAP_AD_TYPE_SECURITY_MANAGER_OOB_FLAGS
-        slave_connection_interval_range     = driver.BLE_GAP_AD_TYPE_SLAVE_CONNECTION_INTERVAL_RANGE
-        solicited_sevice_uuids_16bit        = driver.BLE_GAP_AD_TYPE_SOLICITED_SERVICE_UUIDS_16BIT
-        solicited_sevice_uuids_128bit       = driver.BLE_GAP_AD_TYPE_SOLICITED_SERVICE_UUIDS_128BIT
-        service_data                        = driver.BLE_GAP_AD_TYPE_SERVICE_DATA
-        public_target_address               = driver.BLE_GAP_AD_TYPE_PUBLIC_TARGET_ADDRESS
-        random_target_address               = driver.BLE_GAP_AD_TYPE_RANDOM_TARGET_ADDRESS
-        appearance                          = driver.BLE_GAP_AD_TYPE_APPEARANCE
-        advertising_interval                = driver.BLE_GAP_AD_TYPE_ADVERTISING_INTERVAL
-        le_bluetooth_device_address         = driver.BLE_GAP_AD_TYPE_LE_BLUETOOTH_DEVICE_ADDRESS
-        le_role                             = driver.BLE_GAP_AD_TYPE_LE_ROLE
-        simple_pairng_hash_c256             = driver.BLE_GAP_AD_TYPE_SIMPLE_PAIRING_HASH_C256
-        simple_pairng_randomizer_r256       = driver.BLE_GAP_AD_TYPE_SIMPLE_PAIRING_RANDOMIZER_R256
-        service_data_32bit_uuid             = driver.BLE_GAP_AD_TYPE_SERVICE_DATA_32BIT_UUID
-        service_data_128bit_uuid            = driver.BLE_GAP_AD_TYPE_SERVICE_DATA_128BIT_UUID
-        uri                                 = driver.BLE_GAP_AD_TYPE_URI
-        information_3d_data                 = driver.BLE_GAP_AD_TYPE_3D_INFORMATION_DATA
-        manufacturer_specific_data          = driver.BLE_GAP_AD_TYPE_MANUFACTURER_SPECIFIC_DATA
-
-
+        flags                               = const.BLE_GAP_AD_TYPE_FLAGS
+        service_16bit_uuid_more_available   = const.BLE_GAP_AD_TYPE_16BIT_SERVICE_UUID_MORE_AVAILABLE
+        service_16bit_uuid_complete         = const.BLE_GAP_AD_TYPE_16BIT_SERVICE_UUID_COMPLETE
+        service_32bit_uuid_more_available   = const.BLE_GAP_AD_TYPE_32BIT_SERVICE_UUID_MORE_AVAILABLE
+        service_32bit_uuid_complete         = const.BLE_GAP_AD_TYPE_32BIT_SERVICE_UUID_COMPLETE
+        service_128bit_uuid_more_available  = const.BLE_GAP_AD_TYPE_128BIT_SERVICE_UUID_MORE_AVAILABLE
+        service_128bit_uuid_complete        = const.BLE_GAP_AD_TYPE_128BIT_SERVICE_UUID_COMPLETE
+        short_local_name                    = const.BLE_GAP_AD_TYPE_SHORT_LOCAL_NAME
+        complete_local_name                 = const.BLE_GAP_AD_TYPE_COMPLETE_LOCAL_NAME
+        tx_power_level                      = const.BLE_GAP_AD_TYPE_TX_POWER_LEVEL
+        class_of_device                     = const.BLE_GAP_AD_TYPE_CLASS_OF_DEVICE
+        simple_pairing_hash_c               = const.BLE_GAP_AD_TYPE_SIMPLE_PAIRING_HASH_C
+        simple_pairing_randimizer_r         = const.BLE_GAP_AD_TYPE_SIMPLE_PAIRING_RANDOMIZER_R
+        security_manager_tk_value           = const.BLE_GAP_AD_TYPE_SECURITY_MANAGER_TK_VALUE
+        security_manager_oob_flags          = const.BLE_GAP_AD_TYPE_SECURITY_MANAGER_OOB_FLAGS
+        slave_connection_interval_range     = const.BLE_GAP_AD_TYPE_SLAVE_CONNECTION_INTERVAL_RANGE
+        solicited_sevice_uuids_16bit        = const.BLE_GAP_AD_TYPE_SOLICITED_SERVICE_UUIDS_16BIT
+        solicited_sevice_uuids_128bit       = const.BLE_GAP_AD_TYPE_SOLICITED_SERVICE_UUIDS_128BIT
+        service_data                        = const.BLE_GAP_AD_TYPE_SERVICE_DATA
+        public_target_address               = const.BLE_GAP_AD_TYPE_PUBLIC_TARGET_ADDRESS
+        random_target_address               = const.BLE_GAP_AD_TYPE_RANDOM_TARGET_ADDRESS
+        appearance                          = const.BLE_GAP_AD_TYPE_APPEARANCE
+        advertising_interval                = const.BLE_GAP_AD_TYPE_ADVERTISING_INTERVAL
+        le_bluetooth_device_address         = const.BLE_GAP_AD_TYPE_LE_BLUETOOTH_DEVICE_ADDRESS
+        le_role                             = const.BLE_GAP_AD_TYPE_LE_ROLE
+        simple_pairng_hash_c256             = const.BLE_GAP_AD_TYPE_SIMPLE_PAIRING_HASH_C256
+        simple_pairng_randomizer_r256       = const.BLE_GAP_AD_TYPE_SIMPLE_PAIRING_RANDOMIZER_R256
+        service_data_32bit_uuid             = const.BLE_GAP_AD_TYPE_SERVICE_DATA_32BIT_UUID
+        service_data_128bit_uuid            = const.BLE_GAP_AD_TYPE_SERVICE_DATA_128BIT_UUID
+        uri                                 = const.BLE_GAP_AD_TYPE_URI
+        information_3d_data                 = const.BLE_GAP_AD_TYPE_3D_INFORMATION_DATA
+        manufacturer_specific_data          = const.BLE_GAP_AD_TYPE_MANUFACTURER_SPECIFIC_DATA
+
+
+
+    __slots__ = ('records', '__data_array')
 
     def __init__(self, **kwargs):
         self.records = dict()
@@ -506,7 +918,19 @@ class BLEAdvData(object):
             self.records[BLEAdvData.Types[k]] = kwargs[k]
 
 
-    def to_c(self):
+    def __eq__(self, other):
+        return isinstance(other, BLEAdvData) and (self.records == other.records)
+
+
+    def __ne__(self, other):
+        return not self == other
+
+
+    # records is filled in after construction, by scan response merging too
+    __hash__ = None
+
+
+    def to_c(self, backend):
         data_list = list()
         for k in self.records:
             data_list.append(len(self.records[k]) + 1) # add type length
@@ -524,7 +948,7 @@ class BLEAdvData(object):
         if data_len == 0:
             return (data_len, None)
         else:
-            self.__data_array  = util.list_to_uint8_array(data_list)
+            self.__data_array  = util.list_to_uint8_array(backend.driver, data_list)
             return (data_len, self.__data_array.cast())
 
 
@@ -552,48 +976,114 @@ class BLEAdvData(object):
 
 
 
+class BLEAdvReportMerger(object):
+    """Joins scannable advertising reports with the scan response from the same peer."""
+    def __init__(self, timeout_ms=200):
+        self.timeout_ms = timeout_ms
+        self.pending    = dict()
+        self.lock       = Lock()
+
+
+    def adv_report(self, peer_addr, rssi, adv_type, adv_data):
+        """Returns list of (peer_addr, rssi, adv_type, adv_data) reports ready for dispatch."""
+        with self.lock:
+            return self.adv_report_merge(peer_addr, rssi, adv_type, adv_data)
+
+
+    def adv_report_merge(self, peer_addr, rssi, adv_type, adv_data):
+        now     = time.time()
+        key     = peer_addr
+        reports = self.pending_pop(before = now - self.timeout_ms / 1000.0)
+
+        if adv_type is None:
+            pending = self.pending.pop(key, None)
+            if pending is None:
+                reports.append((peer_addr, rssi, adv_type, adv_data))
+            else:
+                (p_addr, p_rssi, p_type, p_data, _) = pending
+                p_data.records.update(adv_data.records)
+                reports.append((p_addr, p_rssi, p_type, p_data))
+
+        elif adv_type in (BLEGapAdvType.connectable_undirected, BLEGapAdvType.scanable_undirected):
+            if key in self.pending:
+                reports.append(self.pending.pop(key)[:4])
+            self.pending[key] = (peer_addr, rssi, adv_type, adv_data, now)
+
+        else:
+            reports.append((peer_addr, rssi, adv_type, adv_data))
+
+        return reports
+
+
+    def flush(self, before=None):
+        """Returns the reports still waiting for a scan response, older than before if given."""
+        with self.lock:
+            return self.pending_pop(before)
+
+
+    def pending_pop(self, before=None):
+        reports = list()
+        for key, pending in self.pending.items():
+            if (before is None) or (pending[4] < before):
+                del self.pending[key]
+                reports.append(pending[:4])
+        return reports
+
+
+
 class BLEGattWriteOperation(Enum):
-    invalid             = driver.BLE_GATT_OP_INVALID
-    write_req           = driver.BLE_GATT_OP_WRITE_REQ
-    write_cmd           = driver.BLE_GATT_OP_WRITE_CMD
-    singed_write_cmd    = driver.BLE_GATT_OP_SIGN_WRITE_CMD
-    prepare_write_req   = driver.BLE_GATT_OP_PREP_WRITE_REQ
-    execute_write_req   = driver.BLE_GATT_OP_EXEC_WRITE_REQ
+    invalid             = const.BLE_GATT_OP_INVALID
+    write_req           = const.BLE_GATT_OP_WRITE_REQ
+    write_cmd           = const.BLE_GATT_OP_WRITE_CMD
+    singed_write_cmd    = const.BLE_GATT_OP_SIGN_WRITE_CMD
+    prepare_write_req   = const.BLE_GATT_OP_PREP_WRITE_REQ
+    execute_write_req   = const.BLE_GATT_OP_EXEC_WRITE_REQ
+
+
+
+class BLEGattsWriteOperation(Enum):
+    invalid                 = const.BLE_GATTS_OP_INVALID
+    write_req               = const.BLE_GATTS_OP_WRITE_REQ
+    write_cmd               = const.BLE_GATTS_OP_WRITE_CMD
+    signed_write_cmd        = const.BLE_GATTS_OP_SIGN_WRITE_CMD
+    prepare_write_req       = const.BLE_GATTS_OP_PREP_WRITE_REQ
+    execute_write_cancel    = const.BLE_GATTS_OP_EXEC_WRITE_REQ_CANCEL
+    execute_write_now       = const.BLE_GATTS_OP_EXEC_WRITE_REQ_NOW
 
 
 
 class BLEGattHVXType(Enum):
-    invalid         = driver.BLE_GATT_HVX_INVALID
-    notification    = driver.BLE_GATT_HVX_NOTIFICATION
-    indication      = driver.BLE_GATT_HVX_INDICATION
+    invalid         = const.BLE_GATT_HVX_INVALID
+    notification    = const.BLE_GATT_HVX_NOTIFICATION
+    indication      = const.BLE_GATT_HVX_INDICATION
 
 
 
 class BLEGattStatusCode(Enum):
-    success             = driver.BLE_GATT_STATUS_SUCCESS
-    invalid = driver.BLE_GATT_STATUS_ATTERR_INVALID
-    invalid_handle = driver.BLE_GATT_STATUS_ATTERR_INVALID_HANDLE
-    read_not_permitted = driver.BLE_GATT_STATUS_ATTERR_READ_NOT_PERMITTED
-    write_not_permitted = driver.BLE_GATT_STATUS_ATTERR_WRITE_NOT_PERMITTED
-    invalid_pdu = driver.BLE_GATT_STATUS_ATTERR_INVALID_PDU
-    insuf_authentication = driver.BLE_GATT_STATUS_ATTERR_INSUF_AUTHENTICATION
-    req_not_supp = driver.BLE_GATT_STATUS_ATTERR_REQUEST_NOT_SUPPORTED
-    invalid_offs = driver.BLE_GATT_STATUS_ATTERR_INVALID_OFFSET
-    insuf_authorization = driver.BLE_GATT_STATUS_ATTERR_INSUF_AUTHORIZATION
-    prep_q_full = driver.BLE_GATT_STATUS_ATTERR_PREPARE_QUEUE_FULL
-    attribute_not_found = driver.BLE_GATT_STATUS_ATTERR_ATTRIBUTE_NOT_FOUND
-    attribute_not_long = driver.BLE_GATT_STATUS_ATTERR_ATTRIBUTE_NOT_LONG
-    insuf_enc_key_size = driver.BLE_GATT_STATUS_ATTERR_INSUF_ENC_KEY_SIZE
-    invalid_att_va_length = driver.BLE_GATT_STATUS_ATTERR_INVALID_ATT_VAL_LENGTH
-    unlikely_error = driver.BLE_GATT_STATUS_ATTERR_UNLIKELY_ERROR
-    insuf_encryption = driver.BLE_GATT_STATUS_ATTERR_INSUF_ENCRYPTION
-    unsupp_group_type = driver.BLE_GATT_STATUS_ATTERR_UNSUPPORTED_GROUP_TYPE
-    insuf_resources = driver.BLE_GATT_STATUS_ATTERR_INSUF_RESOURCES
+    success             = const.BLE_GATT_STATUS_SUCCESS
+    invalid = const.BLE_GATT_STATUS_ATTERR_INVALID
+    invalid_handle = const.BLE_GATT_STATUS_ATTERR_INVALID_HANDLE
+    read_not_permitted = const.BLE_GATT_STATUS_ATTERR_READ_NOT_PERMITTED
+    write_not_permitted = const.BLE_GATT_STATUS_ATTERR_WRITE_NOT_PERMITTED
+    invalid_pdu = const.BLE_GATT_STATUS_ATTERR_INVALID_PDU
+    insuf_authentication = const.BLE_GATT_STATUS_ATTERR_INSUF_AUTHENTICATION
+    req_not_supp = const.BLE_GATT_STATUS_ATTERR_REQUEST_NOT_SUPPORTED
+    invalid_offs = const.BLE_GATT_STATUS_ATTERR_INVALID_OFFSET
+    insuf_authorization = const.BLE_GATT_STATUS_ATTERR_INSUF_AUTHORIZATION
+    prep_q_full = const.BLE_GATT_STATUS_ATTERR_PREPARE_QUEUE_FULL
+    attribute_not_found = const.BLE_GATT_STATUS_ATTERR_ATTRIBUTE_NOT_FOUND
+    attribute_not_long = const.BLE_GATT_STATUS_ATTERR_ATTRIBUTE_NOT_LONG
+    insuf_enc_key_size = const.BLE_GATT_STATUS_ATTERR_INSUF_ENC_KEY_SIZE
+    invalid_att_va_length = const.BLE_GATT_STATUS_ATTERR_INVALID_ATT_VAL_LENGTH
+    unlikely_error = const.BLE_GATT_STATUS_ATTERR_UNLIKELY_ERROR
+    insuf_encryption = const.BLE_GATT_STATUS_ATTERR_INSUF_ENCRYPTION
+    unsupp_group_type = const.BLE_GATT_STATUS_ATTERR_UNSUPPORTED_GROUP_TYPE
+    insuf_resources = const.BLE_GATT_STATUS_ATTERR_INSUF_RESOURCES
 
 
 class BLEGattExecWriteFlag(Enum):
-    prepared_cancel = driver.BLE_GATT_EXEC_WRITE_FLAG_PREPARED_CANCEL
-    prepared_write  = driver.BLE_GATT_EXEC_WRITE_FLAG_PREPARED_WRITE
+    prepared_cancel = const.BLE_GATT_EXEC_WRITE_FLAG_PREPARED_CANCEL
+    prepared_write  = const.BLE_GATT_EXEC_WRITE_FLAG_PREPARED_WRITE
     unused          = 0x00
 
 
@@ -618,9 +1108,9 @@ class BLEGattcWriteParams(object):
                                                        gattc_write_params.len))
 
 
-    def to_c(self):
-        self.__data_array       = util.list_to_uint8_array(self.data)
-        write_params            = driver.ble_gattc_write_params_t()
+    def to_c(self, backend):
+        self.__data_array       = util.list_to_uint8_array(backend.driver, self.data)
+        write_params            = backend.driver.ble_gattc_write_params_t()
         write_params.p_value    = self.__data_array.cast()
         write_params.flags      = self.flags.value
         write_params.handle     = self.handle
@@ -632,65 +1122,225 @@ class BLEGattcWriteParams(object):
 
 
 
+class BLEGattCharProps(object):
+    def __init__(self, broadcast = False, read = False, write_wo_resp = False, write = False,
+                 notify = False, indicate = False, auth_signed_wr = False):
+        self.broadcast      = broadcast
+        self.read           = read
+        self.write_wo_resp  = write_wo_resp
+        self.write          = write
+        self.notify         = notify
+        self.indicate       = indicate
+        self.auth_signed_wr = auth_signed_wr
+
+
+    def to_c(self, backend):
+        char_props                  = backend.driver.ble_gatt_char_props_t()
+        char_props.broadcast        = self.broadcast
+        char_props.read             = self.read
+        char_props.write_wo_resp    = self.write_wo_resp
+        char_props.write            = self.write
+        char_props.notify           = self.notify
+        char_props.indicate         = self.indicate
+        char_props.auth_signed_wr   = self.auth_signed_wr
+        return char_props
+
+
+
+class BLEGattsCharHandles(ValueTuple):
+    __slots__ = ()
+
+    def __new__(cls, value_handle, user_desc_handle, cccd_handle, sccd_handle):
+        return tuple.__new__(cls, (value_handle, user_desc_handle, cccd_handle, sccd_handle))
+
+
+    value_handle        = property(itemgetter(0))
+    user_desc_handle    = property(itemgetter(1))
+    cccd_handle         = property(itemgetter(2))
+    sccd_handle         = property(itemgetter(3))
+
+
+    @classmethod
+    def from_c(cls, char_handles):
+        return cls(value_handle     = char_handles.value_handle,
+                   user_desc_handle = char_handles.user_desc_handle,
+                   cccd_handle      = char_handles.cccd_handle,
+                   sccd_handle      = char_handles.sccd_handle)
+
+
+
+class BLEGattsCharacteristic(object):
+    """Characteristic of the local GATT server, handles is set once it is added."""
+    def __init__(self, uuid, props, value = None, max_len = ATT_MTU_DEFAULT - 3, vlen = True):
+        assert isinstance(uuid, BLEUUID),           'Invalid argument type'
+        assert isinstance(props, BLEGattCharProps), 'Invalid argument type'
+        self.uuid       = uuid
+        self.props      = props
+        self.value      = value if value is not None else list()
+        self.max_len    = max_len
+        self.vlen       = vlen
+        self.handles    = None
+
+
+    @staticmethod
+    def attr_md_to_c(backend, readable, writable, vlen = False):
+        # Open link (security mode 1 level 1) for allowed access, no access otherwise
+        attr_md                 = backend.driver.ble_gatts_attr_md_t()
+        attr_md.read_perm.sm    = 1 if readable else 0
+        attr_md.read_perm.lv    = 1 if readable else 0
+        attr_md.write_perm.sm   = 1 if writable else 0
+        attr_md.write_perm.lv   = 1 if writable else 0
+        attr_md.vloc            = const.BLE_GATTS_VLOC_STACK
+        attr_md.vlen            = vlen
+        return attr_md
+
+
+    def to_c(self, backend):
+        self.__attr_md  = self.attr_md_to_c(backend,
+                                            self.props.read,
+                                            self.props.write or self.props.write_wo_resp,
+                                            self.vlen)
+        self.__cccd_md  = None
+        if self.props.notify or self.props.indicate:
+            self.__cccd_md = self.attr_md_to_c(backend, True, True)
+
+        char_md                     = backend.driver.ble_gatts_char_md_t()
+        char_md.char_props          = self.props.to_c(backend)
+        char_md.p_cccd_md           = self.__cccd_md
+
+        self.__uuid                 = self.uuid.to_c(backend)
+        self.__value_array          = util.list_to_uint8_array(backend.driver, self.value)
+        attr_char_value             = backend.driver.ble_gatts_attr_t()
+        attr_char_value.p_uuid      = self.__uuid
+        attr_char_value.p_attr_md   = self.__attr_md
+        attr_char_value.init_len    = len(self.value)
+        attr_char_value.init_offs   = 0
+        attr_char_value.max_len     = self.max_len
+        attr_char_value.p_value     = self.__value_array.cast()
+
+        return (char_md, attr_char_value)
+
+
+
+class BLEGattsService(object):
+    """Service of the local GATT server, handle is set once it is added."""
+    def __init__(self, uuid, chars = None, primary = True):
+        assert isinstance(uuid, BLEUUID), 'Invalid argument type'
+        self.uuid       = uuid
+        self.chars      = chars if chars is not None else list()
+        self.primary    = primary
+        self.handle     = None
+
+
+
+class BLEGattsHVXParams(object):
+    def __init__(self, handle, hvx_type, data, offset = 0):
+        assert isinstance(hvx_type, BLEGattHVXType), 'Invalid argument type'
+        self.handle     = handle
+        self.hvx_type   = hvx_type
+        self.data       = data
+        self.offset     = offset
+
+
+    def to_c(self, backend):
+        self.__data_array   = util.list_to_uint8_array(backend.driver, self.data)
+        self.__len          = backend.driver.new_uint16()
+        backend.driver.uint16_assign(self.__len, len(self.data))
+        hvx_params          = backend.driver.ble_gatts_hvx_params_t()
+        hvx_params.handle   = self.handle
+        hvx_params.type     = self.hvx_type.value
+        hvx_params.offset   = self.offset
+        hvx_params.p_len    = self.__len
+        hvx_params.p_data   = self.__data_array.cast()
+        return hvx_params
+
+
+
 class BLEHci(Enum):
-    success                                     = driver.BLE_HCI_STATUS_CODE_SUCCESS
-    unknown_btle_command                        = driver.BLE_HCI_STATUS_CODE_UNKNOWN_BTLE_COMMAND
-    unknown_connection_identifier               = driver.BLE_HCI_STATUS_CODE_UNKNOWN_CONNECTION_IDENTIFIER
-    authentication_failure                      = driver.BLE_HCI_AUTHENTICATION_FAILURE
-    pin_or_key_missing                          = driver.BLE_HCI_STATUS_CODE_PIN_OR_KEY_MISSING
-    memory_capacity_exceeded                    = driver.BLE_HCI_MEMORY_CAPACITY_EXCEEDED
-    connection_timeout                          = driver.BLE_HCI_CONNECTION_TIMEOUT
-    command_disallowed                          = driver.BLE_HCI_STATUS_CODE_COMMAND_DISALLOWED
-    invalid_btle_command_parameters             = driver.BLE_HCI_STATUS_CODE_INVALID_BTLE_COMMAND_PARAMETERS
-    remote_user_terminated_connection           = driver.BLE_HCI_REMOTE_USER_TERMINATED_CONNECTION
-    remote_dev_termination_due_to_low_resources = driver.BLE_HCI_REMOTE_DEV_TERMINATION_DUE_TO_LOW_RESOURCES
-    remote_dev_termination_due_to_power_off     = driver.BLE_HCI_REMOTE_DEV_TERMINATION_DUE_TO_POWER_OFF
-    local_host_terminated_connection            = driver.BLE_HCI_LOCAL_HOST_TERMINATED_CONNECTION
-    unsupported_remote_feature                  = driver.BLE_HCI_UNSUPPORTED_REMOTE_FEATURE
-    invalid_lmp_parameters                      = driver.BLE_HCI_STATUS_CODE_INVALID_LMP_PARAMETERS
-    unspecified_error                           = driver.BLE_HCI_STATUS_CODE_UNSPECIFIED_ERROR
-    lmp_response_timeout                        = driver.BLE_HCI_STATUS_CODE_LMP_RESPONSE_TIMEOUT
-    lmp_pdu_not_allowed                         = driver.BLE_HCI_STATUS_CODE_LMP_PDU_NOT_ALLOWED
-    instant_passed                              = driver.BLE_HCI_INSTANT_PASSED
-    pairintg_with_unit_key_unsupported          = driver.BLE_HCI_PAIRING_WITH_UNIT_KEY_UNSUPPORTED
-    differen_transaction_collision              = driver.BLE_HCI_DIFFERENT_TRANSACTION_COLLISION
-    controller_busy                             = driver.BLE_HCI_CONTROLLER_BUSY
-    conn_interval_unacceptable                  = driver.BLE_HCI_CONN_INTERVAL_UNACCEPTABLE
-    directed_advertiser_timeout                 = driver.BLE_HCI_DIRECTED_ADVERTISER_TIMEOUT
-    conn_terminated_due_to_mic_failure          = driver.BLE_HCI_CONN_TERMINATED_DUE_TO_MIC_FAILURE
-    conn_failed_to_be_established               = driver.BLE_HCI_CONN_FAILED_TO_BE_ESTABLISHED
+    success                                     = const.BLE_HCI_STATUS_CODE_SUCCESS
+    unknown_btle_command                        = const.BLE_HCI_STATUS_CODE_UNKNOWN_BTLE_COMMAND
+    unknown_connection_identifier               = const.BLE_HCI_STATUS_CODE_UNKNOWN_CONNECTION_IDENTIFIER
+    authentication_failure                      = const.BLE_HCI_AUTHENTICATION_FAILURE
+    pin_or_key_missing                          = const.BLE_HCI_STATUS_CODE_PIN_OR_KEY_MISSING
+    memory_capacity_exceeded                    = const.BLE_HCI_MEMORY_CAPACITY_EXCEEDED
+    connection_timeout                          = const.BLE_HCI_CONNECTION_TIMEOUT
+    command_disallowed                          = const.BLE_HCI_STATUS_CODE_COMMAND_DISALLOWED
+    invalid_btle_command_parameters             = const.BLE_HCI_STATUS_CODE_INVALID_BTLE_COMMAND_PARAMETERS
+    remote_user_terminated_connection           = const.BLE_HCI_REMOTE_USER_TERMINATED_CONNECTION
+    remote_dev_termination_due_to_low_resources = const.BLE_HCI_REMOTE_DEV_TERMINATION_DUE_TO_LOW_RESOURCES
+    remote_dev_termination_due_to_power_off     = const.BLE_HCI_REMOTE_DEV_TERMINATION_DUE_TO_POWER_OFF
+    local_host_terminated_connection            = const.BLE_HCI_LOCAL_HOST_TERMINATED_CONNECTION
+    unsupported_remote_feature                  = const.BLE_HCI_UNSUPPORTED_REMOTE_FEATURE
+    invalid_lmp_parameters                      = const.BLE_HCI_STATUS_CODE_INVALID_LMP_PARAMETERS
+    unspecified_error                           = const.BLE_HCI_STATUS_CODE_UNSPECIFIED_ERROR
+    lmp_response_timeout                        = const.BLE_HCI_STATUS_CODE_LMP_RESPONSE_TIMEOUT
+    lmp_pdu_not_allowed                         = const.BLE_HCI_STATUS_CODE_LMP_PDU_NOT_ALLOWED
+    instant_passed                              = const.BLE_HCI_INSTANT_PASSED
+    pairintg_with_unit_key_unsupported          = const.BLE_HCI_PAIRING_WITH_UNIT_KEY_UNSUPPORTED
+    differen_transaction_collision              = const.BLE_HCI_DIFFERENT_TRANSACTION_COLLISION
+    controller_busy                             = const.BLE_HCI_CONTROLLER_BUSY
+    conn_interval_unacceptable                  = const.BLE_HCI_CONN_INTERVAL_UNACCEPTABLE
+    directed_advertiser_timeout                 = const.BLE_HCI_DIRECTED_ADVERTISER_TIMEOUT
+    conn_terminated_due_to_mic_failure          = const.BLE_HCI_CONN_TERMINATED_DUE_TO_MIC_FAILURE
+    conn_failed_to_be_established               = const.BLE_HCI_CONN_FAILED_TO_BE_ESTABLISHED
 
 
 
 class BLEUUIDBase(object):
+    __slots__ = ('base', 'type', '__key', '__array')
+
     def __init__(self, vs_uuid_base=None, uuid_type=None):
         assert isinstance(vs_uuid_base, (list, NoneType)), 'Invalid argument type'
         assert isinstance(uuid_type, (int, long, NoneType)), 'Invalid argument type'
         if (vs_uuid_base is None) and uuid_type is None:
             self.base   = [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x10, 0x00,
                            0x80, 0x00, 0x00, 0x80, 0x5F, 0x9B, 0x34, 0xFB]
-            self.type   = driver.BLE_UUID_TYPE_BLE
+            self.type   = const.BLE_UUID_TYPE_BLE
 
         else:
             self.base   = vs_uuid_base
             self.type   = uuid_type
 
+        # A base is identified by its bytes, the type differs between drivers.
+        # Bases only known by type, from events, are each a value of their own.
+        self.__key      = tuple(self.base) if self.base is not None else None
+
+
+    def __eq__(self, other):
+        if not isinstance(other, BLEUUIDBase):
+            return False
+        if self.__key is None:
+            return self is other
+        return self.__key == other.__key
+
+
+    def __ne__(self, other):
+        return not self == other
+
+
+    def __hash__(self):
+        if self.__key is None:
+            return object.__hash__(self)
+        return hash(self.__key)
+
 
     @classmethod
-    def from_c(cls, uuid):
-        return cls(uuid_type = uuid.type)
+    def from_c(cls, uuid, ble_driver):
+        # UUID types are assigned per SoftDevice, so only the driver that
+        # received the UUID knows its base
+        return ble_driver.uuid_base_get(uuid.type)
 
 
-    def to_c(self):
+    def to_c(self, backend):
         lsb_list        = self.base[::-1]
-        self.__array    = util.list_to_uint8_array(lsb_list)
-        uuid            = driver.ble_uuid128_t()
+        self.__array    = util.list_to_uint8_array(backend.driver, lsb_list)
+        uuid            = backend.driver.ble_uuid128_t()
         uuid.uuid128    = self.__array.cast()
         return uuid
 
 
 
-class BLEUUID(object):
+class BLEUUID(ValueTuple):
     class Standard(Enum):
         unknown             = 0x0000
         service_primary     = 0x2800
@@ -701,13 +1351,30 @@ class BLEUUID(object):
         heart_rate          = 0x2A37
 
 
-    def __init__(self, value, base=BLEUUIDBase()):
+    __slots__ = ()
+    registry  = dict()  # (base, value) -> interned UUID
+
+    def __new__(cls, value, base=None):
+        if base is None:
+            base = BLE_UUID_BASE
         assert isinstance(base, BLEUUIDBase), 'Invalid argument type'
-        self.base   = base
-        try:
-            self.value  = value if isinstance(value, BLEUUID.Standard) else BLEUUID.Standard(value)
-        except(ValueError):
-            self.value  = value
+        if isinstance(value, BLEUUID.Standard):
+            value = value.value
+
+        key     = (base, value)
+        uuid    = cls.registry.get(key)
+        if uuid is not None:
+            return uuid
+
+        uuid = tuple.__new__(cls, (BLEUUID.standard_values.get(value, value), base))
+        if base.base is not None:
+            # Bases only known by type are not interned, they are not shared
+            uuid = cls.registry.setdefault(key, uuid)
+        return uuid
+
+
+    value   = property(itemgetter(0))
+    base    = property(itemgetter(1))
 
 
     def __str__(self):
@@ -718,13 +1385,13 @@ class BLEUUID(object):
 
 
     @classmethod
-    def from_c(cls, uuid):
-        return cls(value = uuid.uuid, base = BLEUUIDBase.from_c(uuid))
+    def from_c(cls, uuid, ble_driver):
+        return cls(value = uuid.uuid, base = BLEUUIDBase.from_c(uuid, ble_driver))
 
 
-    def to_c(self):
+    def to_c(self, backend):
         assert self.base.type is not None, 'Vendor specific UUID not registered'
-        uuid = driver.ble_uuid_t()
+        uuid = backend.driver.ble_uuid_t()
         if isinstance(self.value, BLEUUID.Standard):
             uuid.uuid = self.value.value
         else:
@@ -733,24 +1400,33 @@ class BLEUUID(object):
         return uuid
 
 
+BLE_UUID_BASE           = BLEUUIDBase()
+BLEUUID.standard_values = dict((s.value, s) for s in BLEUUID.Standard)
+
 
-class BLEDescriptor(object):
-    def __init__(self, uuid, handle):
-        logger.debug('New descriptor uuid: {}, handle: {}'.format(uuid, handle))
-        self.handle = handle
-        self.uuid   = uuid
+
+class BLEDescriptor(ValueTuple):
+    __slots__ = ()
+
+    def __new__(cls, uuid, handle):
+        return tuple.__new__(cls, (uuid, handle))
+
+
+    uuid    = property(itemgetter(0))
+    handle  = property(itemgetter(1))
 
 
     @classmethod
-    def from_c(cls, gattc_desc):
-        return cls(uuid     = BLEUUID.from_c(gattc_desc.uuid),
+    def from_c(cls, gattc_desc, ble_driver):
+        return cls(uuid     = BLEUUID.from_c(gattc_desc.uuid, ble_driver),
                    handle   = gattc_desc.handle)
 
 
 
 class BLECharacteristic(object):
+    __slots__ = ('uuid', 'handle_decl', 'handle_value', 'end_handle', 'descs')
+
     def __init__(self, uuid, handle_decl, handle_value):
-        logger.debug('New characteristic uuid: {}, declaration handle: {}, value handle: {}'.format(uuid, handle_decl, handle_value))
         self.uuid           = uuid
         self.handle_decl    = handle_decl
         self.handle_value   = handle_value
@@ -758,26 +1434,53 @@ class BLECharacteristic(object):
         self.descs          = list()
 
 
+    def __eq__(self, other):
+        return (isinstance(other, BLECharacteristic) and
+                (self.uuid, self.handle_decl, self.handle_value) == (other.uuid, other.handle_decl, other.handle_value))
+
+
+    def __ne__(self, other):
+        return not self == other
+
+
+    def __hash__(self):
+        return hash((self.uuid, self.handle_decl, self.handle_value))
+
+
     @classmethod
-    def from_c(cls, gattc_char):
-        return cls(uuid         = BLEUUID.from_c(gattc_char.uuid),
+    def from_c(cls, gattc_char, ble_driver):
+        return cls(uuid         = BLEUUID.from_c(gattc_char.uuid, ble_driver),
                    handle_decl  = gattc_char.handle_decl,
                    handle_value = gattc_char.handle_value)
 
 
 
 class BLEService(object):
+    __slots__ = ('uuid', 'start_handle', 'end_handle', 'chars')
+
     def __init__(self, uuid, start_handle, end_handle):
-        logger.debug('New service uuid: {}, start handle: {}, end handle: {}'.format(uuid, start_handle, end_handle))
         self.uuid           = uuid
         self.start_handle   = start_handle
         self.end_handle     = end_handle
         self.chars          = list()
 
 
+    def __eq__(self, other):
+        return (isinstance(other, BLEService) and
+                (self.uuid, self.start_handle, self.end_handle) == (other.uuid, other.start_handle, other.end_handle))
+
+
+    def __ne__(self, other):
+        return not self == other
+
+
+    def __hash__(self):
+        return hash((self.uuid, self.start_handle, self.end_handle))
+
+
     @classmethod
-    def from_c(cls, gattc_service):
-        return cls(uuid         = BLEUUID.from_c(gattc_service.uuid),
+    def from_c(cls, gattc_service, ble_driver):
+        return cls(uuid         = BLEUUID.from_c(gattc_service.uuid, ble_driver),
                    start_handle = gattc_service.handle_range.start_handle,
                    end_handle   = gattc_service.handle_range.end_handle)
 
@@ -801,7 +1504,7 @@ class SerialPortDescriptor(object):
     
     @classmethod
     def to_string(cls, char_arr):
-        s = util.char_array_to_list(char_arr, driver.SD_RPC_MAXPATHLEN)
+        s = util.char_array_to_list(char_arr, const.SD_RPC_MAXPATHLEN)
         for i, c in enumerate(s):
             if c == '\x00':
                 break
@@ -822,7 +1525,10 @@ class SerialPortDescriptor(object):
 
 
 class Flasher(object):
-    api_lock = Lock()
+    # nrfjprog calls are serialized per board, different boards are worked on in parallel
+    snr_locks       = dict()
+    snr_locks_lock  = Lock()
+
     @staticmethod
     def which(program):
         import os
@@ -843,7 +1549,13 @@ class Flasher(object):
         return None
 
     NRFJPROG = 'nrfjprog'
-    def __init__(self, serial_port = None, snr = None):
+    def __init__(self, serial_port = None, snr = None, conn_ic_id = None, serial_ports = None, fw_cache = None):
+        """Flasher for the board on serial_port or with serial number snr.
+
+        serial_ports is a list of SerialPortDescriptor, enumerated on the spot
+        if None. fw_cache is a FirmwareCache that spares fw_check the board
+        read for boards verified before.
+        """
         if serial_port is None and snr is None:
             raise NordicSemiException('Invalid Flasher initialization')
         
@@ -853,7 +1565,8 @@ class Flasher(object):
             if nrfjprog == None:
                 raise NordicSemiException('nrfjprog not installed')
 
-        serial_ports = BLEDriver.enum_serial_ports()
+        if serial_ports is None:
+            serial_ports = BLEDriver.enum_serial_ports(conn_ic_id)
         try:
             if serial_port is None:
                 serial_port = [d.port for d in serial_ports if d.serial_number == snr][0]
@@ -863,17 +1576,41 @@ class Flasher(object):
            raise NordicSemiException('board not found')
 
         self.serial_port = serial_port
-        self.snr    = snr.lstrip("0")
-        self.family = config.__conn_ic_id__
+        self.snr        = snr.lstrip("0")
+        self.conn_ic_id = conn_ic_id
+        self.family     = config.conn_ic_id_get(conn_ic_id)
+        self.fw_cache   = fw_cache
+
+
+    @classmethod
+    def snr_lock(cls, snr):
+        with cls.snr_locks_lock:
+            return cls.snr_locks.setdefault(snr, Lock())
+
+
+    def fw_check(self, recheck = False):
+        hex_file    = config.conn_ic_hex_get(self.family)
+        sd_api_ver  = config.sd_api_ver_get(self.family)
+        if self.fw_cache is not None and not recheck and self.fw_cache.verified(self.snr, hex_file, sd_api_ver):
+            return True
 
-    def fw_check(self):
         data    = self.read(addr = 0x20000, size = 4)
-        return data == [0x17, 0xA5, 0xD8, 0x46] # hex magic number
+        current = data == [0x17, 0xA5, 0xD8, 0x46] # hex magic number
+        if self.fw_cache is not None:
+            if current:
+                self.fw_cache.add(self.snr, hex_file, sd_api_ver)
+            else:
+                self.fw_cache.remove(self.snr)
+        return current
 
     def fw_flash(self):
+        if self.fw_cache is not None:
+            self.fw_cache.remove(self.snr)
         self.erase()
-        hex_file = config.conn_ic_hex_get()
+        hex_file = config.conn_ic_hex_get(self.family)
         self.program(hex_file)
+        if self.fw_cache is not None:
+            self.fw_cache.add(self.snr, hex_file, config.sd_api_ver_get(self.family))
 
     def read(self, addr, size):
         args = ['--memrd', str(addr), '--w', '8', '--n', str(size)]
@@ -901,11 +1638,39 @@ class Flasher(object):
         self.call_cmd(args)
 
 
-    @wrapt.synchronized(api_lock)
+    def wait_ready(self, timeout = 5.0, interval = 0.05):
+        """Poll until the serial port of the board is back after a reset.
+
+        The port counts as ready once it is enumerated again and, outside
+        Windows, its device node can be opened. The connectivity firmware
+        boots well within the link layer sync retries of sd_rpc_open.
+        """
+        t_end = time.time() + timeout
+        while not self.port_ready():
+            if time.time() > t_end:
+                raise NordicSemiException('Board {} not ready after {} s'.format(self.snr, timeout))
+            time.sleep(interval)
+
+
+    def port_ready(self):
+        ports = [d.port for d in BLEDriver.enum_serial_ports(self.conn_ic_id, max_age_s = 0)]
+        if self.serial_port not in ports:
+            return False
+        if os.name == 'nt':
+            return True
+        try:
+            fd = os.open(self.serial_port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        except OSError:
+            return False
+        os.close(fd)
+        return True
+
+
     def call_cmd(self, args):
         args = [Flasher.NRFJPROG, '--snr', str(self.snr)] + args + ['--family']
         try:
-            return subprocess.check_output(args + [self.family], stderr=subprocess.STDOUT)
+            with Flasher.snr_lock(self.snr):
+                return subprocess.check_output(args + [self.family], stderr=subprocess.STDOUT)
         except subprocess.CalledProcessError as e:
             if e.returncode == 18:
                 raise RuntimeError("Invalid Connectivity IC ID: {}".format(self.family))
@@ -915,77 +1680,178 @@ class Flasher(object):
 
 
 class BLEDriver(object):
-    observer_lock   = Lock()
-    api_lock        = Lock()
-    def __init__(self, serial_port, baud_rate=115200, auto_flash=False):
+    enum_lock       = Lock()
+    enum_cache      = None  # (scan time, descriptors)
+    def __init__(self, serial_port, baud_rate=115200, auto_flash=False, merge_scan_rsp=False, conn_ic_id=None,
+                 fw_cache=None, fw_recheck=False):
         super(BLEDriver, self).__init__()
-        self.observers = list()
+        self.state_init(serial_port, driver_load(conn_ic_id), merge_scan_rsp)
         if auto_flash:
             try:
-                flasher = Flasher(serial_port=serial_port)
+                flasher = Flasher(serial_port=serial_port, conn_ic_id=conn_ic_id, fw_cache=fw_cache)
             except Exception:
                 logger.error("Unable to find serial port")
                 raise
 
-            if flasher.fw_check() == False:
+            if flasher.fw_check(recheck=fw_recheck) == False:
                 logger.info("Flashing board with firmware")
                 flasher.fw_flash()
 
             flasher.reset()
-            time.sleep(1)
-
-        phy_layer           = driver.sd_rpc_physical_layer_create_uart(serial_port,
-                                                                       baud_rate,
-                                                                       driver.SD_RPC_FLOW_CONTROL_NONE,
-                                                                       driver.SD_RPC_PARITY_NONE);
-        link_layer          = driver.sd_rpc_data_link_layer_create_bt_three_wire(phy_layer, 100)
-        transport_layer     = driver.sd_rpc_transport_layer_create(link_layer, 100)
-        self.rpc_adapter    = driver.sd_rpc_adapter_create(transport_layer)
+            flasher.wait_ready()
+
+        phy_layer           = self.driver.sd_rpc_physical_layer_create_uart(serial_port,
+                                                                            baud_rate,
+                                                                            const.SD_RPC_FLOW_CONTROL_NONE,
+                                                                            const.SD_RPC_PARITY_NONE);
+        link_layer          = self.driver.sd_rpc_data_link_layer_create_bt_three_wire(phy_layer, 100)
+        transport_layer     = self.driver.sd_rpc_transport_layer_create(link_layer, 100)
+        self.rpc_adapter    = self.driver.sd_rpc_adapter_create(transport_layer)
+
+
+    def state_init(self, serial_port, backend, merge_scan_rsp=False):
+        """Set up the driver state, everything but the transport to the connectivity IC.
+
+        Drivers that simulate the native layer call this instead of __init__.
+        """
+        self.backend            = backend
+        self.driver             = backend.driver
+        self.serial_port        = serial_port
+        self.rpc_adapter        = None
+        self.tx_in_flight       = dict()
+        self.tx_packet_counts   = dict()
+        self.data_lengths       = dict()
+        self.att_mtu_requests   = dict()
+        self.sec_keysets        = dict()
+        self.sec_keys           = dict()
+        self.callback_time      = 0.0
+        self.api_lock           = Lock()
+        self.observer_lock      = Lock()
+        self.observers          = tuple()
+        self.evt_thread_id      = None
+        self.uuid_bases         = {const.BLE_UUID_TYPE_BLE: BLE_UUID_BASE}  # UUID type -> base, per SoftDevice
+        self.whitelist          = BLEGapWhitelist()
+        self.scan_params        = None
+        self.adv_report_merger  = BLEAdvReportMerger() if merge_scan_rsp else None
 
 
-    @wrapt.synchronized(api_lock)
     @classmethod
-    def enum_serial_ports(cls):
-        MAX_SERIAL_PORTS = 64
-        c_descs = [ driver.sd_rpc_serial_port_desc_t() for i in range(MAX_SERIAL_PORTS)]
-        c_desc_arr = util.list_to_serial_port_desc_array(c_descs)
+    def enum_serial_ports(cls, conn_ic_id=None, max_age_s=SERIAL_PORT_CACHE_TTL_S):
+        """List the serial ports, from the last scan if it is at most max_age_s old.
 
-        arr_len = driver.new_uint32()
-        driver.uint32_assign(arr_len, MAX_SERIAL_PORTS)
+        max_age_s = 0 always scans. A SerialPortMonitor invalidates the
+        cache whenever a port comes or goes.
+        """
+        with cls.enum_lock:
+            if (cls.enum_cache is not None) and (time.time() - cls.enum_cache[0] < max_age_s):
+                return list(cls.enum_cache[1])
+            descs           = cls.enum_serial_ports_scan(conn_ic_id)
+            cls.enum_cache  = (time.time(), descs)
+            return list(descs)
 
-        err_code = driver.sd_rpc_serial_port_enum(c_desc_arr, arr_len)
-        if err_code != driver.NRF_SUCCESS:
-            raise NordicSemiException('Failed to {}. Error code: {}'.format(func.__name__, err_code))
 
-        dlen = driver.uint32_value(arr_len)
+    @classmethod
+    def enum_cache_invalidate(cls):
+        with cls.enum_lock:
+            cls.enum_cache = None
+
 
-        descs   = util.serial_port_desc_array_to_list(c_desc_arr, dlen)
+    @staticmethod
+    def enum_serial_ports_scan(conn_ic_id=None):
+        driver      = driver_load(conn_ic_id).driver
+        # The native enumerator fills in the descriptors, they need no initialization
+        c_desc_arr  = driver.sd_rpc_serial_port_desc_array(SERIAL_PORTS_MAX)
+        arr_len     = driver.new_uint32()
+        try:
+            driver.uint32_assign(arr_len, SERIAL_PORTS_MAX)
+            err_code = driver.sd_rpc_serial_port_enum(c_desc_arr, arr_len)
+            if err_code != const.NRF_SUCCESS:
+                raise NordicSemiException('Failed to enum_serial_ports. Error code: {}'.format(err_code))
+            dlen = driver.uint32_value(arr_len)
+        finally:
+            driver.delete_uint32(arr_len)
+
+        descs   = util.serial_port_desc_array_to_list(driver, c_desc_arr, dlen)
         return map(SerialPortDescriptor.from_c, descs)
 
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def open(self):
-        return driver.sd_rpc_open(self.rpc_adapter,
-                                  self.status_handler,
-                                  self.ble_evt_handler,
-                                  self.log_message_handler)
+        return self.driver.sd_rpc_open(self.rpc_adapter,
+                                       self.status_handler,
+                                       self.ble_evt_handler,
+                                       self.log_message_handler)
 
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def close(self):
-        return driver.sd_rpc_close(self.rpc_adapter)
+        return self.driver.sd_rpc_close(self.rpc_adapter)
 
 
-    @wrapt.synchronized(observer_lock)
+    # Observers are kept in a tuple that is replaced on every change, so
+    # dispatch iterates a snapshot without holding observer_lock and
+    # callbacks are free to register, unregister or call into the driver.
     def observer_register(self, observer):
-        self.observers.append(observer)
+        with self.observer_lock:
+            self.observers = self.observers + (observer,)
 
 
-    @wrapt.synchronized(observer_lock)
     def observer_unregister(self, observer):
-        self.observers.remove(observer)
+        with self.observer_lock:
+            observers = list(self.observers)
+            observers.remove(observer)
+            self.observers = tuple(observers)
+
+
+    def observers_notify(self, callback, **kwargs):
+        observers = self.observers
+        if not (metrics.registry.enabled or profiling.hooks):
+            for obs in observers:
+                getattr(obs, callback)(**kwargs)
+            return
+
+        metered = metrics.registry.enabled
+        for obs in observers:
+            t_start = time.time()
+            if profiling.hooks:
+                profiling.call_profiled(profiling.hooks, profiling.PROFILE_CALLBACK,
+                                        '{}.{}'.format(type(obs).__name__, callback),
+                                        kwargs.get('conn_handle'), getattr(obs, callback), (), kwargs)
+            else:
+                getattr(obs, callback)(**kwargs)
+            if metered:
+                elapsed = time.time() - t_start
+                self.callback_time += elapsed
+                metrics.callback_seconds.labels(self.serial_port, type(obs).__name__, callback).observe(elapsed)
+
+
+    def tx_in_flight_update(self, conn_handle, count):
+        """Track packets handed to the SoftDevice and not yet reported by a TX complete event."""
+        in_flight = max(self.tx_in_flight.get(conn_handle, 0) + count, 0)
+        self.tx_in_flight[conn_handle] = in_flight
+        if metrics.registry.enabled:
+            metrics.tx_packets_in_flight.labels(self.serial_port, conn_handle).set(in_flight)
+
+
+    def tx_credits(self, conn_handle):
+        """Number of packets that can be queued on conn_handle without the SoftDevice running out of buffers."""
+        return self.tx_packet_counts.get(conn_handle, 1) - self.tx_in_flight.get(conn_handle, 0)
+
+
+    def sec_keys_update(self, conn_handle, auth_status_evt):
+        """Keep the keys distributed by a successful bonding in sec_keys."""
+        (keyset, keys) = self.sec_keysets.pop(conn_handle, (None, None))
+        if (keys is None) or (auth_status_evt.auth_status != const.BLE_GAP_SEC_STATUS_SUCCESS) or not auth_status_evt.bonded:
+            return
+
+        own_enc_key     = BLEGapEncKey.from_c(keys['own_enc'])  if auth_status_evt.kdist_own.enc  else None
+        peer_enc_key    = BLEGapEncKey.from_c(keys['peer_enc']) if auth_status_evt.kdist_peer.enc else None
+        peer_id_key     = BLEGapIdKey.from_c(keys['peer_id'])   if auth_status_evt.kdist_peer.id  else None
+        # With LE Secure Connections the LTK is not distributed, both sides
+        # derive the same one and the SoftDevice returns it as own key
+        if own_enc_key and own_enc_key.lesc and not (peer_enc_key and peer_enc_key.ltk):
+            peer_enc_key = own_enc_key
+        self.sec_keys[conn_handle] = BLEGapSecKeyset(own_enc_key, peer_enc_key, peer_id_key)
 
 
     def ble_enable_params_setup(self):
@@ -1014,217 +1880,377 @@ class BLEDriver(object):
                                 slave_latency        = 0)
 
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def ble_enable(self, ble_enable_params=None):
         if not ble_enable_params:
             ble_enable_params = self.ble_enable_params_setup()
         assert isinstance(ble_enable_params, BLEEnableParams), 'Invalid argument type'
         self.ble_enable_params = ble_enable_params
-        return driver.sd_ble_enable(self.rpc_adapter, ble_enable_params.to_c(), None)
+        return self.driver.sd_ble_enable(self.rpc_adapter, ble_enable_params.to_c(self.backend), None)
+
+
+    @NordicSemiAPICall
+    def ble_opt_conn_bw_set(self, role, conn_bw_tx, conn_bw_rx):
+        assert isinstance(role, BLEGapRoles),     'Invalid argument type'
+        assert isinstance(conn_bw_tx, BLEConnBw), 'Invalid argument type'
+        assert isinstance(conn_bw_rx, BLEConnBw), 'Invalid argument type'
+        opt                                         = self.driver.ble_opt_t()
+        opt.common_opt.conn_bw.role                 = role.value
+        opt.common_opt.conn_bw.conn_bw.conn_bw_tx   = conn_bw_tx.value
+        opt.common_opt.conn_bw.conn_bw.conn_bw_rx   = conn_bw_rx.value
+        return self.driver.sd_ble_opt_set(self.rpc_adapter, const.BLE_COMMON_OPT_CONN_BW, opt)
+
 
+    @NordicSemiAPICall
+    def ble_opt_conn_evt_ext_set(self, enable):
+        assert self.backend.sd_api_ver >= 3, 'Connection event extension requires SoftDevice API v3'
+        opt                                 = self.driver.ble_opt_t()
+        opt.common_opt.conn_evt_ext.enable  = enable
+        return self.driver.sd_ble_opt_set(self.rpc_adapter, const.BLE_COMMON_OPT_CONN_EVT_EXT, opt)
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+
+    @NordicSemiAPICall
+    def ble_opt_ext_len_set(self, rxtx_max_pdu_payload_size):
+        assert self.backend.sd_api_ver >= 3, 'Data length extension requires SoftDevice API v3'
+        opt                                             = self.driver.ble_opt_t()
+        opt.gap_opt.ext_len.rxtx_max_pdu_payload_size   = rxtx_max_pdu_payload_size
+        return self.driver.sd_ble_opt_set(self.rpc_adapter, const.BLE_GAP_OPT_EXT_LEN, opt)
+
+
+    @NordicSemiAPICall
     def ble_gap_adv_start(self, adv_params=None):
         if not adv_params:
             adv_params = self.adv_params_setup()
         assert isinstance(adv_params, BLEGapAdvParams), 'Invalid argument type'
-        return driver.sd_ble_gap_adv_start(self.rpc_adapter, adv_params.to_c())
+        return self.driver.sd_ble_gap_adv_start(self.rpc_adapter, adv_params.to_c(self.backend))
 
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def ble_gap_conn_param_update(self, conn_handle, conn_params):
         assert isinstance(conn_params, (BLEGapConnParams, NoneType)), 'Invalid argument type'
         if conn_params:
-            conn_params=conn_params.to_c()
-        return driver.sd_ble_gap_conn_param_update(self.rpc_adapter, conn_handle, conn_params)
+            conn_params=conn_params.to_c(self.backend)
+        return self.driver.sd_ble_gap_conn_param_update(self.rpc_adapter, conn_handle, conn_params)
 
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def ble_gap_adv_stop(self):
-        return driver.sd_ble_gap_adv_stop(self.rpc_adapter)
+        return self.driver.sd_ble_gap_adv_stop(self.rpc_adapter)
 
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def ble_gap_scan_start(self, scan_params=None):
         if not scan_params:
             scan_params = self.scan_params_setup()
         assert isinstance(scan_params, BLEGapScanParams), 'Invalid argument type'
-        return driver.sd_ble_gap_scan_start(self.rpc_adapter, scan_params.to_c())
+        self.scan_params = scan_params
+        return self.driver.sd_ble_gap_scan_start(self.rpc_adapter, scan_params.to_c(self.backend, self.whitelist))
 
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def ble_gap_scan_stop(self):
-        return driver.sd_ble_gap_scan_stop(self.rpc_adapter)
+        self.gap_scan_stop()
+        # No scan response or scan timeout follows a stop, so dispatch the
+        # reports held back. Outside the API lock, observers may call the driver.
+        if self.adv_report_merger:
+            self.adv_report_dispatch(const.BLE_CONN_HANDLE_INVALID, self.adv_report_merger.flush())
+
+
+    @NordicSemiAPICall
+    def gap_scan_stop(self):
+        return self.driver.sd_ble_gap_scan_stop(self.rpc_adapter)
 
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def ble_gap_connect(self, address, scan_params=None, conn_params=None):
-        assert isinstance(address, BLEGapAddr), 'Invalid argument type'
+        assert isinstance(address, (BLEGapAddr, NoneType)), 'Invalid argument type'
 
         if not scan_params:
             scan_params = self.scan_params_setup()
+            scan_params.use_whitelist = address is None
         assert isinstance(scan_params, BLEGapScanParams), 'Invalid argument type'
+        assert address or scan_params.use_whitelist, 'Address required when not using whitelist'
 
         if not conn_params:
             conn_params = self.conn_params_setup()
         assert isinstance(conn_params, BLEGapConnParams), 'Invalid argument type'
 
-        return driver.sd_ble_gap_connect(self.rpc_adapter, 
-                                         address.to_c(),
-                                         scan_params.to_c(),
-                                         conn_params.to_c())
+        return self.driver.sd_ble_gap_connect(self.rpc_adapter, 
+                                              address.to_c(self.backend) if address else None,
+                                              scan_params.to_c(self.backend, self.whitelist),
+                                              conn_params.to_c(self.backend))
+
+
+    @NordicSemiAPICall
+    def ble_gap_whitelist_set(self, whitelist):
+        assert isinstance(whitelist, BLEGapWhitelist), 'Invalid argument type'
+        if self.backend.sd_api_ver < 3:
+            # API v2 passes the whitelist along with the scan parameters
+            self.whitelist = whitelist
+            return const.NRF_SUCCESS
+
+        pp_addrs = whitelist.to_c(self.backend)
+        err_code = self.backend.shlib.sd_ble_gap_whitelist_set(int(self.rpc_adapter.this),
+                                                               pp_addrs if len(whitelist) else None,
+                                                               len(whitelist))
+        if err_code == const.NRF_SUCCESS:
+            self.whitelist = whitelist
+        return err_code
 
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def ble_gap_disconnect(self, conn_handle, hci_status_code = BLEHci.remote_user_terminated_connection):
         assert isinstance(hci_status_code, BLEHci), 'Invalid argument type'
-        return driver.sd_ble_gap_disconnect(self.rpc_adapter, 
-                                            conn_handle,
-                                            hci_status_code.value)
+        return self.driver.sd_ble_gap_disconnect(self.rpc_adapter, 
+                                                 conn_handle,
+                                                 hci_status_code.value)
 
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def ble_gap_adv_data_set(self, adv_data = BLEAdvData(), scan_data = BLEAdvData()):
         assert isinstance(adv_data, BLEAdvData),    'Invalid argument type'
         assert isinstance(scan_data, BLEAdvData),   'Invalid argument type'
-        (adv_data_len,  p_adv_data)     = adv_data.to_c()
-        (scan_data_len, p_scan_data)    = scan_data.to_c()
+        (adv_data_len,  p_adv_data)     = adv_data.to_c(self.backend)
+        (scan_data_len, p_scan_data)    = scan_data.to_c(self.backend)
 
-        return driver.sd_ble_gap_adv_data_set(self.rpc_adapter,
-                                              p_adv_data,
-                                              adv_data_len,
-                                              p_scan_data,
-                                              scan_data_len)
+        return self.driver.sd_ble_gap_adv_data_set(self.rpc_adapter,
+                                                   p_adv_data,
+                                                   adv_data_len,
+                                                   p_scan_data,
+                                                   scan_data_len)
 
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def ble_gap_authenticate(self, conn_handle, sec_params):
         assert isinstance(sec_params, (BLEGapSecParams, NoneType)), 'Invalid argument type'
-        return driver.sd_ble_gap_authenticate(self.rpc_adapter,
-                                              conn_handle,
-                                              sec_params.to_c() if sec_params else None)
+        return self.driver.sd_ble_gap_authenticate(self.rpc_adapter,
+                                                   conn_handle,
+                                                   sec_params.to_c(self.backend) if sec_params else None)
 
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def ble_gap_sec_params_reply(self, conn_handle, sec_status, sec_params, own_keys, peer_keys):
         assert isinstance(sec_status, BLEGapSecStatus),             'Invalid argument type'
         assert isinstance(sec_params, (BLEGapSecParams, NoneType)), 'Invalid argument type'
-        #assert isinstance(own_keys,   NoneType),                    'NOT IMPLEMENTED'
-        assert isinstance(peer_keys,  NoneType),                    'NOT IMPLEMENTED'
-
-        keyset                      = driver.ble_gap_sec_keyset_t()
-
-        keyset.keys_own.p_enc_key   = driver.ble_gap_enc_key_t()
-        keyset.keys_own.p_id_key    = driver.ble_gap_id_key_t()
-        keyset.keys_own.p_sign_key  = driver.ble_gap_sign_info_t()
-        keyset.keys_own.p_pk        = own_keys.to_c() if own_keys else driver.ble_gap_lesc_p256_pk_t()
-
-        keyset.keys_peer.p_enc_key  = driver.ble_gap_enc_key_t()
-        keyset.keys_peer.p_id_key   = driver.ble_gap_id_key_t()
-        keyset.keys_peer.p_sign_key = driver.ble_gap_sign_info_t()
-        keyset.keys_peer.p_pk       = driver.ble_gap_lesc_p256_pk_t()
-
-        self.__keyset = keyset
-
-        return driver.sd_ble_gap_sec_params_reply(self.rpc_adapter,
-                                                  conn_handle,
-                                                  sec_status.value,
-                                                  sec_params.to_c() if sec_params else None,
-                                                  self.__keyset)
+        assert isinstance(own_keys,   (BLEGapLESCp256pk, NoneType)), 'Invalid argument type'
+        assert isinstance(peer_keys,  (BLEGapLESCp256pk, NoneType)), 'Invalid argument type'
+
+        # The SoftDevice fills in the distributed keys when pairing completes,
+        # so the keys stay referenced until the authentication status event
+        keys = dict(own_enc     = self.driver.ble_gap_enc_key_t(),
+                    own_id      = self.driver.ble_gap_id_key_t(),
+                    own_sign    = self.driver.ble_gap_sign_info_t(),
+                    own_pk      = own_keys.to_c(self.backend) if own_keys else self.driver.ble_gap_lesc_p256_pk_t(),
+                    peer_enc    = self.driver.ble_gap_enc_key_t(),
+                    peer_id     = self.driver.ble_gap_id_key_t(),
+                    peer_sign   = self.driver.ble_gap_sign_info_t(),
+                    peer_pk     = peer_keys.to_c(self.backend) if peer_keys else self.driver.ble_gap_lesc_p256_pk_t())
+
+        keyset                      = self.driver.ble_gap_sec_keyset_t()
+
+        keyset.keys_own.p_enc_key   = keys['own_enc']
+        keyset.keys_own.p_id_key    = keys['own_id']
+        keyset.keys_own.p_sign_key  = keys['own_sign']
+        keyset.keys_own.p_pk        = keys['own_pk']
+
+        keyset.keys_peer.p_enc_key  = keys['peer_enc']
+        keyset.keys_peer.p_id_key   = keys['peer_id']
+        keyset.keys_peer.p_sign_key = keys['peer_sign']
+        keyset.keys_peer.p_pk       = keys['peer_pk']
+
+        self.sec_keysets[conn_handle] = (keyset, keys)
+
+        return self.driver.sd_ble_gap_sec_params_reply(self.rpc_adapter,
+                                                       conn_handle,
+                                                       sec_status.value,
+                                                       sec_params.to_c(self.backend) if sec_params else None,
+                                                       keyset)
+
+
+    @NordicSemiAPICall
+    def ble_gap_encrypt(self, conn_handle, enc_key):
+        assert isinstance(enc_key, BLEGapEncKey), 'Invalid argument type'
+        return self.driver.sd_ble_gap_encrypt(self.rpc_adapter,
+                                              conn_handle,
+                                              enc_key.master_id_to_c(self.backend),
+                                              enc_key.enc_info_to_c(self.backend))
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def ble_gap_lesc_dhkey_reply(self, conn_handle, dhkey):
-        return driver.sd_ble_gap_lesc_dhkey_reply(self.rpc_adapter,
-                                                  conn_handle,
-                                                  dhkey.to_c())
+        return self.driver.sd_ble_gap_lesc_dhkey_reply(self.rpc_adapter,
+                                                       conn_handle,
+                                                       dhkey.to_c(self.backend))
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def ble_gap_auth_key_reply(self, conn_handle, key_type, p_key):
-        return driver.sd_ble_gap_auth_key_reply(self.rpc_adapter,
-                                                  conn_handle,
-                                                  key_type,
-                                                  p_key)
+        return self.driver.sd_ble_gap_auth_key_reply(self.rpc_adapter,
+                                                       conn_handle,
+                                                       key_type,
+                                                       p_key)
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def ble_vs_uuid_add(self, uuid_base):
         assert isinstance(uuid_base, BLEUUIDBase), 'Invalid argument type'
-        uuid_type = driver.new_uint8()
-
-        err_code = driver.sd_ble_uuid_vs_add(self.rpc_adapter,
-                                             uuid_base.to_c(),
-                                             uuid_type)
-        if err_code == driver.NRF_SUCCESS:
-            uuid_base.type = driver.uint8_value(uuid_type)
+        for (uuid_type, base) in self.uuid_bases.items():
+            if base == uuid_base:
+                uuid_base.type = uuid_type
+                return const.NRF_SUCCESS
+
+        uuid_type = self.driver.new_uint8()
+        err_code = self.driver.sd_ble_uuid_vs_add(self.rpc_adapter,
+                                                  uuid_base.to_c(self.backend),
+                                                  uuid_type)
+        if err_code == const.NRF_SUCCESS:
+            uuid_base.type = self.driver.uint8_value(uuid_type)
+            self.uuid_bases[uuid_base.type] = uuid_base
         return err_code
 
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    def uuid_base_get(self, uuid_type):
+        base = self.uuid_bases.get(uuid_type)
+        if base is None:
+            # Not added through this driver, the base bytes are unknown
+            base = self.uuid_bases.setdefault(uuid_type, BLEUUIDBase(uuid_type = uuid_type))
+        return base
+
+
+    @NordicSemiAPICall
     def ble_gattc_write(self, conn_handle, write_params):
         assert isinstance(write_params, BLEGattcWriteParams), 'Invalid argument type'
-        return driver.sd_ble_gattc_write(self.rpc_adapter,
-                                         conn_handle,
-                                         write_params.to_c())
+        err_code = self.driver.sd_ble_gattc_write(self.rpc_adapter,
+                                                  conn_handle,
+                                                  write_params.to_c(self.backend))
+        if err_code == const.NRF_SUCCESS and write_params.write_op == BLEGattWriteOperation.write_cmd:
+            self.tx_in_flight_update(conn_handle, 1)
+        return err_code
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def ble_gattc_read(self, conn_handle, handle, offset):
-        return driver.sd_ble_gattc_read(self.rpc_adapter,
-                                         conn_handle,
-                                         handle,
+        return self.driver.sd_ble_gattc_read(self.rpc_adapter,
+                                              conn_handle,
+                                              handle,
 										 offset)
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+
+    @NordicSemiAPICall
+    def ble_gattc_hv_confirm(self, conn_handle, handle):
+        return self.driver.sd_ble_gattc_hv_confirm(self.rpc_adapter,
+                                                   conn_handle,
+                                                   handle)
+
+    @NordicSemiAPICall
+    def ble_gatts_service_add(self, service):
+        assert isinstance(service, BLEGattsService), 'Invalid argument type'
+        handle      = self.driver.new_uint16()
+        err_code    = self.driver.sd_ble_gatts_service_add(self.rpc_adapter,
+                                                           const.BLE_GATTS_SRVC_TYPE_PRIMARY if service.primary
+                                                           else const.BLE_GATTS_SRVC_TYPE_SECONDARY,
+                                                           service.uuid.to_c(self.backend),
+                                                           handle)
+        if err_code == const.NRF_SUCCESS:
+            service.handle = self.driver.uint16_value(handle)
+        return err_code
+
+
+    @NordicSemiAPICall
+    def ble_gatts_characteristic_add(self, service_handle, char):
+        assert isinstance(char, BLEGattsCharacteristic), 'Invalid argument type'
+        (char_md, attr_char_value)  = char.to_c(self.backend)
+        handles                     = self.driver.ble_gatts_char_handles_t()
+        err_code                    = self.driver.sd_ble_gatts_characteristic_add(self.rpc_adapter,
+                                                                                  service_handle,
+                                                                                  char_md,
+                                                                                  attr_char_value,
+                                                                                  handles)
+        if err_code == const.NRF_SUCCESS:
+            char.handles = BLEGattsCharHandles.from_c(handles)
+        return err_code
+
+
+    @NordicSemiAPICall
+    def ble_gatts_value_set(self, conn_handle, handle, data, offset = 0):
+        data_array      = util.list_to_uint8_array(self.driver, data)
+        value           = self.driver.ble_gatts_value_t()
+        value.len       = len(data)
+        value.offset    = offset
+        value.p_value   = data_array.cast()
+        return self.driver.sd_ble_gatts_value_set(self.rpc_adapter,
+                                                  conn_handle,
+                                                  handle,
+                                                  value)
+
+
+    @NordicSemiAPICall
+    def ble_gatts_hvx(self, conn_handle, hvx_params):
+        assert isinstance(hvx_params, BLEGattsHVXParams), 'Invalid argument type'
+        err_code = self.driver.sd_ble_gatts_hvx(self.rpc_adapter,
+                                                conn_handle,
+                                                hvx_params.to_c(self.backend))
+        # Indications complete with a confirmation, not a TX complete event
+        if err_code == const.NRF_SUCCESS and hvx_params.hvx_type == BLEGattHVXType.notification:
+            self.tx_in_flight_update(conn_handle, 1)
+        return err_code
+
+
+    @NordicSemiAPICall
+    def ble_gatts_sys_attr_set(self, conn_handle, sys_attr_data = None, flags = 0):
+        if sys_attr_data:
+            data_array = util.list_to_uint8_array(self.driver, sys_attr_data)
+            return self.driver.sd_ble_gatts_sys_attr_set(self.rpc_adapter,
+                                                         conn_handle,
+                                                         data_array.cast(),
+                                                         len(sys_attr_data),
+                                                         flags)
+        return self.driver.sd_ble_gatts_sys_attr_set(self.rpc_adapter, conn_handle, None, 0, flags)
+
+
+    @NordicSemiAPICall
+    def ble_tx_packet_count_get(self, conn_handle):
+        """Read the number of application TX buffers of conn_handle into tx_packet_counts."""
+        count       = self.driver.new_uint8()
+        err_code    = self.driver.sd_ble_tx_packet_count_get(self.rpc_adapter, conn_handle, count)
+        if err_code == const.NRF_SUCCESS:
+            self.tx_packet_counts[conn_handle] = self.driver.uint8_value(count)
+        return err_code
+
+
+    @NordicSemiAPICall
     def ble_gattc_prim_srvc_disc(self, conn_handle, srvc_uuid, start_handle):
         assert isinstance(srvc_uuid, (BLEUUID, NoneType)), 'Invalid argument type'
-        return driver.sd_ble_gattc_primary_services_discover(self.rpc_adapter,
-                                                             conn_handle,
-                                                             start_handle,
-                                                             srvc_uuid.to_c() if srvc_uuid else None)
+        return self.driver.sd_ble_gattc_primary_services_discover(self.rpc_adapter,
+                                                                  conn_handle,
+                                                                  start_handle,
+                                                                  srvc_uuid.to_c(self.backend) if srvc_uuid else None)
 
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def ble_gattc_char_disc(self, conn_handle, start_handle, end_handle):
-        handle_range                = driver.ble_gattc_handle_range_t()
+        handle_range                = self.driver.ble_gattc_handle_range_t()
         handle_range.start_handle   = start_handle
         handle_range.end_handle     = end_handle
-        return driver.sd_ble_gattc_characteristics_discover(self.rpc_adapter,
-                                                            conn_handle,
-                                                            handle_range)
+        return self.driver.sd_ble_gattc_characteristics_discover(self.rpc_adapter,
+                                                                 conn_handle,
+                                                                 handle_range)
 
 
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @NordicSemiAPICall
     def ble_gattc_desc_disc(self, conn_handle, start_handle, end_handle):
-        handle_range                = driver.ble_gattc_handle_range_t()
+        handle_range                = self.driver.ble_gattc_handle_range_t()
         handle_range.start_handle   = start_handle
         handle_range.end_handle     = end_handle
-        return driver.sd_ble_gattc_descriptors_discover(self.rpc_adapter,
-                                                        conn_handle,
-                                                        handle_range)
-
-    @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
-    def ble_gattc_exchange_mtu_req(self, conn_handle):
-        logger.debug('Sending GATTC MTU exchange request: {}'.format(self.ble_enable_params.att_mtu))
-        return driver.sd_ble_gattc_exchange_mtu_request(self.rpc_adapter,
-                                                        conn_handle,
-                                                        self.ble_enable_params.att_mtu)
+        return self.driver.sd_ble_gattc_descriptors_discover(self.rpc_adapter,
+                                                             conn_handle,
+                                                             handle_range)
+
+    @NordicSemiAPICall
+    def ble_gattc_exchange_mtu_req(self, conn_handle, att_mtu = None):
+        # The client RX MTU defaults to, and cannot exceed, the one given to ble_enable
+        if att_mtu is None:
+            att_mtu = self.ble_enable_params.att_mtu
+        assert ATT_MTU_DEFAULT <= att_mtu <= self.ble_enable_params.att_mtu, 'Invalid ATT MTU'
+        logger.debug('Sending GATTC MTU exchange request: {}'.format(att_mtu))
+        self.att_mtu_requests[conn_handle] = att_mtu
+        return self.driver.sd_ble_gattc_exchange_mtu_request(self.rpc_adapter,
+                                                             conn_handle,
+                                                             att_mtu)
 
 
     def status_handler(self, adapter, status_code, status_message):
@@ -1238,15 +2264,33 @@ class BLEDriver(object):
 
 
     def ble_evt_handler(self, adapter, ble_event):
+        # Events of one adapter are delivered in order from a single native thread
+        self.evt_thread_id = thread.get_ident()
         self.sync_ble_evt_handler(adapter, ble_event)
 
 
-    @wrapt.synchronized(observer_lock)
+    def adv_report_dispatch(self, conn_handle, reports):
+        for (peer_addr, rssi, adv_type, adv_data) in reports:
+            self.observers_notify('on_gap_evt_adv_report',
+                                  ble_driver    = self,
+                                  conn_handle   = conn_handle,
+                                  peer_addr     = peer_addr,
+                                  rssi          = rssi,
+                                  adv_type      = adv_type,
+                                  adv_data      = adv_data)
+
+
     def sync_ble_evt_handler(self, adapter, ble_event):
-        evt_id = None
+        evt_id  = None
+        metered = metrics.registry.enabled
+        if metered:
+            t_start             = time.time()
+            self.callback_time  = 0.0
+        if tracer.enabled:
+            # All event structs start with the connection handle
+            tracer.record(TRACE_EVT, ble_event.evt.gap_evt.conn_handle, ble_event.header.evt_id)
         try:
             evt_id = BLEEvtID(ble_event.header.evt_id)
-            logger.debug('Received event: ' + str(evt_id))
         except:
             logger.error('Invalid received BLE event id: 0x{:02X}'.format(ble_event.header.evt_id))
             return
@@ -1254,53 +2298,64 @@ class BLEDriver(object):
             if evt_id == BLEEvtID.gap_evt_connected:
                 connected_evt = ble_event.evt.gap_evt.params.connected
 
-                for obs in self.observers:
-                    obs.on_gap_evt_connected(ble_driver     = self,
-                                             conn_handle    = ble_event.evt.gap_evt.conn_handle,
-                                             peer_addr      = BLEGapAddr.from_c(connected_evt.peer_addr),
-                                             role           = BLEGapRoles(connected_evt.role),
-                                             conn_params    = BLEGapConnParams.from_c(connected_evt.conn_params))
+                self.observers_notify('on_gap_evt_connected',
+                                      ble_driver     = self,
+                                      conn_handle    = ble_event.evt.gap_evt.conn_handle,
+                                      peer_addr      = BLEGapAddr.from_c(connected_evt.peer_addr),
+                                      role           = BLEGapRoles(connected_evt.role),
+                                      conn_params    = BLEGapConnParams.from_c(connected_evt.conn_params))
 
             elif evt_id == BLEEvtID.gap_evt_disconnected:
                 disconnected_evt = ble_event.evt.gap_evt.params.disconnected
-
-                for obs in self.observers:
-                    obs.on_gap_evt_disconnected(ble_driver  = self,
-                                                conn_handle = ble_event.evt.gap_evt.conn_handle,
-                                                reason      = BLEHci(disconnected_evt.reason))
+                self.tx_in_flight.pop(ble_event.evt.gap_evt.conn_handle, None)
+                self.tx_packet_counts.pop(ble_event.evt.gap_evt.conn_handle, None)
+                self.data_lengths.pop(ble_event.evt.gap_evt.conn_handle, None)
+                self.att_mtu_requests.pop(ble_event.evt.gap_evt.conn_handle, None)
+                self.sec_keysets.pop(ble_event.evt.gap_evt.conn_handle, None)
+                self.sec_keys.pop(ble_event.evt.gap_evt.conn_handle, None)
+                if metrics.registry.enabled:
+                    metrics.tx_packets_in_flight.remove(self.serial_port, ble_event.evt.gap_evt.conn_handle)
+
+                self.observers_notify('on_gap_evt_disconnected',
+                                      ble_driver  = self,
+                                      conn_handle = ble_event.evt.gap_evt.conn_handle,
+                                      reason      = BLEHci(disconnected_evt.reason))
 
             elif evt_id == BLEEvtID.gap_evt_sec_params_request:
                 sec_params_request_evt = ble_event.evt.gap_evt.params.sec_params_request
 
-                for obs in self.observers:
-                    obs.on_gap_evt_sec_params_request(ble_driver  = self,
-                                                      conn_handle = ble_event.evt.gap_evt.conn_handle,
-                                                      peer_params = BLEGapSecParams.from_c(sec_params_request_evt.peer_params))
+                self.observers_notify('on_gap_evt_sec_params_request',
+                                      ble_driver  = self,
+                                      conn_handle = ble_event.evt.gap_evt.conn_handle,
+                                      peer_params = BLEGapSecParams.from_c(sec_params_request_evt.peer_params))
 
             elif evt_id == BLEEvtID.gap_evt_lesc_dhkey_request:
                 lesc_dhkey_request_evt = ble_event.evt.gap_evt.params.lesc_dhkey_request
 
-                for obs in self.observers:
-                    obs.on_gap_evt_lesc_dhkey_request(ble_driver  = self,
-                                                      conn_handle = ble_event.evt.gap_evt.conn_handle,
-                                                      p_pk_peer   = BLEGapLESCp256pk.from_c(lesc_dhkey_request_evt.p_pk_peer))
+                self.observers_notify('on_gap_evt_lesc_dhkey_request',
+                                      ble_driver  = self,
+                                      conn_handle = ble_event.evt.gap_evt.conn_handle,
+                                      p_pk_peer   = BLEGapLESCp256pk.from_c(lesc_dhkey_request_evt.p_pk_peer))
 
             elif evt_id == BLEEvtID.gap_evt_passkey_display:
                 passkey_display_evt = ble_event.evt.gap_evt.params.passkey_display
 
-                for obs in self.observers:
-                    obs.on_gap_evt_passkey_display(ble_driver    = self,
-                                                   conn_handle   = ble_event.evt.gap_evt.conn_handle,
-                                                   match_request = passkey_display_evt.match_request,
-                                                   passkey       = util.uint8_array_to_list(passkey_display_evt.passkey, 6))
+                self.observers_notify('on_gap_evt_passkey_display',
+                                      ble_driver    = self,
+                                      conn_handle   = ble_event.evt.gap_evt.conn_handle,
+                                      match_request = passkey_display_evt.match_request,
+                                      passkey       = util.uint8_array_to_list(passkey_display_evt.passkey, 6))
 
             elif evt_id == BLEEvtID.gap_evt_timeout:
                 timeout_evt = ble_event.evt.gap_evt.params.timeout
 
-                for obs in self.observers:
-                    obs.on_gap_evt_timeout(ble_driver   = self,
-                                           conn_handle  = ble_event.evt.gap_evt.conn_handle,
-                                           src          = BLEGapTimeoutSrc(timeout_evt.src))
+                if self.adv_report_merger and (timeout_evt.src == BLEGapTimeoutSrc.scan.value):
+                    self.adv_report_dispatch(ble_event.evt.gap_evt.conn_handle, self.adv_report_merger.flush())
+
+                self.observers_notify('on_gap_evt_timeout',
+                                      ble_driver   = self,
+                                      conn_handle  = ble_event.evt.gap_evt.conn_handle,
+                                      src          = BLEGapTimeoutSrc(timeout_evt.src))
 
             elif evt_id == BLEEvtID.gap_evt_adv_report:
                 adv_report_evt  = ble_event.evt.gap_evt.params.adv_report
@@ -1308,135 +2363,198 @@ class BLEDriver(object):
                 if not adv_report_evt.scan_rsp:
                     adv_type = BLEGapAdvType(adv_report_evt.type)
 
-                for obs in self.observers:
-                    obs.on_gap_evt_adv_report(ble_driver    = self,
-                                              conn_handle   = ble_event.evt.gap_evt.conn_handle,
-                                              peer_addr     = BLEGapAddr.from_c(adv_report_evt.peer_addr),
-                                              rssi          = adv_report_evt.rssi,
-                                              adv_type      = adv_type,
-                                              adv_data      = BLEAdvData.from_c(adv_report_evt))
+                report = (BLEGapAddr.from_c(adv_report_evt.peer_addr),
+                          adv_report_evt.rssi,
+                          adv_type,
+                          BLEAdvData.from_c(adv_report_evt))
+
+                if self.adv_report_merger and self.scan_params and self.scan_params.active:
+                    reports = self.adv_report_merger.adv_report(*report)
+                else:
+                    reports = [report]
+
+                self.adv_report_dispatch(ble_event.evt.gap_evt.conn_handle, reports)
 
             elif evt_id == BLEEvtID.gap_evt_conn_param_update_request:
                 conn_params = ble_event.evt.gap_evt.params.conn_param_update_request.conn_params
 
-                for obs in self.observers:
-                    obs.on_gap_evt_conn_param_update_request(ble_driver   = self,
-                                                             conn_handle  = ble_event.evt.common_evt.conn_handle,
-                                                             conn_params  = BLEGapConnParams.from_c(conn_params))
+                self.observers_notify('on_gap_evt_conn_param_update_request',
+                                      ble_driver   = self,
+                                      conn_handle  = ble_event.evt.common_evt.conn_handle,
+                                      conn_params  = BLEGapConnParams.from_c(conn_params))
+
+            elif evt_id == BLEEvtID.gap_evt_conn_param_update:
+                conn_params = ble_event.evt.gap_evt.params.conn_param_update.conn_params
+
+                self.observers_notify('on_gap_evt_conn_param_update',
+                                      ble_driver   = self,
+                                      conn_handle  = ble_event.evt.common_evt.conn_handle,
+                                      conn_params  = BLEGapConnParams.from_c(conn_params))
 
             elif evt_id == BLEEvtID.gap_evt_auth_status:
                 auth_status_evt = ble_event.evt.gap_evt.params.auth_status
+                self.sec_keys_update(ble_event.evt.common_evt.conn_handle, auth_status_evt)
 
-                for obs in self.observers:
-                    obs.on_gap_evt_auth_status(ble_driver   = self,
-                                               conn_handle  = ble_event.evt.common_evt.conn_handle,
-                                               auth_status  = BLEGapSecStatus(auth_status_evt.auth_status))
+                self.observers_notify('on_gap_evt_auth_status',
+                                      ble_driver   = self,
+                                      conn_handle  = ble_event.evt.common_evt.conn_handle,
+                                      auth_status  = BLEGapSecStatus(auth_status_evt.auth_status))
 
             elif evt_id == BLEEvtID.gap_evt_conn_sec_update:
                 conn_sec_update_evt = ble_event.evt.gap_evt.params.conn_sec_update
 
-                for obs in self.observers:
-                    obs.on_gap_evt_conn_sec_update(ble_driver   = self,
-                                                   conn_handle  = ble_event.evt.common_evt.conn_handle)
+                self.observers_notify('on_gap_evt_conn_sec_update',
+                                      ble_driver   = self,
+                                      conn_handle  = ble_event.evt.common_evt.conn_handle)
+                # Separate callback, so observers of the one above keep their signature
+                self.observers_notify('on_conn_sec_updated',
+                                      ble_driver   = self,
+                                      conn_handle  = ble_event.evt.common_evt.conn_handle,
+                                      conn_sec     = BLEGapConnSec.from_c(conn_sec_update_evt.conn_sec))
 
             elif evt_id == BLEEvtID.evt_tx_complete:
                 tx_complete_evt = ble_event.evt.common_evt.params.tx_complete
+                self.tx_in_flight_update(ble_event.evt.common_evt.conn_handle, -tx_complete_evt.count)
 
-                for obs in self.observers:
-                    obs.on_evt_tx_complete(ble_driver   = self,
-                                           conn_handle  = ble_event.evt.common_evt.conn_handle,
-                                           count        = tx_complete_evt.count)
+                self.observers_notify('on_evt_tx_complete',
+                                      ble_driver   = self,
+                                      conn_handle  = ble_event.evt.common_evt.conn_handle,
+                                      count        = tx_complete_evt.count)
 
             elif evt_id == BLEEvtID.gattc_evt_write_rsp:
                 write_rsp_evt   = ble_event.evt.gattc_evt.params.write_rsp
 
-                for obs in self.observers:
-                    obs.on_gattc_evt_write_rsp(ble_driver   = self,
-                                               conn_handle  = ble_event.evt.gattc_evt.conn_handle,
-                                               status       = BLEGattStatusCode(ble_event.evt.gattc_evt.gatt_status),
-                                               error_handle = ble_event.evt.gattc_evt.error_handle,
-                                               attr_handle  = write_rsp_evt.handle,
-                                               write_op     = BLEGattWriteOperation(write_rsp_evt.write_op),
-                                               offset       = write_rsp_evt.offset,
-                                               data         = util.uint8_array_to_list(write_rsp_evt.data,
-                                                                                       write_rsp_evt.len))
+                self.observers_notify('on_gattc_evt_write_rsp',
+                                      ble_driver   = self,
+                                      conn_handle  = ble_event.evt.gattc_evt.conn_handle,
+                                      status       = BLEGattStatusCode(ble_event.evt.gattc_evt.gatt_status),
+                                      error_handle = ble_event.evt.gattc_evt.error_handle,
+                                      attr_handle  = write_rsp_evt.handle,
+                                      write_op     = BLEGattWriteOperation(write_rsp_evt.write_op),
+                                      offset       = write_rsp_evt.offset,
+                                      data         = util.uint8_array_to_list(write_rsp_evt.data,
+                                                                              write_rsp_evt.len))
 
             elif evt_id == BLEEvtID.gattc_evt_read_rsp:
                 read_rsp_evt   = ble_event.evt.gattc_evt.params.read_rsp
-                logger.debug('GATTC: READ RSP')
-                for obs in self.observers:
-                    obs.on_gattc_evt_read_rsp(ble_driver   = self,
-                                               conn_handle  = ble_event.evt.gattc_evt.conn_handle,
-                                               status       = BLEGattStatusCode(ble_event.evt.gattc_evt.gatt_status),
-                                               error_handle = ble_event.evt.gattc_evt.error_handle,
-                                               attr_handle  = read_rsp_evt.handle,
-                                               offset       = read_rsp_evt.offset,
-                                               data         = util.uint8_array_to_list(read_rsp_evt.data,
-                                                                                       read_rsp_evt.len))
+                self.observers_notify('on_gattc_evt_read_rsp',
+                                      ble_driver   = self,
+                                       conn_handle  = ble_event.evt.gattc_evt.conn_handle,
+                                       status       = BLEGattStatusCode(ble_event.evt.gattc_evt.gatt_status),
+                                       error_handle = ble_event.evt.gattc_evt.error_handle,
+                                       attr_handle  = read_rsp_evt.handle,
+                                       offset       = read_rsp_evt.offset,
+                                       data         = util.uint8_array_to_list(read_rsp_evt.data,
+                                                                               read_rsp_evt.len))
 
             elif evt_id == BLEEvtID.gattc_evt_hvx:
                 hvx_evt = ble_event.evt.gattc_evt.params.hvx
-
-                for obs in self.observers:
-                    obs.on_gattc_evt_hvx(ble_driver     = self,
-                                         conn_handle    = ble_event.evt.gattc_evt.conn_handle,
-                                         status         = BLEGattStatusCode(ble_event.evt.gattc_evt.gatt_status),
-                                         error_handle   = ble_event.evt.gattc_evt.error_handle,
-                                         attr_handle    = hvx_evt.handle,
-                                         hvx_type       = BLEGattHVXType(hvx_evt.type),
-                                         data           = util.uint8_array_to_list(hvx_evt.data, hvx_evt.len))
+                data    = util.uint8_array_to_list(hvx_evt.data, hvx_evt.len)
+                if tracer.enabled:
+                    tracer.record(TRACE_HVX, ble_event.evt.gattc_evt.conn_handle, hvx_evt.handle, bytes(bytearray(data)))
+
+                self.observers_notify('on_gattc_evt_hvx',
+                                      ble_driver     = self,
+                                      conn_handle    = ble_event.evt.gattc_evt.conn_handle,
+                                      status         = BLEGattStatusCode(ble_event.evt.gattc_evt.gatt_status),
+                                      error_handle   = ble_event.evt.gattc_evt.error_handle,
+                                      attr_handle    = hvx_evt.handle,
+                                      hvx_type       = BLEGattHVXType(hvx_evt.type),
+                                      data           = data)
 
             elif evt_id == BLEEvtID.gattc_evt_prim_srvc_disc_rsp:
                 prim_srvc_disc_rsp_evt = ble_event.evt.gattc_evt.params.prim_srvc_disc_rsp
 
                 services = list()
-                for s in util.service_array_to_list(prim_srvc_disc_rsp_evt.services, prim_srvc_disc_rsp_evt.count):
-                    services.append(BLEService.from_c(s))
+                for s in util.service_array_to_list(self.driver, prim_srvc_disc_rsp_evt.services, prim_srvc_disc_rsp_evt.count):
+                    services.append(BLEService.from_c(s, self))
 
-                for obs in self.observers:
-                    obs.on_gattc_evt_prim_srvc_disc_rsp(ble_driver  = self,
-                                                        conn_handle = ble_event.evt.gattc_evt.conn_handle,
-                                                        status      = BLEGattStatusCode(ble_event.evt.gattc_evt.gatt_status),
-                                                        services    = services)
+                self.observers_notify('on_gattc_evt_prim_srvc_disc_rsp',
+                                      ble_driver  = self,
+                                      conn_handle = ble_event.evt.gattc_evt.conn_handle,
+                                      status      = BLEGattStatusCode(ble_event.evt.gattc_evt.gatt_status),
+                                      services    = services)
 
             elif evt_id == BLEEvtID.gattc_evt_char_disc_rsp:
                 char_disc_rsp_evt = ble_event.evt.gattc_evt.params.char_disc_rsp
 
                 characteristics = list()
-                for ch in util.ble_gattc_char_array_to_list(char_disc_rsp_evt.chars, char_disc_rsp_evt.count):
-                    characteristics.append(BLECharacteristic.from_c(ch))
+                for ch in util.ble_gattc_char_array_to_list(self.driver, char_disc_rsp_evt.chars, char_disc_rsp_evt.count):
+                    characteristics.append(BLECharacteristic.from_c(ch, self))
 
-                for obs in self.observers:
-                    obs.on_gattc_evt_char_disc_rsp(ble_driver       = self,
-                                                   conn_handle      = ble_event.evt.gattc_evt.conn_handle,
-                                                   status           = BLEGattStatusCode(ble_event.evt.gattc_evt.gatt_status),
-                                                   characteristics  = characteristics)
+                self.observers_notify('on_gattc_evt_char_disc_rsp',
+                                      ble_driver       = self,
+                                      conn_handle      = ble_event.evt.gattc_evt.conn_handle,
+                                      status           = BLEGattStatusCode(ble_event.evt.gattc_evt.gatt_status),
+                                      characteristics  = characteristics)
 
             elif evt_id == BLEEvtID.gattc_evt_desc_disc_rsp:
                 desc_disc_rsp_evt = ble_event.evt.gattc_evt.params.desc_disc_rsp
 
                 descriptions = list()
-                for d in util.desc_array_to_list(desc_disc_rsp_evt.descs, desc_disc_rsp_evt.count):
-                    descriptions.append(BLEDescriptor.from_c(d))
-
-                for obs in self.observers:
-                    obs.on_gattc_evt_desc_disc_rsp(ble_driver   = self,
-                                                   conn_handle  = ble_event.evt.gattc_evt.conn_handle,
-                                                   status       = BLEGattStatusCode(ble_event.evt.gattc_evt.gatt_status),
-                                                   descriptions = descriptions)
-
-            elif nrf_sd_ble_api_ver >= 3:
-                    if evt_id == BLEEvtID.gatts_evt_exchange_mtu_request:
+                for d in util.desc_array_to_list(self.driver, desc_disc_rsp_evt.descs, desc_disc_rsp_evt.count):
+                    descriptions.append(BLEDescriptor.from_c(d, self))
+
+                self.observers_notify('on_gattc_evt_desc_disc_rsp',
+                                      ble_driver   = self,
+                                      conn_handle  = ble_event.evt.gattc_evt.conn_handle,
+                                      status       = BLEGattStatusCode(ble_event.evt.gattc_evt.gatt_status),
+                                      descriptions = descriptions)
+
+            elif evt_id == BLEEvtID.gatts_evt_write:
+                write_evt = ble_event.evt.gatts_evt.params.write
+
+                self.observers_notify('on_gatts_evt_write',
+                                      ble_driver    = self,
+                                      conn_handle   = ble_event.evt.gatts_evt.conn_handle,
+                                      attr_handle   = write_evt.handle,
+                                      uuid          = BLEUUID.from_c(write_evt.uuid, self),
+                                      op            = BLEGattsWriteOperation(write_evt.op),
+                                      auth_required = bool(write_evt.auth_required),
+                                      offset        = write_evt.offset,
+                                      data          = util.uint8_array_to_list(write_evt.data, write_evt.len))
+
+            elif evt_id == BLEEvtID.gatts_evt_sys_attr_missing:
+                sys_attr_missing_evt = ble_event.evt.gatts_evt.params.sys_attr_missing
+
+                self.observers_notify('on_gatts_evt_sys_attr_missing',
+                                      ble_driver    = self,
+                                      conn_handle   = ble_event.evt.gatts_evt.conn_handle,
+                                      hint          = sys_attr_missing_evt.hint)
+
+            elif evt_id == BLEEvtID.gatts_evt_hvc:
+                hvc_evt = ble_event.evt.gatts_evt.params.hvc
+
+                self.observers_notify('on_gatts_evt_hvc',
+                                      ble_driver    = self,
+                                      conn_handle   = ble_event.evt.gatts_evt.conn_handle,
+                                      attr_handle   = hvc_evt.handle)
+
+            elif self.backend.sd_api_ver >= 3:
+                    if evt_id == BLEEvtID.evt_data_length_changed:
+                        data_length_changed_evt = ble_event.evt.common_evt.params.data_length_changed
+                        self.data_lengths[ble_event.evt.common_evt.conn_handle] = (data_length_changed_evt.max_tx_octets,
+                                                                                   data_length_changed_evt.max_rx_octets)
+
+                        self.observers_notify('on_evt_data_length_changed',
+                                              ble_driver     = self,
+                                              conn_handle    = ble_event.evt.common_evt.conn_handle,
+                                              max_tx_octets  = data_length_changed_evt.max_tx_octets,
+                                              max_tx_time    = data_length_changed_evt.max_tx_time,
+                                              max_rx_octets  = data_length_changed_evt.max_rx_octets,
+                                              max_rx_time    = data_length_changed_evt.max_rx_time)
+
+                    elif evt_id == BLEEvtID.gatts_evt_exchange_mtu_request:
                         xchg_mtu_evt = ble_event.evt.gatts_evt.params.exchange_mtu_request
-                        driver.sd_ble_gatts_exchange_mtu_reply(self.rpc_adapter, ble_event.evt.gatts_evt.conn_handle, self.ble_enable_params.att_mtu)
+                        self.driver.sd_ble_gatts_exchange_mtu_reply(self.rpc_adapter, ble_event.evt.gatts_evt.conn_handle, self.ble_enable_params.att_mtu)
 
                         _att_mtu = min(xchg_mtu_evt.client_rx_mtu, self.ble_enable_params.att_mtu)
                         logger.debug('GATTS: ATT MTU: {}'.format(_att_mtu))
 
-                        for obs in self.observers:
-                            obs.on_att_mtu_exchanged(ble_driver     = self,
-                                                     conn_handle    = ble_event.evt.gatts_evt.conn_handle,
-                                                     att_mtu        = _att_mtu)
+                        self.observers_notify('on_att_mtu_exchanged',
+                                              ble_driver     = self,
+                                              conn_handle    = ble_event.evt.gatts_evt.conn_handle,
+                                              att_mtu        = _att_mtu)
 
                     elif evt_id == BLEEvtID.gattc_evt_exchange_mtu_rsp:
                         xchg_mtu_evt = ble_event.evt.gattc_evt.params.exchange_mtu_rsp
@@ -1448,18 +2566,20 @@ class BLEDriver(object):
                         else:
                             _server_rx_mtu = ATT_MTU_DEFAULT
 
-                        _att_mtu = min(_server_rx_mtu, self.ble_enable_params.att_mtu)
+                        _client_rx_mtu = self.att_mtu_requests.pop(ble_event.evt.gattc_evt.conn_handle,
+                                                                   self.ble_enable_params.att_mtu)
+                        _att_mtu = min(_server_rx_mtu, _client_rx_mtu)
                         logger.debug('GATTC: ATT MTU: {}'.format(_att_mtu))
 
-                        for obs in self.observers:
-                            obs.on_att_mtu_exchanged(ble_driver     = self,
-                                                     conn_handle    = ble_event.evt.gatts_evt.conn_handle,
-                                                     att_mtu        = _att_mtu)
-                        for obs in self.observers:
-                            obs.on_gattc_evt_exchange_mtu_rsp(ble_driver     = self,
-                                                              conn_handle    = ble_event.evt.gatts_evt.conn_handle,
-                                                              status         = _status,
-                                                              att_mtu        = _att_mtu)
+                        self.observers_notify('on_att_mtu_exchanged',
+                                              ble_driver     = self,
+                                              conn_handle    = ble_event.evt.gattc_evt.conn_handle,
+                                              att_mtu        = _att_mtu)
+                        self.observers_notify('on_gattc_evt_exchange_mtu_rsp',
+                                              ble_driver     = self,
+                                              conn_handle    = ble_event.evt.gattc_evt.conn_handle,
+                                              status         = _status,
+                                              att_mtu        = _att_mtu)
 
 
         except Exception as e:
@@ -1467,3 +2587,8 @@ class BLEDriver(object):
             for line in traceback.extract_tb(sys.exc_info()[2]):
                 logger.error(line) 
             logger.error("") 
+
+        if metered:
+            elapsed = time.time() - t_start
+            metrics.events_received.labels(self.serial_port, evt_id.name).inc()
+            metrics.event_decode_seconds.labels(self.serial_port, evt_id.name).observe(elapsed - self.callback_time)
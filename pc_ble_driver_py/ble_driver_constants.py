@@ -0,0 +1,221 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+# SoftDevice constants used by ble_driver, so that the Enum tables can be built
+# without loading the shared library. Values are the same for SoftDevice API v2
+# and v3 unless marked otherwise.
+
+BLE_COMMON_OPT_CONN_BW                                  = 1
+BLE_COMMON_OPT_CONN_EVT_EXT                             = 3  # SoftDevice API v3 only
+BLE_CONN_BW_HIGH                                        = 3
+BLE_CONN_BW_LOW                                         = 1
+BLE_CONN_BW_MID                                         = 2
+BLE_CONN_HANDLE_INVALID                                 = 0xFFFF
+BLE_EVT_DATA_LENGTH_CHANGED                             = 4  # SoftDevice API v3 only
+BLE_EVT_TX_COMPLETE                                     = 1
+BLE_GAP_ADDR_LEN                                        = 6
+BLE_GAP_ADDR_TYPE_PUBLIC                                = 0
+BLE_GAP_ADDR_TYPE_RANDOM_PRIVATE_NON_RESOLVABLE         = 3
+BLE_GAP_ADDR_TYPE_RANDOM_PRIVATE_RESOLVABLE             = 2
+BLE_GAP_ADDR_TYPE_RANDOM_STATIC                         = 1
+BLE_GAP_ADV_FP_ANY                                      = 0
+BLE_GAP_ADV_TYPE_ADV_DIRECT_IND                         = 1
+BLE_GAP_ADV_TYPE_ADV_IND                                = 0
+BLE_GAP_ADV_TYPE_ADV_NONCONN_IND                        = 3
+BLE_GAP_ADV_TYPE_ADV_SCAN_IND                           = 2
+BLE_GAP_AD_TYPE_128BIT_SERVICE_UUID_COMPLETE            = 7
+BLE_GAP_AD_TYPE_128BIT_SERVICE_UUID_MORE_AVAILABLE      = 6
+BLE_GAP_AD_TYPE_16BIT_SERVICE_UUID_COMPLETE             = 3
+BLE_GAP_AD_TYPE_16BIT_SERVICE_UUID_MORE_AVAILABLE       = 2
+BLE_GAP_AD_TYPE_32BIT_SERVICE_UUID_COMPLETE             = 5
+BLE_GAP_AD_TYPE_32BIT_SERVICE_UUID_MORE_AVAILABLE       = 4
+BLE_GAP_AD_TYPE_3D_INFORMATION_DATA                     = 0x3D
+BLE_GAP_AD_TYPE_ADVERTISING_INTERVAL                    = 0x1A
+BLE_GAP_AD_TYPE_APPEARANCE                              = 0x19
+BLE_GAP_AD_TYPE_CLASS_OF_DEVICE                         = 0x0D
+BLE_GAP_AD_TYPE_COMPLETE_LOCAL_NAME                     = 9
+BLE_GAP_AD_TYPE_FLAGS                                   = 1
+BLE_GAP_AD_TYPE_LE_BLUETOOTH_DEVICE_ADDRESS             = 0x1B
+BLE_GAP_AD_TYPE_LE_ROLE                                 = 0x1C
+BLE_GAP_AD_TYPE_MANUFACTURER_SPECIFIC_DATA              = 0xFF
+BLE_GAP_AD_TYPE_PUBLIC_TARGET_ADDRESS                   = 0x17
+BLE_GAP_AD_TYPE_RANDOM_TARGET_ADDRESS                   = 0x18
+BLE_GAP_AD_TYPE_SECURITY_MANAGER_OOB_FLAGS              = 0x11
+BLE_GAP_AD_TYPE_SECURITY_MANAGER_TK_VALUE               = 0x10
+BLE_GAP_AD_TYPE_SERVICE_DATA                            = 0x16
+BLE_GAP_AD_TYPE_SERVICE_DATA_128BIT_UUID                = 0x21
+BLE_GAP_AD_TYPE_SERVICE_DATA_32BIT_UUID                 = 0x20
+BLE_GAP_AD_TYPE_SHORT_LOCAL_NAME                        = 8
+BLE_GAP_AD_TYPE_SIMPLE_PAIRING_HASH_C                   = 0x0E
+BLE_GAP_AD_TYPE_SIMPLE_PAIRING_HASH_C256                = 0x1D
+BLE_GAP_AD_TYPE_SIMPLE_PAIRING_RANDOMIZER_R             = 0x0F
+BLE_GAP_AD_TYPE_SIMPLE_PAIRING_RANDOMIZER_R256          = 0x1E
+BLE_GAP_AD_TYPE_SLAVE_CONNECTION_INTERVAL_RANGE         = 0x12
+BLE_GAP_AD_TYPE_SOLICITED_SERVICE_UUIDS_128BIT          = 0x15
+BLE_GAP_AD_TYPE_SOLICITED_SERVICE_UUIDS_16BIT           = 0x14
+BLE_GAP_AD_TYPE_TX_POWER_LEVEL                          = 0x0A
+BLE_GAP_AD_TYPE_URI                                     = 0x24
+BLE_GAP_AUTH_KEY_TYPE_NONE                              = 0
+BLE_GAP_AUTH_KEY_TYPE_PASSKEY                           = 1
+BLE_GAP_EVT_ADV_REPORT                                  = 0x1D
+BLE_GAP_EVT_AUTH_STATUS                                 = 0x19
+BLE_GAP_EVT_CONNECTED                                   = 0x10
+BLE_GAP_EVT_CONN_PARAM_UPDATE                           = 0x12
+BLE_GAP_EVT_CONN_PARAM_UPDATE_REQUEST                   = 0x1F
+BLE_GAP_EVT_CONN_SEC_UPDATE                             = 0x1A
+BLE_GAP_EVT_DISCONNECTED                                = 0x11
+BLE_GAP_EVT_LESC_DHKEY_REQUEST                          = 0x18
+BLE_GAP_EVT_PASSKEY_DISPLAY                             = 0x15
+BLE_GAP_EVT_SEC_PARAMS_REQUEST                          = 0x13
+BLE_GAP_EVT_TIMEOUT                                     = 0x1B
+BLE_GAP_IO_CAPS_DISPLAY_ONLY                            = 0
+BLE_GAP_IO_CAPS_DISPLAY_YESNO                           = 1
+BLE_GAP_IO_CAPS_KEYBOARD_DISPLAY                        = 4
+BLE_GAP_IO_CAPS_KEYBOARD_ONLY                           = 2
+BLE_GAP_IO_CAPS_NONE                                    = 3
+BLE_GAP_OPT_EXT_LEN                                     = 0x26  # SoftDevice API v3 only
+BLE_GAP_ROLE_CENTRAL                                    = 2
+BLE_GAP_ROLE_INVALID                                    = 0
+BLE_GAP_ROLE_PERIPH                                     = 1
+BLE_GAP_SEC_KEY_LEN                                     = 0x10
+BLE_GAP_SEC_RAND_LEN                                    = 8
+BLE_GAP_SEC_STATUS_AUTH_REQ                             = 0x83
+BLE_GAP_SEC_STATUS_BR_EDR_IN_PROG                       = 0x8D
+BLE_GAP_SEC_STATUS_CONFIRM_VALUE                        = 0x84
+BLE_GAP_SEC_STATUS_DHKEY_FAILURE                        = 0x8B
+BLE_GAP_SEC_STATUS_ENC_KEY_SIZE                         = 0x86
+BLE_GAP_SEC_STATUS_INVALID_PARAMS                       = 0x8A
+BLE_GAP_SEC_STATUS_NUM_COMP_FAILURE                     = 0x8C
+BLE_GAP_SEC_STATUS_OOB_NOT_AVAILABLE                    = 0x82
+BLE_GAP_SEC_STATUS_PAIRING_NOT_SUPP                     = 0x85
+BLE_GAP_SEC_STATUS_PASSKEY_ENTRY_FAILED                 = 0x81
+BLE_GAP_SEC_STATUS_PDU_INVALID                          = 2
+BLE_GAP_SEC_STATUS_REPEATED_ATTEMPTS                    = 0x89
+BLE_GAP_SEC_STATUS_SMP_CMD_UNSUPPORTED                  = 0x87
+BLE_GAP_SEC_STATUS_SUCCESS                              = 0
+BLE_GAP_SEC_STATUS_TIMEOUT                              = 1
+BLE_GAP_SEC_STATUS_UNSPECIFIED                          = 0x88
+BLE_GAP_SEC_STATUS_X_TRANS_KEY_DISALLOWED               = 0x8E
+BLE_GAP_TIMEOUT_SRC_ADVERTISING                         = 0
+BLE_GAP_TIMEOUT_SRC_CONN                                = 3
+BLE_GAP_TIMEOUT_SRC_SCAN                                = 2
+BLE_GAP_TIMEOUT_SRC_SECURITY_REQUEST                    = 1
+BLE_GAP_WHITELIST_ADDR_MAX_COUNT                        = 8
+BLE_GATTC_EVT_CHAR_DISC_RSP                             = 0x32
+BLE_GATTC_EVT_DESC_DISC_RSP                             = 0x33
+BLE_GATTC_EVT_EXCHANGE_MTU_RSP                          = 0x3A  # SoftDevice API v3 only
+BLE_GATTC_EVT_HVX                                       = 0x39
+BLE_GATTC_EVT_PRIM_SRVC_DISC_RSP                        = 0x30
+BLE_GATTC_EVT_READ_RSP                                  = 0x36
+BLE_GATTC_EVT_WRITE_RSP                                 = 0x38
+BLE_GATTS_ATTR_TAB_SIZE_DEFAULT                         = 0
+BLE_GATTS_EVT_EXCHANGE_MTU_REQUEST                      = 0x55  # SoftDevice API v3 only
+BLE_GATTS_EVT_HVC                                       = 0x53
+BLE_GATTS_EVT_SYS_ATTR_MISSING                          = 0x52
+BLE_GATTS_EVT_WRITE                                     = 0x50
+BLE_GATTS_OP_EXEC_WRITE_REQ_CANCEL                      = 5
+BLE_GATTS_OP_EXEC_WRITE_REQ_NOW                         = 6
+BLE_GATTS_OP_INVALID                                    = 0
+BLE_GATTS_OP_PREP_WRITE_REQ                             = 4
+BLE_GATTS_OP_SIGN_WRITE_CMD                             = 3
+BLE_GATTS_OP_WRITE_CMD                                  = 2
+BLE_GATTS_OP_WRITE_REQ                                  = 1
+BLE_GATTS_SRVC_TYPE_PRIMARY                             = 1
+BLE_GATTS_SRVC_TYPE_SECONDARY                           = 2
+BLE_GATTS_VLOC_STACK                                    = 1
+BLE_GATT_EXEC_WRITE_FLAG_PREPARED_CANCEL                = 0
+BLE_GATT_EXEC_WRITE_FLAG_PREPARED_WRITE                 = 1
+BLE_GATT_HVX_INDICATION                                 = 2
+BLE_GATT_HVX_INVALID                                    = 0
+BLE_GATT_HVX_NOTIFICATION                               = 1
+BLE_GATT_OP_EXEC_WRITE_REQ                              = 5
+BLE_GATT_OP_INVALID                                     = 0
+BLE_GATT_OP_PREP_WRITE_REQ                              = 4
+BLE_GATT_OP_SIGN_WRITE_CMD                              = 3
+BLE_GATT_OP_WRITE_CMD                                   = 2
+BLE_GATT_OP_WRITE_REQ                                   = 1
+BLE_GATT_STATUS_ATTERR_ATTRIBUTE_NOT_FOUND              = 0x10A
+BLE_GATT_STATUS_ATTERR_ATTRIBUTE_NOT_LONG               = 0x10B
+BLE_GATT_STATUS_ATTERR_INSUF_AUTHENTICATION             = 0x105
+BLE_GATT_STATUS_ATTERR_INSUF_AUTHORIZATION              = 0x108
+BLE_GATT_STATUS_ATTERR_INSUF_ENCRYPTION                 = 0x10F
+BLE_GATT_STATUS_ATTERR_INSUF_ENC_KEY_SIZE               = 0x10C
+BLE_GATT_STATUS_ATTERR_INSUF_RESOURCES                  = 0x111
+BLE_GATT_STATUS_ATTERR_INVALID                          = 0x100
+BLE_GATT_STATUS_ATTERR_INVALID_ATT_VAL_LENGTH           = 0x10D
+BLE_GATT_STATUS_ATTERR_INVALID_HANDLE                   = 0x101
+BLE_GATT_STATUS_ATTERR_INVALID_OFFSET                   = 0x107
+BLE_GATT_STATUS_ATTERR_INVALID_PDU                      = 0x104
+BLE_GATT_STATUS_ATTERR_PREPARE_QUEUE_FULL               = 0x109
+BLE_GATT_STATUS_ATTERR_READ_NOT_PERMITTED               = 0x102
+BLE_GATT_STATUS_ATTERR_REQUEST_NOT_SUPPORTED            = 0x106
+BLE_GATT_STATUS_ATTERR_UNLIKELY_ERROR                   = 0x10E
+BLE_GATT_STATUS_ATTERR_UNSUPPORTED_GROUP_TYPE           = 0x110
+BLE_GATT_STATUS_ATTERR_WRITE_NOT_PERMITTED              = 0x103
+BLE_GATT_STATUS_SUCCESS                                 = 0
+BLE_HCI_AUTHENTICATION_FAILURE                          = 5
+BLE_HCI_CONNECTION_TIMEOUT                              = 8
+BLE_HCI_CONN_FAILED_TO_BE_ESTABLISHED                   = 0x3E
+BLE_HCI_CONN_INTERVAL_UNACCEPTABLE                      = 0x3B
+BLE_HCI_CONN_TERMINATED_DUE_TO_MIC_FAILURE              = 0x3D
+BLE_HCI_CONTROLLER_BUSY                                 = 0x3A
+BLE_HCI_DIFFERENT_TRANSACTION_COLLISION                 = 0x2A
+BLE_HCI_DIRECTED_ADVERTISER_TIMEOUT                     = 0x3C
+BLE_HCI_INSTANT_PASSED                                  = 0x28
+BLE_HCI_LOCAL_HOST_TERMINATED_CONNECTION                = 0x16
+BLE_HCI_MEMORY_CAPACITY_EXCEEDED                        = 7
+BLE_HCI_PAIRING_WITH_UNIT_KEY_UNSUPPORTED               = 0x29
+BLE_HCI_REMOTE_DEV_TERMINATION_DUE_TO_LOW_RESOURCES     = 0x14
+BLE_HCI_REMOTE_DEV_TERMINATION_DUE_TO_POWER_OFF         = 0x15
+BLE_HCI_REMOTE_USER_TERMINATED_CONNECTION               = 0x13
+BLE_HCI_STATUS_CODE_COMMAND_DISALLOWED                  = 0x0C
+BLE_HCI_STATUS_CODE_INVALID_BTLE_COMMAND_PARAMETERS     = 0x12
+BLE_HCI_STATUS_CODE_INVALID_LMP_PARAMETERS              = 0x1E
+BLE_HCI_STATUS_CODE_LMP_PDU_NOT_ALLOWED                 = 0x24
+BLE_HCI_STATUS_CODE_LMP_RESPONSE_TIMEOUT                = 0x22
+BLE_HCI_STATUS_CODE_PIN_OR_KEY_MISSING                  = 6
+BLE_HCI_STATUS_CODE_SUCCESS                             = 0
+BLE_HCI_STATUS_CODE_UNKNOWN_BTLE_COMMAND                = 1
+BLE_HCI_STATUS_CODE_UNKNOWN_CONNECTION_IDENTIFIER       = 2
+BLE_HCI_STATUS_CODE_UNSPECIFIED_ERROR                   = 0x1F
+BLE_HCI_UNSUPPORTED_REMOTE_FEATURE                      = 0x1A
+BLE_UUID_TYPE_BLE                                       = 1
+GATT_MTU_SIZE_DEFAULT                                   = 0x17
+NRF_SUCCESS                                             = 0
+SD_RPC_FLOW_CONTROL_NONE                                = 0
+SD_RPC_MAXPATHLEN                                       = 0x200
+SD_RPC_PARITY_NONE                                      = 0
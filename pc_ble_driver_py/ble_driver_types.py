@@ -35,16 +35,7 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
-import importlib
-
-import config
-nrf_sd_ble_api_ver = config.sd_api_ver_get()
-# Load pc_ble_driver
-SWIG_MODULE_NAME = "pc_ble_driver_sd_api_v{}".format(nrf_sd_ble_api_ver)
-try:
-    ble_driver = importlib.import_module(SWIG_MODULE_NAME)
-except Exception:
-    print "Error. No ble_driver module found."
+import ctypes
 
 
 UNIT_0_625_MS = 625  # Unit used for scanning and advertising parameters
@@ -63,83 +54,85 @@ def units_to_msec(units, resolution):
     time_ms = units * float(resolution) / 1000
     return time_ms
 
+# Primitive arrays are read directly from memory and do not depend on the
+# SoftDevice API version. Struct arrays and all array constructors take the
+# SWIG module of the driver that owns the data as the first argument.
+
 def char_array_to_list(array_pointer, length):
     """Convert char_array to python list."""
-    data_array = ble_driver.char_array.frompointer(array_pointer)
-    data_list = _populate_list(data_array, length)
+    data_list = list(ctypes.string_at(int(array_pointer), length))
     return data_list
 
 def uint8_array_to_list(array_pointer, length):
     """Convert uint8_array to python list."""
-    data_array = ble_driver.uint8_array.frompointer(array_pointer)
-    data_list = _populate_list(data_array, length)
+    data_list = list(bytearray(ctypes.string_at(int(array_pointer), length)))
     return data_list
 
 
 def uint16_array_to_list(array_pointer, length):
     """Convert uint16_array to python list."""
-    data_array = ble_driver.uint16_array.frompointer(array_pointer)
-    data_list = _populate_list(data_array, length)
+    data_array = (ctypes.c_uint16 * length).from_address(int(array_pointer))
+    data_list = list(data_array)
     return data_list
 
 
-def service_array_to_list(array_pointer, length):
+def service_array_to_list(ble_driver, array_pointer, length):
     """Convert ble_gattc_service_array to python list."""
     data_array = ble_driver.ble_gattc_service_array.frompointer(array_pointer)
     data_list = _populate_list(data_array, length)
     return data_list
 
 
-def include_array_to_list(array_pointer, length):
+def include_array_to_list(ble_driver, array_pointer, length):
     """Convert ble_gattc_include_array to python list."""
     data_array = ble_driver.ble_gattc_include_array.frompointer(array_pointer)
     data_list = _populate_list(data_array, length)
     return data_list
 
 
-def ble_gattc_char_array_to_list(array_pointer, length):
+def ble_gattc_char_array_to_list(ble_driver, array_pointer, length):
     """Convert ble_gattc_char_array to python list."""
     data_array = ble_driver.ble_gattc_char_array.frompointer(array_pointer)
     data_list = _populate_list(data_array, length)
     return data_list
 
 
-def desc_array_to_list(array_pointer, length):
+def desc_array_to_list(ble_driver, array_pointer, length):
     """Convert ble_gattc_desc_array to python list."""
     data_array = ble_driver.ble_gattc_desc_array.frompointer(array_pointer)
     data_list = _populate_list(data_array, length)
     return data_list
 
 
-def handle_value_array_to_list(array_pointer, length):
+def handle_value_array_to_list(ble_driver, array_pointer, length):
     """Convert ble_gattc_handle_value_array to python list."""
     data_array = ble_driver.ble_gattc_handle_value_array.frompointer(array_pointer)
     data_list = _populate_list(data_array, length)
     return data_list
 
 
-def attr_info_array_to_list(array_pointer, length):
+def attr_info_array_to_list(ble_driver, array_pointer, length):
     """Convert ble_gattc_attr_info_array to python list."""
     data_array = ble_driver.ble_gattc_attr_info_array.frompointer(array_pointer)
     data_list = _populate_list(data_array, length)
     return data_list
 
 
-def attr_info16_array_to_list(array_pointer, length):
+def attr_info16_array_to_list(ble_driver, array_pointer, length):
     """Convert ble_gattc_attr_info16_array to python list."""
     data_array = ble_driver.ble_gattc_attr_info16_array.frompointer(array_pointer)
     data_list = _populate_list(data_array, length)
     return data_list
 
 
-def attr_info128_array_to_list(array_pointer, length):
+def attr_info128_array_to_list(ble_driver, array_pointer, length):
     """Convert ble_gattc_attr_info128_array to python list."""
     data_array = ble_driver.ble_gattc_attr_info128_array.frompointer(array_pointer)
     data_list = _populate_list(data_array, length)
     return data_list
 
 
-def serial_port_desc_array_to_list(array_pointer, length):
+def serial_port_desc_array_to_list(ble_driver, array_pointer, length):
     """Convert sd_rpc_serial_port_desc_array to python list."""
     data_array = ble_driver.sd_rpc_serial_port_desc_array.frompointer(array_pointer)
     data_list = _populate_list(data_array, length)
@@ -151,66 +144,74 @@ def _populate_list(data_array, length):
         data_list.append(data_array[i])
     return data_list
 
-def list_to_char_array(data_list):
+def list_to_char_array(ble_driver, data_list):
     """Convert python list to char_array."""
 
     data_array = _populate_array(data_list, ble_driver.char_array)
     return data_array
 
-def list_to_uint8_array(data_list):
+def list_to_uint8_array(ble_driver, data_list):
     """Convert python list to uint8_array."""
 
     data_array = _populate_array(data_list, ble_driver.uint8_array)
     return data_array
 
 
-def list_to_uint16_array(data_list):
+def list_to_uint16_array(ble_driver, data_list):
     """Convert python list to uint16_array."""
 
     data_array = _populate_array(data_list, ble_driver.uint16_array)
     return data_array
 
 
-def list_to_service_array(data_list):
+def list_to_service_array(ble_driver, data_list):
     """Convert python list to ble_gattc_service_array."""
 
     data_array = _populate_array(data_list, ble_driver.ble_gattc_service_array)
     return data_array
 
 
-def list_to_include_array(data_list):
+def list_to_include_array(ble_driver, data_list):
     """Convert python list to ble_gattc_include_array."""
 
     data_array = _populate_array(data_list, ble_driver.ble_gattc_include_array)
     return data_array
 
 
-def list_to_ble_gattc_char_array(data_list):
+def list_to_ble_gattc_char_array(ble_driver, data_list):
     """Convert python list to ble_gattc_char_array."""
 
     data_array = _populate_array(data_list, ble_driver.ble_gattc_char_array)
     return data_array
 
 
-def list_to_desc_array(data_list):
+def list_to_desc_array(ble_driver, data_list):
     """Convert python list to ble_gattc_desc_array."""
 
     data_array = _populate_array(data_list, ble_driver.ble_gattc_desc_array)
     return data_array
 
 
-def list_to_handle_value_array(data_list):
+def list_to_handle_value_array(ble_driver, data_list):
     """Convert python list to ble_gattc_handle_value_array."""
 
     data_array = _populate_array(data_list, ble_driver.ble_gattc_handle_value_array)
     return data_array
 
-def list_to_serial_port_desc_array(data_list):
+def list_to_serial_port_desc_array(ble_driver, data_list):
     """Convert python list to sd_rpc_serial_port_desc_array."""
 
     data_array = _populate_array(data_list, ble_driver.sd_rpc_serial_port_desc_array)
     return data_array
 
+def list_to_pointer_array(data_list):
+    """Convert python list of SWIG objects to ctypes array of pointers."""
+
+    data_array = (ctypes.c_void_p * len(data_list))()
+    for i in range(0, len(data_list)):
+        data_array[i] = int(data_list[i].this)
+    return data_array
+
 def _populate_array(data_list, array_type):
     length = len(data_list)
     data_array = array_type(length)
@@ -0,0 +1,238 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import os
+import json
+import time
+import logging
+from threading  import Condition, Lock, Thread
+
+from atomic_file    import json_dump_atomic
+from ble_driver     import BLEGapAddr, BLEGapEncKey, BLEGapIdKey, BLEGapSecKeyset
+
+logger  = logging.getLogger(__name__)
+
+
+def list_to_hex(data):
+    return bytes(bytearray(data)).encode('hex')
+
+
+def hex_to_list(data):
+    return list(bytearray(data.decode('hex')))
+
+
+def addr_to_dict(addr):
+    return {'addr_type' : addr.addr_type.name,
+            'addr'      : addr.addr_bytes.encode('hex')}
+
+
+def addr_from_dict(d):
+    return BLEGapAddr(BLEGapAddr.Types[d['addr_type']], bytearray(d['addr'].decode('hex')))
+
+
+def enc_key_to_dict(enc_key):
+    if enc_key is None:
+        return None
+    return {'ltk'   : list_to_hex(enc_key.ltk),
+            'lesc'  : enc_key.lesc,
+            'auth'  : enc_key.auth,
+            'ediv'  : enc_key.ediv,
+            'rand'  : list_to_hex(enc_key.rand)}
+
+
+def enc_key_from_dict(d):
+    if d is None:
+        return None
+    return BLEGapEncKey(ltk     = hex_to_list(d['ltk']),
+                        lesc    = d['lesc'],
+                        auth    = d['auth'],
+                        ediv    = d['ediv'],
+                        rand    = hex_to_list(d['rand']))
+
+
+def id_key_to_dict(id_key):
+    if id_key is None:
+        return None
+    return {'irk'       : list_to_hex(id_key.irk),
+            'id_addr'   : addr_to_dict(id_key.id_addr)}
+
+
+def id_key_from_dict(d):
+    if d is None:
+        return None
+    return BLEGapIdKey(irk      = hex_to_list(d['irk']),
+                       id_addr  = addr_from_dict(d['id_addr']))
+
+
+
+class Bond(object):
+    """Keys of a bonded peer.
+
+    The peer is identified by its identity address when it distributed one,
+    otherwise by the address it connected with.
+    """
+    def __init__(self, peer_addr, keys):
+        assert isinstance(peer_addr, BLEGapAddr),   'Invalid argument type'
+        assert isinstance(keys, BLEGapSecKeyset),   'Invalid argument type'
+        self.peer_addr  = peer_addr
+        self.keys       = keys
+
+
+    @property
+    def identity(self):
+        if self.keys.peer_id_key:
+            return self.keys.peer_id_key.id_addr
+        return self.peer_addr
+
+
+    def matches(self, addr):
+        return addr == self.peer_addr or addr == self.identity
+
+
+    def to_dict(self):
+        return {'peer_addr'     : addr_to_dict(self.peer_addr),
+                'own_enc_key'   : enc_key_to_dict(self.keys.own_enc_key),
+                'peer_enc_key'  : enc_key_to_dict(self.keys.peer_enc_key),
+                'peer_id_key'   : id_key_to_dict(self.keys.peer_id_key)}
+
+
+    @classmethod
+    def from_dict(cls, d):
+        keys = BLEGapSecKeyset(own_enc_key  = enc_key_from_dict(d['own_enc_key']),
+                               peer_enc_key = enc_key_from_dict(d['peer_enc_key']),
+                               peer_id_key  = id_key_from_dict(d['peer_id_key']))
+        return cls(addr_from_dict(d['peer_addr']), keys)
+
+
+
+class BondStore(object):
+    """Bonds kept in a JSON file, one entry per peer identity.
+
+    Every change rewrites the file through a temporary file in the same
+    directory that is renamed over it, so the file always holds either the
+    old or the new set of bonds. The file is written by a thread of its own,
+    changes made from the event thread do not wait for the disk. flush waits
+    until the file holds every change made so far.
+    """
+    def __init__(self, path):
+        self.path       = path
+        self.lock       = Lock()
+        self.changed    = Condition(self.lock)
+        self.bonds      = dict()
+        self.version    = 0     # Changes made
+        self.saved      = 0     # Changes written to the file
+        self.writer     = None
+        if os.path.exists(path):
+            with open(path) as f:
+                for d in json.load(f):
+                    bond = Bond.from_dict(d)
+                    self.bonds[bond.identity] = bond
+
+
+    def __len__(self):
+        return len(self.bonds)
+
+
+    def __contains__(self, addr):
+        return self.get(addr) is not None
+
+
+    def get(self, addr):
+        """Return the bond of the peer that connected with addr, or None."""
+        with self.lock:
+            for bond in self.bonds.values():
+                if bond.matches(addr):
+                    return bond
+        return None
+
+
+    def add(self, bond):
+        assert isinstance(bond, Bond), 'Invalid argument type'
+        with self.lock:
+            for identity in [i for i, b in self.bonds.items() if b.matches(bond.peer_addr)]:
+                del self.bonds[identity]
+            self.bonds[bond.identity] = bond
+            self.save()
+
+
+    def remove(self, addr):
+        with self.lock:
+            for identity in [i for i, b in self.bonds.items() if b.matches(addr)]:
+                del self.bonds[identity]
+            self.save()
+
+
+    def save(self):
+        # Called with the lock held
+        self.version += 1
+        if self.writer is None:
+            self.writer         = Thread(target = self.run, name = 'BondStoreWriter')
+            self.writer.daemon  = True
+            self.writer.start()
+        self.changed.notify_all()
+
+
+    def flush(self, timeout = None):
+        """Wait until the file holds every change made so far, return False on timeout."""
+        deadline = (time.time() + timeout) if timeout is not None else None
+        with self.lock:
+            version = self.version
+            while self.saved < version:
+                if deadline is None:
+                    self.changed.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.changed.wait(remaining)
+        return True
+
+
+    def run(self):
+        while True:
+            with self.lock:
+                while self.saved == self.version:
+                    self.changed.wait()
+                version = self.version
+                bonds   = [b.to_dict() for b in self.bonds.values()]
+            try:
+                json_dump_atomic(bonds, self.path, indent = 1)
+            except Exception as e:
+                logger.error('Failed to save bonds to {}: {}'.format(self.path, e))
+            with self.lock:
+                self.saved = version
+                self.changed.notify_all()
@@ -35,39 +35,47 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
-# Connectivity IC identifier
-# This variable needs to be set before importing pc_ble_driver_py from external Python code
+# Default connectivity IC identifier
+# Only used for drivers created without a conn_ic_id. It must be set before such
+# a driver is created; the backend is loaded per driver, so NRF51 and NRF52
+# adapters can be used from the same process.
 # Currently functional variants are:
 #
 # * "NRF51"
 # * "NRF52"
 __conn_ic_id__ = None
 
-def sd_api_ver_get():
-    if __conn_ic_id__ is None:
+def conn_ic_id_get(conn_ic_id=None):
+    if conn_ic_id is None:
+        conn_ic_id = __conn_ic_id__
+    if conn_ic_id is None:
         raise RuntimeError('Connectivity IC identifier __conn_ic_id__ is not set')
+    return conn_ic_id
 
-    if __conn_ic_id__.upper() == "NRF51":
+
+def sd_api_ver_get(conn_ic_id=None):
+    conn_ic_id = conn_ic_id_get(conn_ic_id)
+
+    if conn_ic_id.upper() == "NRF51":
         _sd_api_v = 2
-    elif __conn_ic_id__.upper() == "NRF52":
+    elif conn_ic_id.upper() == "NRF52":
         _sd_api_v = 3
     else:
-        raise RuntimeError('Invalid connectivity IC identifier: {}.'.format(__conn_ic_id__))
+        raise RuntimeError('Invalid connectivity IC identifier: {}.'.format(conn_ic_id))
     return _sd_api_v
 
 
-def conn_ic_hex_get():
+def conn_ic_hex_get(conn_ic_id=None):
     import os
-    if __conn_ic_id__ is None:
-        raise RuntimeError('Connectivity IC identifier __conn_ic_id__ is not set')
+    conn_ic_id = conn_ic_id_get(conn_ic_id)
 
-    if __conn_ic_id__.upper() == "NRF51":
+    if conn_ic_id.upper() == "NRF51":
         return os.path.join(os.path.dirname(__file__),
                         'hex', 'sd_api_v2',
                         'connectivity_1.0.1_115k2_with_s130_2.0.1.hex')
-    elif __conn_ic_id__.upper() == "NRF52":
+    elif conn_ic_id.upper() == "NRF52":
         return os.path.join(os.path.dirname(__file__),
                         'hex', 'sd_api_v3',
                         'connectivity_1.0.1_115k2_with_s132_3.0.hex')
     else:
-        raise RuntimeError('Invalid connectivity IC identifier: {}.'.format(__conn_ic_id__))
+        raise RuntimeError('Invalid connectivity IC identifier: {}.'.format(conn_ic_id))
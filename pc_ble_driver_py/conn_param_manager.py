@@ -0,0 +1,266 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import time
+import logging
+from enum       import Enum
+from threading  import Lock, Thread
+
+from observers  import BLEDriverObserver, BLEAdapterObserver
+from ble_driver import BLEGapConnParams, NordicSemiException
+
+logger  = logging.getLogger(__name__)
+
+
+class ConnParamMode(Enum):
+    fast    = 0
+    idle    = 1
+
+
+
+class ConnTraffic(object):
+    def __init__(self, conn_params, now):
+        self.conn_params    = conn_params
+        self.mode           = None
+        self.requested      = None
+        self.requested_at   = 0.0
+        self.active_at      = now
+        self.procedure_at   = 0.0
+        self.hvx_count      = 0
+        self.hvx_count_last = 0
+        self.hvx_rate       = 0.0
+        self.updates        = 0
+
+
+
+class ConnParamManager(BLEDriverObserver, BLEAdapterObserver):
+    """Adapts the connection parameters of every connection of an adapter to its traffic.
+
+    A connection is busy while it receives at least busy_hvx_rate notifications
+    or indications per second, has packets in flight, or has GATT procedures
+    (discovery, reads and writes) running. Busy connections are moved to
+    fast_params, connections without traffic for idle_timeout_s to idle_params.
+    Updates are requested at most every min_update_interval_s per connection.
+
+    Connection parameter update requests from the peer are answered by the
+    manager as well, so no other adapter observer should accept them.
+    """
+    def __init__(self, adapter, fast_params = None, idle_params = None, busy_hvx_rate = 20.0,
+                 idle_timeout_s = 2.0, min_update_interval_s = 1.0, tick_s = 0.25):
+        super(ConnParamManager, self).__init__()
+        if fast_params is None:
+            fast_params = BLEGapConnParams(min_conn_interval_ms = 7.5,
+                                           max_conn_interval_ms = 15,
+                                           conn_sup_timeout_ms  = 4000,
+                                           slave_latency        = 0)
+        if idle_params is None:
+            idle_params = BLEGapConnParams(min_conn_interval_ms = 100,
+                                           max_conn_interval_ms = 200,
+                                           conn_sup_timeout_ms  = 6000,
+                                           slave_latency        = 4)
+        assert isinstance(fast_params, BLEGapConnParams), 'Invalid argument type'
+        assert isinstance(idle_params, BLEGapConnParams), 'Invalid argument type'
+
+        self.adapter                = adapter
+        self.params                 = {ConnParamMode.fast : fast_params,
+                                       ConnParamMode.idle : idle_params}
+        self.busy_hvx_rate          = busy_hvx_rate
+        self.idle_timeout_s         = idle_timeout_s
+        self.min_update_interval_s  = min_update_interval_s
+        self.tick_s                 = tick_s
+        self.lock                   = Lock()
+        self.conns                  = dict()
+        self.update_failures        = 0
+        self.ticker                 = None
+
+
+    def start(self):
+        self.adapter.observer_register(self)
+        self.adapter.driver.observer_register(self)
+        self.ticker         = Thread(target = self.tick_loop, name = 'ConnParamManager')
+        self.ticker.daemon  = True
+        self.ticker.start()
+
+
+    def stop(self):
+        ticker, self.ticker = self.ticker, None
+        if ticker:
+            ticker.join()
+        self.adapter.driver.observer_unregister(self)
+        self.adapter.observer_unregister(self)
+
+
+    def tick_loop(self):
+        t_last = time.time()
+        while self.ticker:
+            time.sleep(self.tick_s)
+            now     = time.time()
+            self.tick(now, now - t_last)
+            t_last  = now
+
+
+    def tick(self, now, elapsed_s):
+        with self.lock:
+            conns = self.conns.items()
+
+        for conn_handle, state in conns:
+            hvx_count           = state.hvx_count
+            state.hvx_rate      = (hvx_count - state.hvx_count_last) / elapsed_s
+            state.hvx_count_last = hvx_count
+
+            busy = ((state.hvx_rate >= self.busy_hvx_rate) or
+                    (self.adapter.driver.tx_in_flight.get(conn_handle, 0) > 0) or
+                    (now - state.procedure_at < max(elapsed_s, self.tick_s)))
+            if busy:
+                state.active_at = now
+                mode = ConnParamMode.fast
+            elif now - state.active_at >= self.idle_timeout_s:
+                mode = ConnParamMode.idle
+            else:
+                mode = state.requested
+
+            if (mode is None) or (mode == state.requested):
+                continue
+            if now - state.requested_at < self.min_update_interval_s:
+                continue
+            self.update(conn_handle, state, mode, now)
+
+
+    def update(self, conn_handle, state, mode, now):
+        try:
+            self.adapter.driver.ble_gap_conn_param_update(conn_handle, self.params[mode])
+        except NordicSemiException as e:
+            # Most likely another update is still in progress, retried on the next tick
+            logger.debug('Connection parameter update on connection {} failed: {}'.format(conn_handle, e))
+            self.update_failures += 1
+            return
+        logger.debug('Connection {} switched to {} connection parameters'.format(conn_handle, mode.name))
+        state.requested     = mode
+        state.requested_at  = now
+        state.updates      += 1
+
+
+    def metrics(self):
+        with self.lock:
+            conns = self.conns.items()
+        return {'update_failures'   : self.update_failures,
+                'connections'       : dict((conn_handle,
+                                            {'mode'             : state.mode.name if state.mode else None,
+                                             'conn_params'      : state.conn_params,
+                                             'hvx_rate'         : state.hvx_rate,
+                                             'updates'          : state.updates})
+                                           for conn_handle, state in conns)}
+
+
+    def params_clamp(self, conn_params):
+        fast = self.params[ConnParamMode.fast]
+        idle = self.params[ConnParamMode.idle]
+        min_conn_interval_ms = min(max(conn_params.min_conn_interval_ms, fast.min_conn_interval_ms),
+                                   idle.max_conn_interval_ms)
+        max_conn_interval_ms = min(max(conn_params.max_conn_interval_ms, min_conn_interval_ms),
+                                   idle.max_conn_interval_ms)
+        return BLEGapConnParams(min_conn_interval_ms = min_conn_interval_ms,
+                                max_conn_interval_ms = max_conn_interval_ms,
+                                conn_sup_timeout_ms  = conn_params.conn_sup_timeout_ms,
+                                slave_latency        = min(conn_params.slave_latency, idle.slave_latency))
+
+
+    def on_gap_evt_connected(self, ble_driver, conn_handle, peer_addr, role, conn_params):
+        with self.lock:
+            self.conns[conn_handle] = ConnTraffic(conn_params, time.time())
+
+
+    def on_gap_evt_disconnected(self, ble_driver, conn_handle, reason):
+        with self.lock:
+            self.conns.pop(conn_handle, None)
+
+
+    def on_gap_evt_conn_param_update(self, ble_driver, conn_handle, conn_params):
+        state = self.conns.get(conn_handle)
+        if state is None:
+            return
+        state.conn_params   = conn_params
+        if conn_params.max_conn_interval_ms <= self.params[ConnParamMode.fast].max_conn_interval_ms:
+            state.mode      = ConnParamMode.fast
+        else:
+            state.mode      = ConnParamMode.idle
+
+
+    def on_gattc_evt_hvx(self, ble_driver, conn_handle, **kwargs):
+        state = self.conns.get(conn_handle)
+        if state:
+            state.hvx_count += 1
+
+
+    def on_gattc_evt_write_rsp(self, ble_driver, conn_handle, **kwargs):
+        self.procedure_seen(conn_handle)
+
+
+    def on_gattc_evt_read_rsp(self, ble_driver, conn_handle, **kwargs):
+        self.procedure_seen(conn_handle)
+
+
+    def on_gattc_evt_prim_srvc_disc_rsp(self, ble_driver, conn_handle, **kwargs):
+        self.procedure_seen(conn_handle)
+
+
+    def on_gattc_evt_char_disc_rsp(self, ble_driver, conn_handle, **kwargs):
+        self.procedure_seen(conn_handle)
+
+
+    def on_gattc_evt_desc_disc_rsp(self, ble_driver, conn_handle, **kwargs):
+        self.procedure_seen(conn_handle)
+
+
+    def procedure_seen(self, conn_handle):
+        state = self.conns.get(conn_handle)
+        if state:
+            state.procedure_at = time.time()
+
+
+    def on_conn_param_update_request(self, ble_adapter, conn_handle, conn_params):
+        # Busy connections keep the fast parameters, otherwise the peer gets
+        # what it asks for within the range spanned by the fast and idle parameters
+        state = self.conns.get(conn_handle)
+        if state and state.requested == ConnParamMode.fast:
+            conn_params = self.params[ConnParamMode.fast]
+        else:
+            conn_params = self.params_clamp(conn_params)
+        try:
+            ble_adapter.driver.ble_gap_conn_param_update(conn_handle, conn_params)
+        except NordicSemiException as e:
+            logger.error('Connection parameter update on connection {} failed: {}'.format(conn_handle, e))
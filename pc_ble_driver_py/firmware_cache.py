@@ -0,0 +1,127 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import os
+import json
+import time
+import hashlib
+import logging
+from threading  import Lock
+
+from atomic_file import json_dump_atomic
+
+logger  = logging.getLogger(__name__)
+
+hex_digests         = dict()
+hex_digests_lock    = Lock()
+
+
+def hex_digest(path):
+    """SHA-256 of a hex file, computed again only when the file changes."""
+    st  = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime, st.st_size)
+    with hex_digests_lock:
+        if key not in hex_digests:
+            sha256 = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(65536), b''):
+                    sha256.update(block)
+            hex_digests[key] = sha256.hexdigest()
+        return hex_digests[key]
+
+
+
+class FirmwareCache(object):
+    """Boards known to run the connectivity firmware, kept in a JSON file.
+
+    An entry records the board serial number, the SHA-256 of the hex file
+    and the SoftDevice API version it was verified against, and when. A
+    board only counts as verified while all three match, and, with
+    max_age_s, while the entry is younger than that. Every change rewrites
+    the file atomically.
+    """
+    def __init__(self, path, max_age_s = None):
+        self.path       = path
+        self.max_age_s  = max_age_s
+        self.lock       = Lock()
+        self.boards     = dict()
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.boards = json.load(f)
+            except ValueError as e:
+                logger.warning('Ignoring firmware cache {}: {}'.format(path, e))
+
+
+    def __len__(self):
+        return len(self.boards)
+
+
+    def verified(self, snr, hex_file, sd_api_ver):
+        with self.lock:
+            entry = self.boards.get(snr)
+        if entry is None:
+            return False
+        if (entry['hex_sha256'] != hex_digest(hex_file)) or (entry['sd_api_ver'] != sd_api_ver):
+            return False
+        if self.max_age_s is not None and time.time() - entry['verified'] > self.max_age_s:
+            return False
+        return True
+
+
+    def add(self, snr, hex_file, sd_api_ver):
+        entry = {'hex_sha256'   : hex_digest(hex_file),
+                 'sd_api_ver'   : sd_api_ver,
+                 'verified'     : time.time()}
+        with self.lock:
+            self.boards[snr] = entry
+            self.save()
+
+
+    def remove(self, snr):
+        with self.lock:
+            if self.boards.pop(snr, None) is not None:
+                self.save()
+
+
+    def clear(self):
+        with self.lock:
+            self.boards.clear()
+            self.save()
+
+
+    def save(self):
+        json_dump_atomic(self.boards, self.path, indent = 1, sort_keys = True)
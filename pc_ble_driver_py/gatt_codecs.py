@@ -0,0 +1,241 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import struct
+import itertools
+from collections    import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ble_driver     import BLEUUID
+from exceptions     import NordicSemiException
+
+
+# numpy dtypes of the little endian struct format codes used by codecs
+DTYPES = {'b': 'i1', 'B': 'u1', 'h': '<i2', 'H': '<u2', 'i': '<i4', 'I': '<u4',
+          'q': '<i8', 'Q': '<u8', 'f': '<f4', 'd': '<f8'}
+
+
+def numpy_get():
+    if numpy is None:
+        raise ImportError('Batch decoding requires numpy')
+    return numpy
+
+
+def batch_flatten(values):
+    """Return all values as one uint8 array and the start offset of each value, plus the end."""
+    np          = numpy_get()
+    lengths     = np.fromiter((len(v) for v in values), dtype = np.intp, count = len(values))
+    offsets     = np.zeros(len(values) + 1, dtype = np.intp)
+    np.cumsum(lengths, out = offsets[1:])
+    flat        = np.fromiter(itertools.chain.from_iterable(values), dtype = np.uint8, count = offsets[-1])
+    return flat, offsets
+
+
+
+class StructCodec(object):
+    """Codec for values with a fixed layout, given as a little endian struct format without the byte order."""
+    def __init__(self, name, fmt, fields):
+        assert len(fmt) == len(fields), 'One field name per format code'
+        self.layout = struct.Struct('<' + fmt)
+        self.type   = namedtuple(name, fields)
+        self.dtype  = [(field, DTYPES[code]) for (field, code) in zip(fields, fmt)]
+
+
+    def decode(self, data):
+        return self.type._make(self.layout.unpack_from(bytearray(data)))
+
+
+    def decode_batch(self, values):
+        """Decode a sequence of values into a dict of numpy arrays, one per field."""
+        np              = numpy_get()
+        flat, offsets   = batch_flatten(values)
+        if flat.size != len(values) * self.layout.size:
+            raise NordicSemiException('Values do not match the {} byte layout'.format(self.layout.size))
+        records         = flat.view(np.dtype(self.dtype))
+        return dict((field, records[field].copy()) for field in self.type._fields)
+
+
+
+HeartRateMeasurement = namedtuple('HeartRateMeasurement',
+                                  ['heart_rate', 'sensor_contact', 'energy_expended', 'rr_intervals'])
+
+class HeartRateMeasurementCodec(object):
+    """Heart Rate Measurement (0x2A37).
+
+    sensor_contact is None if the sensor does not support contact detection,
+    energy_expended is None if not present. RR intervals are in 1/1024 s.
+    """
+    FLAG_HR_UINT16          = 0x01
+    FLAG_CONTACT_DETECTED   = 0x02
+    FLAG_CONTACT_SUPPORTED  = 0x04
+    FLAG_ENERGY_EXPENDED    = 0x08
+    FLAG_RR_INTERVAL        = 0x10
+
+    def __init__(self):
+        self.uint8      = struct.Struct('<B')
+        self.uint16     = struct.Struct('<H')
+        self.rr_layouts = dict()
+
+
+    def rr_layout(self, count):
+        layout = self.rr_layouts.get(count)
+        if layout is None:
+            layout = self.rr_layouts.setdefault(count, struct.Struct('<{}H'.format(count)))
+        return layout
+
+
+    def min_length(self, flags):
+        """Bytes needed for the flags and the fields they mark present, RR intervals aside."""
+        return 2 + (flags & self.FLAG_HR_UINT16 != 0) + 2 * (flags & self.FLAG_ENERGY_EXPENDED != 0)
+
+
+    def decode(self, data):
+        data    = bytearray(data)
+        if not data:
+            raise NordicSemiException('Empty heart rate measurement')
+        flags   = data[0]
+        if len(data) < self.min_length(flags):
+            raise NordicSemiException('Heart rate measurement of {} bytes too short for flags 0x{:02X}'.format(len(data), flags))
+        if flags & self.FLAG_HR_UINT16:
+            heart_rate  = self.uint16.unpack_from(data, 1)[0]
+            offset      = 3
+        else:
+            heart_rate  = data[1]
+            offset      = 2
+
+        sensor_contact = None
+        if flags & self.FLAG_CONTACT_SUPPORTED:
+            sensor_contact = bool(flags & self.FLAG_CONTACT_DETECTED)
+
+        energy_expended = None
+        if flags & self.FLAG_ENERGY_EXPENDED:
+            energy_expended = self.uint16.unpack_from(data, offset)[0]
+            offset         += 2
+
+        rr_intervals = list()
+        if flags & self.FLAG_RR_INTERVAL:
+            rr_intervals = list(self.rr_layout((len(data) - offset) // 2).unpack_from(data, offset))
+
+        return HeartRateMeasurement(heart_rate, sensor_contact, energy_expended, rr_intervals)
+
+
+    def decode_batch(self, values):
+        """Decode a sequence of values into a dict of numpy arrays.
+
+        heart_rate, sensor_contact (-1 when not supported) and energy_expended
+        (-1 when not present) have one entry per value. rr_intervals holds the
+        RR intervals of all values and rr_index the value each belongs to.
+        """
+        np              = numpy_get()
+        flat, offsets   = batch_flatten(values)
+        starts          = offsets[:-1]
+        ends            = offsets[1:]
+        lengths         = ends - starts
+        if np.any(lengths == 0):
+            raise NordicSemiException('Empty heart rate measurement at index {}'.format(int(np.argmax(lengths == 0))))
+        # np.where reads both choices, padding keeps the unused one of the last value in range
+        flat            = np.concatenate((flat, np.zeros(2, dtype = np.uint8))).astype(np.uint16)
+
+        flags           = flat[starts]
+        hr_uint16       = (flags & self.FLAG_HR_UINT16) != 0
+        energy_present  = (flags & self.FLAG_ENERGY_EXPENDED) != 0
+        short           = lengths < 2 + hr_uint16 + 2 * energy_present
+        if np.any(short):
+            index = int(np.argmax(short))
+            raise NordicSemiException('Heart rate measurement at index {} of {} bytes too short for flags 0x{:02X}'.format(
+                                      index, int(lengths[index]), int(flags[index])))
+        heart_rate      = np.where(hr_uint16,
+                                   flat[starts + 1] | (flat[starts + 2] << 8),
+                                   flat[starts + 1])
+
+        sensor_contact  = np.where(flags & self.FLAG_CONTACT_SUPPORTED,
+                                   (flags & self.FLAG_CONTACT_DETECTED) != 0, -1).astype(np.int8)
+
+        energy_offsets  = starts + 2 + hr_uint16
+        energy_expended = np.where(energy_present,
+                                   flat[energy_offsets] | (flat[energy_offsets + 1] << 8),
+                                   -1).astype(np.int32)
+
+        rr_offsets      = energy_offsets + 2 * energy_present
+        rr_counts       = np.where(flags & self.FLAG_RR_INTERVAL, (ends - rr_offsets) // 2, 0)
+        rr_index        = np.repeat(np.arange(len(values)), rr_counts)
+        rr_first        = np.cumsum(rr_counts) - rr_counts
+        rr_positions    = (np.repeat(rr_offsets, rr_counts) +
+                           2 * (np.arange(rr_index.size) - np.repeat(rr_first, rr_counts)))
+        rr_intervals    = flat[rr_positions] | (flat[rr_positions + 1] << 8)
+
+        return dict(heart_rate      = heart_rate.astype(np.uint16),
+                    sensor_contact  = sensor_contact,
+                    energy_expended = energy_expended,
+                    rr_intervals    = rr_intervals.astype(np.uint16),
+                    rr_index        = rr_index)
+
+
+
+registry = dict()   # BLEUUID -> codec
+
+def codec_register(uuid, codec):
+    assert isinstance(uuid, BLEUUID), 'Invalid argument type'
+    registry[uuid] = codec
+
+
+def codec_get(uuid):
+    codec = registry.get(uuid)
+    if codec is None:
+        raise NordicSemiException('No codec registered for {}'.format(uuid))
+    return codec
+
+
+def decode(uuid, data):
+    """Decode a characteristic value, or return it unchanged if uuid has no codec."""
+    codec = registry.get(uuid)
+    if codec is None:
+        return data
+    return codec.decode(data)
+
+
+def decode_batch(uuid, values):
+    """Decode many values of uuid, e.g. notifications collected over time, into numpy arrays."""
+    return codec_get(uuid).decode_batch(values)
+
+
+codec_register(BLEUUID(BLEUUID.Standard.battery_level), StructCodec('BatteryLevel', 'B', ['battery_level']))
+codec_register(BLEUUID(BLEUUID.Standard.heart_rate),    HeartRateMeasurementCodec())
@@ -0,0 +1,175 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import time
+import logging
+from threading  import Condition, Lock
+
+from ble_driver import *
+from exceptions import NordicSemiException
+from observers  import BLEDriverObserver
+
+logger  = logging.getLogger(__name__)
+
+
+CCCD_NOTIFICATION   = 0x0001
+CCCD_INDICATION     = 0x0002
+
+
+class GattServer(BLEDriverObserver):
+    """Local GATT server built from a list of BLEGattsService.
+
+    server = GattServer(driver, [BLEGattsService(BLEUUID(0x180F), [
+                 BLEGattsCharacteristic(BLEUUID(BLEUUID.Standard.battery_level),
+                                        BLEGattCharProps(read = True, notify = True),
+                                        value = [100])])])
+    server.build()
+
+    build must be called after ble_enable. Client writes are passed to the
+    callbacks set with write_callback_set, CCCD writes are tracked in cccds.
+    """
+    def __init__(self, ble_driver, services):
+        super(GattServer, self).__init__()
+        self.driver             = ble_driver
+        self.services           = services
+        self.connections        = set()
+        self.cccds              = dict()    # (conn_handle, value handle) -> CCCD value
+        self.write_callbacks    = dict()    # value handle -> (char, callback)
+        self.cccd_handles       = dict()    # CCCD handle -> value handle
+        self.tx_cond            = Condition(Lock())
+        self.driver.observer_register(self)
+
+
+    def build(self):
+        for service in self.services:
+            self.driver.ble_gatts_service_add(service)
+            for char in service.chars:
+                self.driver.ble_gatts_characteristic_add(service.handle, char)
+                if char.handles.cccd_handle:
+                    self.cccd_handles[char.handles.cccd_handle] = char.handles.value_handle
+
+
+    def write_callback_set(self, char, callback):
+        """Call callback(conn_handle, char, data) when a client writes the value of char."""
+        self.write_callbacks[char.handles.value_handle] = (char, callback)
+
+
+    def value_set(self, char, data, conn_handle = const.BLE_CONN_HANDLE_INVALID):
+        char.value = data
+        self.driver.ble_gatts_value_set(conn_handle, char.handles.value_handle, data)
+
+
+    def notification_enabled(self, conn_handle, char):
+        return bool(self.cccds.get((conn_handle, char.handles.value_handle), 0) & CCCD_NOTIFICATION)
+
+
+    def notify(self, conn_handle, char, data):
+        hvx_params = BLEGattsHVXParams(char.handles.value_handle, BLEGattHVXType.notification, data)
+        self.driver.ble_gatts_hvx(conn_handle, hvx_params)
+
+
+    def indicate(self, conn_handle, char, data):
+        hvx_params = BLEGattsHVXParams(char.handles.value_handle, BLEGattHVXType.indication, data)
+        self.driver.ble_gatts_hvx(conn_handle, hvx_params)
+
+
+    def tx_credits_wait(self, conn_handle, timeout):
+        deadline = time.time() + timeout
+        with self.tx_cond:
+            while self.driver.tx_credits(conn_handle) <= 0:
+                if conn_handle not in self.connections:
+                    raise NordicSemiException('Connection {} closed'.format(conn_handle))
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise NordicSemiException('Timed out waiting for TX complete')
+                self.tx_cond.wait(remaining)
+
+
+    def notify_stream(self, conn_handle, char, packets, timeout = 5):
+        """Send every item of packets as a notification of char and return the number sent.
+
+        A packet is queued whenever the SoftDevice has a free application TX
+        buffer, as counted from TX complete events, so the link sends as many
+        notifications per connection event as it can.
+        """
+        if conn_handle not in self.connections:
+            raise NordicSemiException('Connection {} closed'.format(conn_handle))
+        if conn_handle not in self.driver.tx_packet_counts:
+            self.driver.ble_tx_packet_count_get(conn_handle)
+
+        hvx_params  = BLEGattsHVXParams(char.handles.value_handle, BLEGattHVXType.notification, None)
+        sent        = 0
+        for data in packets:
+            self.tx_credits_wait(conn_handle, timeout)
+            hvx_params.data = data
+            self.driver.ble_gatts_hvx(conn_handle, hvx_params)
+            sent += 1
+        return sent
+
+
+    def on_gap_evt_connected(self, ble_driver, conn_handle, peer_addr, role, conn_params):
+        self.connections.add(conn_handle)
+
+
+    def on_gap_evt_disconnected(self, ble_driver, conn_handle, reason):
+        self.connections.discard(conn_handle)
+        for key in [k for k in self.cccds if k[0] == conn_handle]:
+            del self.cccds[key]
+        with self.tx_cond:
+            self.tx_cond.notify_all()
+
+
+    def on_evt_tx_complete(self, ble_driver, conn_handle, count):
+        with self.tx_cond:
+            self.tx_cond.notify_all()
+
+
+    def on_gatts_evt_sys_attr_missing(self, ble_driver, conn_handle, hint):
+        # No bonding, so every connection starts with empty system attributes
+        ble_driver.ble_gatts_sys_attr_set(conn_handle)
+
+
+    def on_gatts_evt_write(self, ble_driver, conn_handle, attr_handle, uuid, op, auth_required, offset, data):
+        value_handle = self.cccd_handles.get(attr_handle)
+        if value_handle is not None:
+            self.cccds[(conn_handle, value_handle)] = data[0] | (data[1] << 8) if len(data) >= 2 else 0
+            return
+
+        write_callback = self.write_callbacks.get(attr_handle)
+        if write_callback is not None:
+            (char, callback) = write_callback
+            callback(conn_handle, char, data)
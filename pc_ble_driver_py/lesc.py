@@ -0,0 +1,144 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import time
+import Queue
+import logging
+import pyelliptic
+from threading  import Lock, Thread
+
+logger  = logging.getLogger(__name__)
+
+
+class EccKeypair(object):
+    """P-256 key pair of one LE Secure Connections pairing.
+
+    Keys are exchanged with the SoftDevice as 64 byte lists, the X and Y
+    coordinates each in little endian byte order.
+    """
+    def __init__(self, curve = 'prime256v1'):
+        self.ecc        = pyelliptic.ECC(curve = curve)
+        # OpenSSL drops leading zero bytes of the coordinates
+        self.public_key = (list(bytearray(self.ecc.pubkey_x.rjust(32, '\x00')))[::-1] +
+                           list(bytearray(self.ecc.pubkey_y.rjust(32, '\x00')))[::-1])
+
+
+    def dhkey(self, peer_pk):
+        """Shared secret with peer_pk, in the byte order of the SoftDevice."""
+        peer_pk_str = '04' + bytes(bytearray(peer_pk[31::-1] + peer_pk[:31:-1])).encode('hex')
+        return list(bytearray(self.ecc.get_ecdh_key(peer_pk_str, format = 'hex')))[::-1]
+
+
+
+class EccKeypairPool(object):
+    """Key pairs generated ahead of time by a background thread.
+
+    Every key pair is handed out once. Key generation spends its time in
+    OpenSSL, which runs without the GIL, so the pool fills up alongside the
+    event thread. The thread is started on first use.
+    """
+    def __init__(self, size = 4, curve = 'prime256v1'):
+        self.curve      = curve
+        self.keypairs   = Queue.Queue(maxsize = size)
+        self.lock       = Lock()
+        self.filler     = None
+        self.misses     = 0
+
+
+    def get(self):
+        """Return an unused key pair, generated on the spot if the pool ran dry."""
+        with self.lock:
+            if self.filler is None:
+                self.filler         = Thread(target = self.fill_loop, name = 'EccKeypairPool')
+                self.filler.daemon  = True
+                self.filler.start()
+        try:
+            return self.keypairs.get_nowait()
+        except Queue.Empty:
+            self.misses += 1
+            return EccKeypair(self.curve)
+
+
+    def fill_loop(self):
+        while True:
+            try:
+                keypair = EccKeypair(self.curve)
+            except Exception as e:
+                logger.error('Key pair generation failed: {}'.format(e))
+                time.sleep(1)
+                continue
+            self.keypairs.put(keypair)
+
+
+
+class DhkeyWorkers(object):
+    """Threads computing ECDH shared secrets off the event thread.
+
+    submit returns immediately, callback(dhkey) is called from a worker, or
+    errback(exception) if the computation failed. The threads are started on
+    first use.
+    """
+    def __init__(self, workers = 4):
+        self.workers    = workers
+        self.jobs       = Queue.Queue()
+        self.lock       = Lock()
+        self.threads    = list()
+
+
+    def submit(self, keypair, peer_pk, callback, errback):
+        with self.lock:
+            if not self.threads:
+                for i in range(self.workers):
+                    thread          = Thread(target = self.work_loop, name = 'DhkeyWorker{}'.format(i))
+                    thread.daemon   = True
+                    thread.start()
+                    self.threads.append(thread)
+        self.jobs.put((keypair, peer_pk, callback, errback))
+
+
+    def work_loop(self):
+        while True:
+            (keypair, peer_pk, callback, errback) = self.jobs.get()
+            try:
+                dhkey = keypair.dhkey(peer_pk)
+            except Exception as e:
+                errback(e)
+                continue
+            try:
+                callback(dhkey)
+            except Exception as e:
+                logger.error('DH key callback failed: {}'.format(e))
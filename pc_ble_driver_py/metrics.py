@@ -0,0 +1,291 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import logging
+import BaseHTTPServer
+from bisect         import bisect_left
+from collections    import OrderedDict
+from threading      import Lock, Thread
+
+logger  = logging.getLogger(__name__)
+
+
+# Upper bounds in seconds, from 50 us to 10 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+
+    def inc(self, amount = 1):
+        self.value += amount
+
+
+    def sample(self):
+        return self.value
+
+
+
+class Gauge(Counter):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+
+    def dec(self, amount = 1):
+        self.value -= amount
+
+
+
+class Histogram(object):
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets = LATENCY_BUCKETS):
+        self.buckets    = buckets
+        self.counts     = [0] * (len(buckets) + 1)
+        self.sum        = 0.0
+        self.count      = 0
+
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum   += value
+        self.count += 1
+
+
+    def sample(self):
+        """Return cumulative (upper bound, count) pairs, the sum and the count."""
+        cumulative  = list()
+        total       = 0
+        for (le, count) in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            cumulative.append((le, total))
+        return dict(buckets = cumulative, sum = self.sum, count = self.count)
+
+
+
+class MetricFamily(object):
+    def __init__(self, name, doc, metric_type, label_names, factory):
+        self.name           = name
+        self.doc            = doc
+        self.metric_type    = metric_type
+        self.label_names    = tuple(label_names)
+        self.factory        = factory
+        self.children       = dict()
+        self.lock           = Lock()
+
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = self.factory()
+                    self.children[values] = child
+        return child
+
+
+    def remove(self, *values):
+        with self.lock:
+            self.children.pop(values, None)
+
+
+
+class MetricsRegistry(object):
+    """Process wide metrics, collected while enabled is set."""
+    def __init__(self):
+        self.enabled    = False
+        self.families   = OrderedDict()
+        self.lock       = Lock()
+
+
+    def enable(self):
+        self.enabled = True
+
+
+    def disable(self):
+        self.enabled = False
+
+
+    def family(self, name, doc, metric_type, label_names, factory):
+        with self.lock:
+            if name not in self.families:
+                self.families[name] = MetricFamily(name, doc, metric_type, label_names, factory)
+            return self.families[name]
+
+
+    def counter(self, name, doc, label_names = ()):
+        return self.family(name, doc, 'counter', label_names, Counter)
+
+
+    def gauge(self, name, doc, label_names = ()):
+        return self.family(name, doc, 'gauge', label_names, Gauge)
+
+
+    def histogram(self, name, doc, label_names = (), buckets = LATENCY_BUCKETS):
+        return self.family(name, doc, 'histogram', label_names, lambda: Histogram(buckets))
+
+
+    def snapshot(self):
+        """Return {name: [(labels dict, sample), ...]} for all metrics."""
+        result = dict()
+        for family in self.families.values():
+            children = list(family.children.items())
+            result[family.name] = [(dict(zip(family.label_names, values)), child.sample())
+                                   for (values, child) in children]
+        return result
+
+
+    def exposition(self):
+        """Render all metrics in the Prometheus text format."""
+        lines = list()
+        for family in self.families.values():
+            lines.append('# HELP {} {}'.format(family.name, family.doc))
+            lines.append('# TYPE {} {}'.format(family.name, family.metric_type))
+            for (values, child) in list(family.children.items()):
+                labels = zip(family.label_names, values)
+                if family.metric_type == 'histogram':
+                    sample = child.sample()
+                    for (le, count) in sample['buckets']:
+                        lines.append('{}_bucket{} {}'.format(family.name,
+                                                             _labels_format(labels + [('le', _value_format(le))]),
+                                                             count))
+                    lines.append('{}_sum{} {}'.format(family.name, _labels_format(labels), _value_format(sample['sum'])))
+                    lines.append('{}_count{} {}'.format(family.name, _labels_format(labels), sample['count']))
+                else:
+                    lines.append('{}{} {}'.format(family.name, _labels_format(labels), _value_format(child.sample())))
+        return '\n'.join(lines) + '\n'
+
+
+
+def _value_format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _labels_format(labels):
+    if not labels:
+        return ''
+    escaped = ['{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+               for (k, v) in labels]
+    return '{' + ','.join(escaped) + '}'
+
+
+
+class MetricsExporter(object):
+    """Serves the registry in the Prometheus text format on http://host:port/metrics."""
+    def __init__(self, port = 9464, host = '127.0.0.1'):
+        self.address    = (host, port)
+        self.server     = None
+        self.thread     = None
+
+
+    def start(self):
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.exposition()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        registry.enable()
+        self.server         = BaseHTTPServer.HTTPServer(self.address, Handler)
+        self.thread         = Thread(target = self.server.serve_forever, name = 'MetricsExporter')
+        self.thread.daemon  = True
+        self.thread.start()
+        logger.info('Metrics exported on http://{}:{}/metrics'.format(*self.server.server_address))
+
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+
+
+
+registry = MetricsRegistry()
+
+events_received         = registry.counter('ble_events_total',
+                                           'BLE events received.',
+                                           ('port', 'evt'))
+event_decode_seconds    = registry.histogram('ble_event_decode_seconds',
+                                             'Time spent decoding a BLE event, excluding observer callbacks.',
+                                             ('port', 'evt'))
+callback_seconds        = registry.histogram('ble_observer_callback_seconds',
+                                             'Time spent in an observer callback.',
+                                             ('port', 'observer', 'callback'))
+api_lock_wait_seconds   = registry.histogram('ble_api_lock_wait_seconds',
+                                             'Time spent waiting for the driver API lock.',
+                                             ('port', 'call'))
+api_lock_hold_seconds   = registry.histogram('ble_api_lock_hold_seconds',
+                                             'Time the driver API lock was held.',
+                                             ('port', 'call'))
+gatt_procedure_seconds  = registry.histogram('ble_gatt_procedure_seconds',
+                                             'Round-trip time of a GATT procedure.',
+                                             ('port', 'procedure'))
+tx_packets_in_flight    = registry.gauge('ble_tx_packets_in_flight',
+                                         'Write commands sent and not yet completed.',
+                                         ('port', 'conn_handle'))
+pairing_seconds         = registry.histogram('ble_pairing_seconds',
+                                             'Duration of a pairing, or of encryption with stored keys.',
+                                             ('port', 'procedure', 'result'))
+scan_seconds            = registry.counter('ble_scan_seconds_total',
+                                           'Time spent scanning by a ScanScheduler.',
+                                           ('port',))
+scan_gap_seconds        = registry.histogram('ble_scan_gap_seconds',
+                                             'Time a driver was not scanning between two scans of a ScanScheduler.',
+                                             ('port',))
+scan_coverage_gaps      = registry.counter('ble_scan_coverage_gaps_total',
+                                           'Times no driver of a ScanScheduler was scanning.')
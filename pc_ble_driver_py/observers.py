@@ -67,6 +67,10 @@ class BLEDriverObserver(object):
         pass
 
 
+    def on_gap_evt_conn_param_update(self, ble_driver, conn_handle, conn_params):
+        pass
+
+
     def on_gap_evt_timeout(self, ble_driver, conn_handle, src):
         pass
 
@@ -79,6 +83,10 @@ class BLEDriverObserver(object):
         pass
 
 
+    def on_evt_data_length_changed(self, ble_driver, conn_handle, max_tx_octets, max_tx_time, max_rx_octets, max_rx_time):
+        pass
+
+
     def on_gattc_evt_write_rsp(self, ble_driver, conn_handle, status, error_handle, attr_handle, write_op, offset, data):
         pass
 
@@ -109,9 +117,29 @@ class BLEDriverObserver(object):
         pass
 
 
+    def on_conn_sec_updated(self, ble_driver, conn_handle, conn_sec):
+        pass
+
+
     def on_att_mtu_exchanged(self, ble_driver, conn_handle, att_mtu):
         pass
 
+
+    def on_gattc_evt_exchange_mtu_rsp(self, ble_driver, conn_handle, status, att_mtu):
+        pass
+
+
+    def on_gatts_evt_write(self, ble_driver, conn_handle, attr_handle, uuid, op, auth_required, offset, data):
+        pass
+
+
+    def on_gatts_evt_sys_attr_missing(self, ble_driver, conn_handle, hint):
+        pass
+
+
+    def on_gatts_evt_hvc(self, ble_driver, conn_handle, attr_handle):
+        pass
+
 class BLEAdapterObserver(object):
     def __init__(self, *args, **kwargs):
         super(BLEAdapterObserver, self).__init__()
@@ -0,0 +1,360 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import time
+import logging
+from enum       import Enum
+from threading  import Event, Lock
+
+from ble_driver import *
+from observers  import BLEDriverObserver
+import metrics
+
+logger  = logging.getLogger(__name__)
+
+# SMP gives up on a pairing after 30 s without progress
+PAIRING_TIMEOUT_S   = 35
+
+
+class PairingState(Enum):
+    encrypting  = 0
+    sec_params  = 1
+    keys        = 2
+    passkey     = 3
+    done        = 4
+    failed      = 5
+
+
+
+class PairingPolicy(object):
+    """Security parameters the PairingEngine pairs with.
+
+    With lesc_required, peers without LE Secure Connections support are
+    refused instead of falling back to legacy pairing.
+    """
+    def __init__(self, lesc = True, mitm = False, bond = False, io_caps = None, lesc_required = False,
+                 min_key_size = 7, max_key_size = 16):
+        if io_caps is None:
+            io_caps = BLEGapIOCaps.yesno if mitm else BLEGapIOCaps.none
+        assert isinstance(io_caps, BLEGapIOCaps), 'Invalid argument type'
+        self.lesc           = lesc
+        self.mitm           = mitm
+        self.bond           = bond
+        self.io_caps        = io_caps
+        self.lesc_required  = lesc_required
+        self.min_key_size   = min_key_size
+        self.max_key_size   = max_key_size
+
+
+    def sec_params(self):
+        kdist_own   = BLEGapSecKDist(enc  = self.bond,
+                                     id   = False,
+                                     sign = False,
+                                     link = False)
+        kdist_peer  = BLEGapSecKDist(enc  = self.bond,
+                                     id   = self.bond,
+                                     sign = False,
+                                     link = False)
+        return BLEGapSecParams(bond          = self.bond,
+                               mitm          = self.mitm,
+                               lesc          = self.lesc,
+                               keypress      = False,
+                               io_caps       = self.io_caps,
+                               oob           = False,
+                               min_key_size  = self.min_key_size,
+                               max_key_size  = self.max_key_size,
+                               kdist_own     = kdist_own,
+                               kdist_peer    = kdist_peer)
+
+
+    def accept(self, peer_params):
+        return peer_params.lesc or not self.lesc_required
+
+
+
+class Pairing(object):
+    """Progress of the pairing of one connection."""
+    def __init__(self, engine, conn_handle, policy, confirm, callback, repair = True):
+        self.engine         = engine
+        self.conn_handle    = conn_handle
+        self.policy         = policy
+        self.confirm        = confirm
+        self.callback       = callback
+        self.repair         = repair    # Pair again when the peer rejects the stored LTK
+        self.state          = PairingState.sec_params
+        self.procedure      = 'lesc' if policy.lesc else 'legacy'
+        self.keypair        = None
+        self.passkey        = None
+        self.auth_status    = None
+        self.t_start        = time.time()
+        self.duration_s     = None
+        self.done           = Event()
+
+
+    def wait(self, timeout = PAIRING_TIMEOUT_S):
+        """Block until the pairing has finished, return its BLEGapSecStatus.
+
+        A pairing still running after timeout is given up, the connection
+        is free to pair again.
+        """
+        if not self.done.wait(timeout):
+            self.engine.abandon(self, BLEGapSecStatus.timeout)
+        return self.auth_status
+
+
+
+class PairingEngine(BLEDriverObserver):
+    """Pairs any number of connections of an adapter at the same time.
+
+    pair starts a pairing and returns a Pairing right away, the rest of the
+    procedure is driven by the security events of the connection. Peers that
+    are bonded in the bond store of the adapter get the link encrypted with
+    the stored keys instead, pairings started by the peer use the default
+    policy.
+
+    For numeric comparison confirm(pairing) is called from the event thread
+    with pairing.passkey set. It returns True or False, or None to answer
+    later through passkey_reply. Without confirm numeric comparison is
+    rejected. callback(pairing) is called once the pairing has finished.
+    """
+    def __init__(self, adapter, policy = None, confirm = None):
+        super(PairingEngine, self).__init__()
+        self.adapter    = adapter
+        self.policy     = policy or PairingPolicy()
+        self.confirm    = confirm
+        self.lock       = Lock()
+        self.pairings   = dict()
+        self.roles      = dict()
+        self.adapter.driver.observer_register(self)
+
+
+    def pair(self, conn_handle, policy = None, confirm = None, callback = None):
+        pairing = Pairing(self, conn_handle, policy or self.policy, confirm or self.confirm, callback)
+        bond    = self.bond_get(conn_handle)
+        if bond:
+            return self.start(pairing, lambda: self.encryption_start(pairing, bond))
+        return self.start(pairing, lambda: self.authenticate(pairing))
+
+
+    def encrypt(self, conn_handle, callback = None):
+        """Encrypt the link of a bonded peer with the stored keys, without pairing.
+
+        Returns the Pairing, or None if the peer is not bonded. If the peer
+        rejects the stored LTK the bond is removed and the pairing fails.
+        """
+        bond = self.bond_get(conn_handle)
+        if bond is None:
+            return None
+        pairing = Pairing(self, conn_handle, self.policy, None, callback, repair = False)
+        return self.start(pairing, lambda: self.encryption_start(pairing, bond))
+
+
+    def start(self, pairing, procedure):
+        conn_handle = pairing.conn_handle
+        with self.lock:
+            if conn_handle in self.pairings:
+                raise NordicSemiException('Pairing already in progress on connection {}'.format(conn_handle))
+            self.pairings[conn_handle] = pairing
+
+        try:
+            procedure()
+        except Exception:
+            with self.lock:
+                self.pairings.pop(conn_handle, None)
+            self.adapter.ecc_keypairs.pop(conn_handle, None)
+            raise
+        return pairing
+
+
+    def abandon(self, pairing, auth_status):
+        # Whoever takes the pairing out of pairings finishes it
+        with self.lock:
+            if self.pairings.get(pairing.conn_handle) is not pairing:
+                return
+            del self.pairings[pairing.conn_handle]
+        logger.info('Connection {}: giving up on {}'.format(pairing.conn_handle, pairing.procedure))
+        self.finish(pairing, auth_status)
+
+
+    def passkey_reply(self, conn_handle, accept):
+        """Answer a numeric comparison that confirm left open."""
+        key_type = const.BLE_GAP_AUTH_KEY_TYPE_PASSKEY if accept else const.BLE_GAP_AUTH_KEY_TYPE_NONE
+        self.adapter.driver.ble_gap_auth_key_reply(conn_handle, key_type, None)
+
+
+    def bond_get(self, conn_handle):
+        # Only the central starts encryption
+        if (self.adapter.bond_store is None) or (self.roles.get(conn_handle) != BLEGapRoles.central):
+            return None
+        bond = self.adapter.bond_store.get(self.adapter.db_conns[conn_handle].peer_addr)
+        if bond and bond.keys.peer_enc_key:
+            return bond
+        return None
+
+
+    def encryption_start(self, pairing, bond):
+        pairing.state       = PairingState.encrypting
+        pairing.procedure   = 'encrypt'
+        self.adapter.driver.ble_gap_encrypt(pairing.conn_handle, bond.keys.peer_enc_key)
+
+
+    def authenticate(self, pairing):
+        pairing.state       = PairingState.sec_params
+        pairing.procedure   = 'lesc' if pairing.policy.lesc else 'legacy'
+        self.keypair_assign(pairing)
+        self.adapter.driver.ble_gap_authenticate(pairing.conn_handle, pairing.policy.sec_params())
+
+
+    def keypair_assign(self, pairing):
+        # The DH key request is answered by the adapter with this key pair
+        if pairing.policy.lesc and not pairing.keypair:
+            pairing.keypair = self.adapter.keypair_pool.get()
+            self.adapter.ecc_keypairs[pairing.conn_handle] = pairing.keypair
+
+
+    def finish(self, pairing, auth_status):
+        self.adapter.ecc_keypairs.pop(pairing.conn_handle, None)
+        pairing.auth_status = auth_status
+        pairing.duration_s  = time.time() - pairing.t_start
+        pairing.state       = PairingState.done if auth_status == BLEGapSecStatus.success else PairingState.failed
+        logger.debug('Connection {}: {} finished with {} in {:.3f} s'.format(pairing.conn_handle,
+                                                                             pairing.procedure,
+                                                                             auth_status,
+                                                                             pairing.duration_s))
+        if metrics.registry.enabled:
+            metrics.pairing_seconds.labels(self.adapter.driver.serial_port,
+                                           pairing.procedure,
+                                           pairing.state.name).observe(pairing.duration_s)
+        pairing.done.set()
+        if pairing.callback:
+            try:
+                pairing.callback(pairing)
+            except Exception as e:
+                logger.error('Pairing callback failed: {}'.format(e))
+
+
+    def on_gap_evt_connected(self, ble_driver, conn_handle, peer_addr, role, conn_params):
+        self.roles[conn_handle] = role
+
+
+    def on_gap_evt_disconnected(self, ble_driver, conn_handle, reason):
+        self.roles.pop(conn_handle, None)
+        with self.lock:
+            pairing = self.pairings.pop(conn_handle, None)
+        if pairing:
+            self.finish(pairing, BLEGapSecStatus.unspecified)
+
+
+    def on_gap_evt_sec_params_request(self, ble_driver, conn_handle, peer_params):
+        with self.lock:
+            pairing = self.pairings.get(conn_handle)
+            if pairing is None:
+                # Pairing started by the peer
+                pairing = Pairing(self, conn_handle, self.policy, self.confirm, None)
+                self.pairings[conn_handle] = pairing
+
+        if not pairing.policy.accept(peer_params):
+            logger.info('Connection {}: peer does not support LE Secure Connections'.format(conn_handle))
+            ble_driver.ble_gap_sec_params_reply(conn_handle, BLEGapSecStatus.auth_req, None, None, None)
+            return
+
+        self.keypair_assign(pairing)
+        pairing.state   = PairingState.keys
+        # The central gave its parameters to ble_gap_authenticate already
+        sec_params      = None if self.roles.get(conn_handle) == BLEGapRoles.central else pairing.policy.sec_params()
+        own_pk          = BLEGapLESCp256pk(pk = pairing.keypair.public_key) if pairing.keypair else None
+        ble_driver.ble_gap_sec_params_reply(conn_handle, BLEGapSecStatus.success, sec_params, own_pk, None)
+
+
+    def on_gap_evt_passkey_display(self, ble_driver, conn_handle, match_request, passkey):
+        pairing = self.pairings.get(conn_handle)
+        if pairing is None:
+            return
+        pairing.passkey = ''.join(chr(c) for c in passkey)
+        if not match_request:
+            logger.info('Connection {}: passkey {}'.format(conn_handle, pairing.passkey))
+            return
+
+        pairing.state = PairingState.passkey
+        accept = False
+        if pairing.confirm:
+            try:
+                accept = pairing.confirm(pairing)
+            except Exception as e:
+                logger.error('Passkey confirmation failed: {}'.format(e))
+        else:
+            logger.warning('Connection {}: numeric comparison rejected, no confirm callback'.format(conn_handle))
+        if accept is not None:
+            self.passkey_reply(conn_handle, accept)
+
+
+    def on_gap_evt_auth_status(self, ble_driver, conn_handle, auth_status):
+        with self.lock:
+            pairing = self.pairings.pop(conn_handle, None)
+        if pairing is None:
+            return
+        if auth_status == BLEGapSecStatus.success:
+            self.adapter.bond_save(conn_handle)
+        self.finish(pairing, auth_status)
+
+
+    def on_conn_sec_updated(self, ble_driver, conn_handle, conn_sec):
+        pairing = self.pairings.get(conn_handle)
+        if (pairing is None) or (pairing.state != PairingState.encrypting):
+            return
+        if conn_sec.encrypted:
+            with self.lock:
+                self.pairings.pop(conn_handle, None)
+            self.finish(pairing, BLEGapSecStatus.success)
+            return
+
+        # The peer lost the bond, pair again
+        peer_addr = self.adapter.db_conns[conn_handle].peer_addr
+        logger.info('Peer {} rejected the stored LTK, removing bond'.format(peer_addr))
+        self.adapter.bond_store.remove(peer_addr)
+        if not pairing.repair:
+            with self.lock:
+                self.pairings.pop(conn_handle, None)
+            self.finish(pairing, BLEGapSecStatus.unspecified)
+            return
+        try:
+            self.authenticate(pairing)
+        except NordicSemiException as e:
+            logger.error('Connection {}: pairing failed: {}'.format(conn_handle, e))
+            with self.lock:
+                self.pairings.pop(conn_handle, None)
+            self.finish(pairing, BLEGapSecStatus.unspecified)
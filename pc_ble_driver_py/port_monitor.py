@@ -0,0 +1,181 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import os
+import time
+import errno
+import ctypes
+import ctypes.util
+import select
+import logging
+import platform
+from threading  import Thread
+
+from ble_driver import BLEDriver
+
+logger  = logging.getLogger(__name__)
+
+# udev creates the /dev/serial/by-id links once a port is set up, and
+# removes /dev/serial with the last one
+SERIAL_BY_ID_PATHS  = ['/dev/serial/by-id', '/dev/serial', '/dev']
+
+IN_CREATE       = 0x00000100
+IN_DELETE       = 0x00000200
+IN_DELETE_SELF  = 0x00000400
+IN_MOVED_FROM   = 0x00000040
+IN_MOVED_TO     = 0x00000080
+IN_NONBLOCK     = 0x00000800
+IN_CLOEXEC      = 0x00080000
+IN_WATCH_MASK   = IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVED_FROM | IN_MOVED_TO
+
+
+class Inotify(object):
+    """inotify watch on the first existing directory of paths, Linux only."""
+    def __init__(self, paths):
+        self.paths  = paths
+        self.libc   = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+        self.fd     = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.wd     = None
+        self.path   = None
+        self.watch()
+
+
+    def watch(self):
+        """Move the watch to the deepest directory that exists now."""
+        for path in self.paths:
+            if os.path.isdir(path):
+                break
+        if path == self.path:
+            return
+        if self.wd is not None:
+            self.libc.inotify_rm_watch(self.fd, self.wd)
+        self.wd     = self.libc.inotify_add_watch(self.fd, path, IN_WATCH_MASK)
+        self.path   = path
+        if self.wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch {} failed'.format(path))
+
+
+    def wait(self, timeout):
+        """Return True if the watched directory changed within timeout."""
+        (readable, _, _) = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+        self.watch()
+        return True
+
+
+    def close(self):
+        os.close(self.fd)
+
+
+
+class SerialPortMonitor(Thread):
+    """Reports serial ports as they are plugged in and removed.
+
+    On Linux the monitor sleeps on an inotify watch of /dev/serial/by-id
+    and scans only when it changes, elsewhere it scans every
+    poll_interval_s. Each change invalidates the BLEDriver.enum_serial_ports
+    cache. on_added(desc) and on_removed(desc) are called from the monitor
+    thread with the SerialPortDescriptor of the port.
+    """
+    def __init__(self, on_added = None, on_removed = None, conn_ic_id = None,
+                 poll_interval_s = 1.0, settle_s = 0.2):
+        super(SerialPortMonitor, self).__init__(name = 'SerialPortMonitor')
+        self.daemon             = True
+        self.on_added           = on_added
+        self.on_removed         = on_removed
+        self.conn_ic_id         = conn_ic_id
+        self.poll_interval_s    = poll_interval_s
+        self.settle_s           = settle_s
+        self.stopped            = False
+        self.ports              = dict()
+        self.inotify            = None
+        if platform.system() == 'Linux':
+            try:
+                self.inotify = Inotify(SERIAL_BY_ID_PATHS)
+            except (OSError, AttributeError) as e:
+                logger.warning('inotify unavailable, polling serial ports: {}'.format(e))
+
+
+    def stop(self):
+        self.stopped = True
+        self.join()
+
+
+    def scan(self):
+        BLEDriver.enum_cache_invalidate()
+        descs   = BLEDriver.enum_serial_ports(self.conn_ic_id, max_age_s = 0)
+        ports   = dict(((d.port, d.serial_number), d) for d in descs)
+        added   = sorted([d for key, d in ports.items() if key not in self.ports], key = lambda d: d.port)
+        removed = sorted([d for key, d in self.ports.items() if key not in ports], key = lambda d: d.port)
+        self.ports = ports
+        for (callback, descs) in [(self.on_removed, removed), (self.on_added, added)]:
+            for desc in descs:
+                if callback is None:
+                    continue
+                try:
+                    callback(desc)
+                except Exception as e:
+                    logger.error('Serial port callback failed: {}'.format(e))
+
+
+    def run(self):
+        try:
+            self.scan()
+            while not self.stopped:
+                if self.inotify:
+                    if not self.inotify.wait(self.poll_interval_s):
+                        continue
+                    # A port brings several links, scan once they are all there
+                    time.sleep(self.settle_s)
+                    while self.inotify.wait(0):
+                        time.sleep(self.settle_s)
+                else:
+                    time.sleep(self.poll_interval_s)
+                self.scan()
+        except Exception as e:
+            logger.error('Serial port monitor stopped: {}'.format(e))
+        finally:
+            if self.inotify:
+                self.inotify.close()
@@ -0,0 +1,189 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import os
+import sys
+import time
+import inspect
+import logging
+from threading  import Lock, Thread, current_thread
+
+logger  = logging.getLogger(__name__)
+
+
+PROFILE_API         = 'api'         # BLEDriver/BLEAdapter call wrapped by NordicSemiErrorCheck
+PROFILE_CALLBACK    = 'callback'    # Observer callback invoked from the event handler
+
+# Registered hooks. Replaced, never modified, so callers can iterate without locking.
+hooks       = tuple()
+_hooks_lock = Lock()
+
+
+class ProfileHook(object):
+    def __init__(self):
+        super(ProfileHook, self).__init__()
+
+
+    def before(self, kind, name, conn_handle):
+        pass
+
+
+    def after(self, kind, name, conn_handle, elapsed):
+        pass
+
+
+
+def hook_register(hook):
+    global hooks
+    assert isinstance(hook, ProfileHook), 'Invalid argument type'
+    with _hooks_lock:
+        hooks = hooks + (hook,)
+
+
+def hook_unregister(hook):
+    global hooks
+    with _hooks_lock:
+        hooks = tuple(h for h in hooks if h is not hook)
+
+
+def arg_index(func, name):
+    """Return the position of argument name in func, not counting self, or None."""
+    try:
+        args = inspect.getargspec(func).args
+    except TypeError:
+        return None
+    if name not in args:
+        return None
+    return args.index(name) - 1
+
+
+def call_profiled(hooks, kind, name, conn_handle, func, args, kwargs):
+    for hook in hooks:
+        hook.before(kind, name, conn_handle)
+    t_start = time.time()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        elapsed = time.time() - t_start
+        for hook in hooks:
+            hook.after(kind, name, conn_handle, elapsed)
+
+
+
+class SamplingProfiler(ProfileHook):
+    """Samples the Python stacks of threads inside profiled calls.
+
+    Stacks are written in the folded format read by flamegraph.pl, one
+    'outer;...;inner count' line per distinct stack, with the profiled call
+    as the root frame.
+    """
+    def __init__(self, path, interval_s = 0.001):
+        super(SamplingProfiler, self).__init__()
+        self.path       = path
+        self.interval_s = interval_s
+        self.active     = dict()    # thread ident -> stack of profiled call names
+        self.stacks     = dict()    # folded stack -> sample count
+        self.stopped    = True
+        self.thread     = None
+
+
+    def before(self, kind, name, conn_handle):
+        self.active.setdefault(current_thread().ident, list()).append('{}:{}'.format(kind, name))
+
+
+    def after(self, kind, name, conn_handle, elapsed):
+        calls = self.active.get(current_thread().ident)
+        if calls:
+            calls.pop()
+
+
+    def start(self):
+        self.stopped        = False
+        self.thread         = Thread(target = self.run, name = 'SamplingProfiler')
+        self.thread.daemon  = True
+        self.thread.start()
+        hook_register(self)
+
+
+    def stop(self):
+        hook_unregister(self)
+        self.stopped = True
+        self.thread.join()
+        self.write()
+
+
+    def run(self):
+        while not self.stopped:
+            time.sleep(self.interval_s)
+            frames = sys._current_frames()
+            for (ident, calls) in list(self.active.items()):
+                # The thread pops calls in after() while this one samples
+                calls = list(calls)
+                if not calls or ident not in frames:
+                    continue
+                stack   = self.stack_fold(calls[0], frames[ident])
+                if stack is not None:
+                    self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+
+    @staticmethod
+    def stack_fold(root, frame):
+        """Fold the frames inside the outermost profiled call under root.
+
+        Returns None when frame is no longer inside a profiled call, which
+        happens when the call returned after the thread was sampled.
+        """
+        names = list()
+        depth = None
+        while frame is not None:
+            code = frame.f_code
+            if code is call_profiled.__code__:
+                depth = len(names)
+            names.append('{} ({})'.format(code.co_name, os.path.basename(code.co_filename)))
+            frame = frame.f_back
+        if depth is None:
+            return None
+        names = names[:depth]
+        names.append(root)
+        return ';'.join(reversed(names))
+
+
+    def write(self):
+        with open(self.path, 'w') as f:
+            for (stack, count) in sorted(self.stacks.items()):
+                f.write('{} {}\n'.format(stack, count))
+        logger.info('Wrote {} folded stacks to {}'.format(len(self.stacks), self.path))
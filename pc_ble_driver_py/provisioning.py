@@ -0,0 +1,149 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import time
+import Queue
+import logging
+from enum       import Enum
+from threading  import Thread
+
+from ble_driver import BLEDriver, Flasher
+
+logger  = logging.getLogger(__name__)
+
+PROVISION_WORKERS   = 8
+READY_TIMEOUT_S     = 5.0
+
+
+class BoardStatus(Enum):
+    current = 0  # Connectivity firmware was already on the board
+    flashed = 1
+    stale   = 2  # Other firmware on the board, flashing was not requested
+    failed  = 3
+
+
+
+class BoardResult(object):
+    """Outcome of provisioning one board."""
+    def __init__(self, port, serial_number):
+        self.port           = port
+        self.serial_number  = serial_number
+        self.status         = None
+        self.error          = None
+        self.duration_s     = None
+
+
+    def __repr__(self):
+        return '{}(port={!r}, serial_number={!r}, status={}, error={!r})'.format(self.__class__.__name__,
+                                                                                 self.port,
+                                                                                 self.serial_number,
+                                                                                 self.status,
+                                                                                 self.error)
+
+
+
+def provision_board(result, serial_ports, conn_ic_id, flash, ready_timeout_s, fw_cache, recheck):
+    t_start = time.time()
+    try:
+        flasher = Flasher(serial_port   = result.port,
+                          conn_ic_id    = conn_ic_id,
+                          serial_ports  = serial_ports,
+                          fw_cache      = fw_cache)
+        if flasher.fw_check(recheck):
+            result.status = BoardStatus.current
+        elif flash:
+            logger.info('Flashing board {} on {}'.format(result.serial_number, result.port))
+            flasher.fw_flash()
+            result.status = BoardStatus.flashed
+        else:
+            result.status = BoardStatus.stale
+
+        if result.status != BoardStatus.stale:
+            flasher.reset()
+            flasher.wait_ready(ready_timeout_s)
+    except Exception as e:
+        logger.error('Provisioning board {} on {} failed: {}'.format(result.serial_number, result.port, e))
+        result.status   = BoardStatus.failed
+        result.error    = e
+    result.duration_s = time.time() - t_start
+
+
+def provision(ports = None, conn_ic_id = None, flash = True, workers = PROVISION_WORKERS,
+              ready_timeout_s = READY_TIMEOUT_S, fw_cache = None, recheck = False):
+    """Make sure every board runs the connectivity firmware, working on boards in parallel.
+
+    Serial ports are enumerated once, for all boards, or only for the ones
+    in ports if given. Each board is checked, flashed if it runs other
+    firmware and flash is set, reset and polled until its port is ready.
+    Returns a BoardResult per board, in the order the ports were found.
+
+    With a FirmwareCache, boards verified before are not read again unless
+    recheck is set.
+    """
+    serial_ports    = BLEDriver.enum_serial_ports(conn_ic_id)
+    found           = [d for d in serial_ports if d.serial_number]
+    if ports is not None:
+        found       = [d for d in found if d.port in ports]
+
+    results = [BoardResult(d.port, d.serial_number) for d in found]
+    if ports is not None:
+        for port in ports:
+            if port not in [d.port for d in found]:
+                result          = BoardResult(port, None)
+                result.status   = BoardStatus.failed
+                result.error    = 'board not found'
+                results.append(result)
+
+    jobs = Queue.Queue()
+    for result in results:
+        if result.status is None:
+            jobs.put(result)
+
+    def work_loop():
+        while True:
+            try:
+                result = jobs.get_nowait()
+            except Queue.Empty:
+                return
+            provision_board(result, serial_ports, conn_ic_id, flash, ready_timeout_s, fw_cache, recheck)
+
+    threads = [Thread(target = work_loop, name = 'Provision{}'.format(i))
+               for i in range(min(workers, jobs.qsize()))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
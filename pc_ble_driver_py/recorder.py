@@ -0,0 +1,341 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import os
+import sys
+import zlib
+import time
+import struct
+import logging
+from array          import array
+from collections    import deque
+from threading      import Lock, Thread
+
+from observers      import BLEDriverObserver, BLEAdapterObserver
+
+logger  = logging.getLogger(__name__)
+
+
+# A recording starts with FILE_MAGIC followed by chunks. Each chunk is a
+# CHUNK_HEADER (magic, record count, compression, stored size of every
+# column) followed by the columns in COLUMNS order, each compressed on its
+# own. All integers are little endian.
+#
+# Every chunk also gets an INDEX_ENTRY (file offset, record count, first and
+# last timestamp) in <path>.idx, a headerless file of fixed size entries that
+# can be mapped with mmap to seek by time.
+FILE_MAGIC      = b'PCBLENR1'
+CHUNK_MAGIC     = b'CHNK'
+CHUNK_HEADER    = struct.Struct('<4sIB3x6I')
+INDEX_ENTRY     = struct.Struct('<QIdd')
+
+COMPRESSION_NONE    = 0
+COMPRESSION_ZLIB    = 1
+
+PEER_ADDR_NONE      = b'\x00' * 6
+
+# Column name and array typecode, or None for raw bytes
+COLUMNS = [('timestamp',        'd'),
+           ('conn_handle',      'H'),
+           ('peer_addr',        None),  # 6 bytes per record
+           ('attr_handle',      'H'),
+           ('payload_offsets',  'I'),   # record count + 1 offsets into payload
+           ('payload',          None)]
+
+
+class Chunk(object):
+    """Column buffers for a block of notifications."""
+    def __init__(self):
+        self.timestamp          = array('d')
+        self.conn_handle        = array('H')
+        self.peer_addr          = bytearray()
+        self.attr_handle        = array('H')
+        self.payload_offsets    = array('I', [0])
+        self.payload            = bytearray()
+
+
+    def __len__(self):
+        return len(self.timestamp)
+
+
+    def append(self, timestamp, conn_handle, peer_addr, attr_handle, data):
+        self.timestamp.append(timestamp)
+        self.conn_handle.append(conn_handle)
+        self.peer_addr.extend(peer_addr)
+        self.attr_handle.append(attr_handle)
+        self.payload.extend(data)
+        self.payload_offsets.append(len(self.payload))
+
+
+    def columns(self):
+        for (name, typecode) in COLUMNS:
+            column = getattr(self, name)
+            if typecode is None:
+                yield bytes(column)
+            else:
+                if sys.byteorder == 'big':
+                    column = array(typecode, column)
+                    column.byteswap()
+                yield column.tostring()
+
+
+
+class ChunkWriter(Thread):
+    """Appends chunks handed over by NotificationRecorder to the recording and its index."""
+    def __init__(self, path, compression, compression_level, max_pending_chunks):
+        super(ChunkWriter, self).__init__(name = 'ChunkWriter')
+        self.daemon             = True
+        self.path               = path
+        self.compression        = compression
+        self.compression_level  = compression_level
+        self.max_pending_chunks = max_pending_chunks
+        self.chunks             = deque()
+        self.dropped            = 0
+        self.stopped            = False
+        self.f                  = None
+        self.f_index            = None
+
+
+    def put(self, chunk):
+        if len(self.chunks) < self.max_pending_chunks:
+            self.chunks.append(chunk)
+        else:
+            self.dropped += len(chunk)
+
+
+    def stop(self):
+        self.stopped = True
+        self.join()
+
+
+    def open(self):
+        exists          = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        self.f          = open(self.path, 'ab')
+        self.f_index    = open(self.path + '.idx', 'ab')
+        if not exists:
+            self.f.write(FILE_MAGIC)
+
+
+    def write(self, chunk):
+        columns = list(chunk.columns())
+        if self.compression == COMPRESSION_ZLIB:
+            columns = [zlib.compress(c, self.compression_level) for c in columns]
+        offset  = self.f.tell()
+        self.f.write(CHUNK_HEADER.pack(CHUNK_MAGIC, len(chunk), self.compression, *map(len, columns)))
+        for c in columns:
+            self.f.write(c)
+        self.f.flush()
+        self.f_index.write(INDEX_ENTRY.pack(offset, len(chunk), chunk.timestamp[0], chunk.timestamp[-1]))
+        self.f_index.flush()
+
+
+    def flush(self):
+        try:
+            while True:
+                self.write(self.chunks.popleft())
+        except IndexError:
+            pass
+
+
+    def run(self, interval_s = 0.05):
+        self.open()
+        try:
+            while not self.stopped:
+                time.sleep(interval_s)
+                self.flush()
+            self.flush()
+        except Exception as e:
+            logger.error('Chunk writer stopped: {}'.format(e))
+        finally:
+            self.f.close()
+            self.f_index.close()
+
+
+
+class NotificationRecorder(BLEDriverObserver, BLEAdapterObserver):
+    """Records notifications of attached adapters to a chunked columnar file.
+
+    The notification callback only appends to in-memory column buffers. Full
+    chunks, and partial chunks older than flush_interval_s, are handed to a
+    writer thread that does the compression and file I/O. If the writer
+    falls behind by more than max_pending_chunks, records are dropped and
+    counted in dropped.
+    """
+    def __init__(self, path, chunk_records = 65536, compression = None, compression_level = 1,
+                 flush_interval_s = 1.0, max_pending_chunks = 64):
+        super(NotificationRecorder, self).__init__()
+        assert compression in (None, 'zlib'), 'Invalid compression'
+        self.chunk_records      = chunk_records
+        self.flush_interval_s   = flush_interval_s
+        self.lock               = Lock()
+        self.chunk              = Chunk()
+        self.peer_addrs         = dict()
+        self.attr_handles       = dict()
+        self.adapters           = list()
+        self.writer             = ChunkWriter(path,
+                                              COMPRESSION_ZLIB if compression == 'zlib' else COMPRESSION_NONE,
+                                              compression_level,
+                                              max_pending_chunks)
+        self.writer.start()
+        self.flusher            = Thread(target = self.flush_loop, name = 'NotificationRecorder')
+        self.flusher.daemon     = True
+        self.flusher.start()
+
+
+    @property
+    def dropped(self):
+        return self.writer.dropped
+
+
+    def attach(self, adapter):
+        adapter.observer_register(self)
+        adapter.driver.observer_register(self)
+        self.adapters.append(adapter)
+
+
+    def detach(self, adapter):
+        adapter.observer_unregister(self)
+        adapter.driver.observer_unregister(self)
+        self.adapters.remove(adapter)
+
+
+    def close(self):
+        for adapter in list(self.adapters):
+            self.detach(adapter)
+        self.flush()
+        self.flusher = None
+        self.writer.stop()
+        if self.writer.dropped:
+            logger.warning('Notification recorder dropped {} records'.format(self.writer.dropped))
+
+
+    def flush(self):
+        with self.lock:
+            chunk = self.chunk
+            if not len(chunk):
+                return
+            self.chunk = Chunk()
+        self.writer.put(chunk)
+
+
+    def flush_loop(self):
+        while self.flusher:
+            time.sleep(self.flush_interval_s)
+            self.flush()
+
+
+    def on_gap_evt_connected(self, ble_driver, conn_handle, peer_addr, role, conn_params):
+        self.peer_addrs[(ble_driver, conn_handle)] = peer_addr.addr_bytes
+
+
+    def on_gap_evt_disconnected(self, ble_driver, conn_handle, reason):
+        self.peer_addrs.pop((ble_driver, conn_handle), None)
+        for key in [k for k in self.attr_handles if k[0].driver is ble_driver and k[1] == conn_handle]:
+            del self.attr_handles[key]
+
+
+    def on_notification(self, ble_adapter, conn_handle, uuid, data):
+        key         = (ble_adapter, conn_handle, uuid)
+        attr_handle = self.attr_handles.get(key)
+        if attr_handle is None:
+            attr_handle = self.attr_handles[key] = ble_adapter.db_conns[conn_handle].get_char_value_handle(uuid)
+        peer_addr   = self.peer_addrs.get((ble_adapter.driver, conn_handle), PEER_ADDR_NONE)
+
+        with self.lock:
+            chunk = self.chunk
+            chunk.append(time.time(), conn_handle, peer_addr, attr_handle, data)
+            if len(chunk) < self.chunk_records:
+                return
+            self.chunk = Chunk()
+        self.writer.put(chunk)
+
+
+
+def recording_index_read(path):
+    """Return the (file offset, record count, first timestamp, last timestamp) of every chunk of a recording."""
+    with open(path + '.idx', 'rb') as f:
+        data = f.read()
+    return [INDEX_ENTRY.unpack_from(data, i) for i in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size)]
+
+
+def recording_chunk_read(f, offset = None):
+    """Read the chunk at offset, or at the current position, and return a dict of columns.
+
+    Numeric columns are arrays, peer_addr and payload are bytes. The payload of
+    record i is payload[payload_offsets[i]:payload_offsets[i + 1]].
+    """
+    if offset is not None:
+        f.seek(offset)
+    header = f.read(CHUNK_HEADER.size)
+    if len(header) < CHUNK_HEADER.size:
+        return None
+    fields = CHUNK_HEADER.unpack(header)
+    (magic, count, compression), sizes = fields[:3], fields[3:]
+    if magic != CHUNK_MAGIC:
+        raise ValueError('Invalid chunk at offset {}'.format(f.tell() - CHUNK_HEADER.size))
+
+    columns = dict()
+    for ((name, typecode), size) in zip(COLUMNS, sizes):
+        data = f.read(size)
+        if compression == COMPRESSION_ZLIB:
+            data = zlib.decompress(data)
+        if typecode is not None:
+            column = array(typecode)
+            column.fromstring(data)
+            if sys.byteorder == 'big':
+                column.byteswap()
+            data = column
+        columns[name] = data
+    return columns
+
+
+def recording_read(path):
+    """Yield (timestamp, conn_handle, peer_addr, attr_handle, data) tuples from a recording."""
+    with open(path, 'rb') as f:
+        if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError('Not a notification recording: {}'.format(path))
+        while True:
+            columns = recording_chunk_read(f)
+            if columns is None:
+                return
+            offsets = columns['payload_offsets']
+            for i in range(len(columns['timestamp'])):
+                yield (columns['timestamp'][i],
+                       columns['conn_handle'][i],
+                       columns['peer_addr'][6 * i:6 * i + 6],
+                       columns['attr_handle'][i],
+                       list(bytearray(columns['payload'][offsets[i]:offsets[i + 1]])))
@@ -0,0 +1,297 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+import time
+import logging
+from threading  import Lock, Timer
+
+from observers  import BLEDriverObserver
+from ble_driver import BLEGapScanParams, BLEGapTimeoutSrc, BLEGapRoles, NordicSemiException
+import metrics
+
+logger  = logging.getLogger(__name__)
+
+
+class ScanState(object):
+    def __init__(self, ble_driver, scan_params, offset_s):
+        self.driver         = ble_driver
+        self.scan_params    = scan_params
+        self.offset_s       = offset_s
+        self.scanning       = False
+        self.starting       = False
+        self.paused         = False
+        self.scan_started   = None
+        self.scan_count     = 0
+        self.resync_timer   = None
+        self.scan_time_s    = 0.0
+        self.gap_started    = None
+        self.gap_count      = 0
+        self.gap_time_s     = 0.0
+        self.gap_max_s      = 0.0
+
+
+    @property
+    def duty_cycle(self):
+        return float(self.scan_params.window_ms) / self.scan_params.interval_ms
+
+
+    def scan_started_set(self, now):
+        self.scanning       = True
+        self.scan_started   = now
+        self.scan_count    += 1
+        if self.gap_started is not None:
+            gap                 = now - self.gap_started
+            self.gap_count     += 1
+            self.gap_time_s    += gap
+            self.gap_max_s      = max(self.gap_max_s, gap)
+            self.gap_started    = None
+            if metrics.registry.enabled:
+                metrics.scan_gap_seconds.labels(self.driver.serial_port).observe(gap)
+
+
+    def scan_stopped_set(self, now):
+        if self.scanning:
+            self.scan_time_s   += now - self.scan_started
+            if metrics.registry.enabled:
+                metrics.scan_seconds.labels(self.driver.serial_port).inc(now - self.scan_started)
+        self.scanning       = False
+        self.gap_started    = now
+
+
+    def scan_time_get(self, now):
+        if self.scanning:
+            return self.scan_time_s + (now - self.scan_started)
+        return self.scan_time_s
+
+
+
+class ScanScheduler(BLEDriverObserver):
+    """
+    Keeps scanning running on one or more BLEDriver instances.
+
+    Scan windows are staggered across the drivers so that together they cover
+    the whole scan interval. Scanning is restarted when the SoftDevice reports a
+    scan timeout, and paused on a driver while it is connecting. Restarts wait
+    for the driver's offset in the interval, so the windows stay staggered.
+
+    The offsets are kept by the host, while each SoftDevice times its windows
+    from its own clock. Without a scan timeout the scans would never restart
+    and the windows would drift apart, so every resync_s seconds each scan is
+    stopped and started again at its offset.
+    """
+    def __init__(self, drivers, interval_ms=200, window_ms=None, timeout_s=0, active=True, use_whitelist=False,
+                 resync_s=10):
+        super(ScanScheduler, self).__init__()
+        if len(drivers) == 0:
+            raise NordicSemiException('No drivers to schedule')
+        if window_ms is None:
+            window_ms = float(interval_ms) / len(drivers)
+        if window_ms > interval_ms:
+            raise NordicSemiException('Scan window larger than scan interval')
+
+        self.lock           = Lock()
+        self.resync_s       = resync_s
+        self.running        = False
+        self.started        = None
+        self.coverage_gaps  = 0
+        self.gap_started    = None
+        self.states         = dict()
+        for i, ble_driver in enumerate(drivers):
+            scan_params = BLEGapScanParams(interval_ms      = interval_ms,
+                                           window_ms        = window_ms,
+                                           timeout_s        = timeout_s,
+                                           use_whitelist    = use_whitelist,
+                                           active           = active)
+            offset_s    = (float(interval_ms) / len(drivers)) * i / 1000.0
+            self.states[ble_driver] = ScanState(ble_driver, scan_params, offset_s)
+            ble_driver.observer_register(self)
+
+
+    def start(self):
+        with self.lock:
+            self.running    = True
+            self.started    = time.time()
+        for state in self.states.values():
+            self.scan_schedule(state)
+
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+        for state in self.states.values():
+            if state.scanning:
+                state.driver.ble_gap_scan_stop()
+            self.scan_stopped(state)
+
+
+    def close(self):
+        self.stop()
+        for ble_driver in self.states:
+            ble_driver.observer_unregister(self)
+
+
+    def pause(self, ble_driver):
+        state = self.states[ble_driver]
+        with self.lock:
+            state.paused = True
+        if state.scanning:
+            ble_driver.ble_gap_scan_stop()
+        self.scan_stopped(state)
+
+
+    def resume(self, ble_driver):
+        state = self.states[ble_driver]
+        with self.lock:
+            state.paused = False
+        self.scan_schedule(state)
+
+
+    def connect(self, ble_driver, address, conn_params=None):
+        # The SoftDevice does not allow scanning while a connection is being established
+        self.pause(ble_driver)
+        try:
+            ble_driver.ble_gap_connect(address, conn_params=conn_params)
+        except Exception:
+            self.resume(ble_driver)
+            raise
+
+
+    def scan_schedule(self, state):
+        # Start at the driver's offset in the scan interval, counted from start()
+        interval_s  = state.scan_params.interval_ms / 1000.0
+        delay_s     = (state.offset_s - (time.time() - self.started)) % interval_s
+        if delay_s < 0.001 or (interval_s - delay_s) < 0.001:
+            self.scan_start(state)
+        else:
+            Timer(delay_s, self.scan_start, [state]).start()
+
+
+    def scan_start(self, state):
+        with self.lock:
+            if (not self.running) or state.paused or state.scanning or state.starting:
+                return
+            state.starting = True
+        try:
+            state.driver.ble_gap_scan_start(state.scan_params)
+        except NordicSemiException as e:
+            with self.lock:
+                state.starting = False
+            logger.error('Failed to restart scanning: {}'.format(e))
+            return
+        if not self.scan_started(state):
+            # Stopped or paused while the scan was starting
+            state.driver.ble_gap_scan_stop()
+            self.scan_stopped(state)
+
+
+    def scan_started(self, state):
+        with self.lock:
+            state.starting = False
+            if (not self.running) or state.paused:
+                return False
+            state.scan_started_set(time.time())
+            if self.gap_started is not None:
+                self.coverage_gaps += 1
+                self.gap_started    = None
+                if metrics.registry.enabled:
+                    metrics.scan_coverage_gaps.labels().inc()
+            if self.resync_s and not state.scan_params.timeout_s:
+                state.resync_timer = Timer(self.resync_s, self.scan_resync, [state, state.scan_count])
+                state.resync_timer.start()
+            return True
+
+
+    def scan_resync(self, state, scan_count):
+        # Restart a scan without timeout at its offset, before the SoftDevice clocks drift apart
+        with self.lock:
+            if (not self.running) or state.paused or (state.scan_count != scan_count) or not state.scanning:
+                return
+        try:
+            state.driver.ble_gap_scan_stop()
+        except NordicSemiException as e:
+            logger.error('Failed to stop scanning: {}'.format(e))
+            return
+        self.scan_stopped(state)
+        self.scan_schedule(state)
+
+
+    def scan_stopped(self, state):
+        with self.lock:
+            now = time.time()
+            state.scan_stopped_set(now)
+            if state.resync_timer is not None:
+                state.resync_timer.cancel()
+                state.resync_timer = None
+            if self.running and not any(s.scanning for s in self.states.values()):
+                self.gap_started = now
+
+
+    def metrics(self):
+        now         = time.time()
+        elapsed     = (now - self.started) if self.started else 0.0
+        drivers     = list()
+        coverage    = 0.0
+        for state in self.states.values():
+            scan_time   = state.scan_time_get(now)
+            effective   = (scan_time * state.duty_cycle / elapsed) if elapsed else 0.0
+            coverage   += effective
+            drivers.append({'scanning'              : state.scanning,
+                            'paused'                : state.paused,
+                            'effective_duty_cycle'  : effective,
+                            'scan_gaps'             : state.gap_count,
+                            'scan_gap_time_s'       : state.gap_time_s,
+                            'scan_gap_max_s'        : state.gap_max_s})
+        return {'elapsed_s'             : elapsed,
+                'effective_duty_cycle'  : min(coverage, 1.0),
+                'coverage_gaps'         : self.coverage_gaps,
+                'drivers'               : drivers}
+
+
+    def on_gap_evt_timeout(self, ble_driver, conn_handle, src):
+        state = self.states.get(ble_driver)
+        if state is None:
+            return
+        if src == BLEGapTimeoutSrc.scan:
+            self.scan_stopped(state)
+            self.scan_schedule(state)
+        elif (src == BLEGapTimeoutSrc.conn) and state.paused:
+            self.resume(ble_driver)
+
+
+    def on_gap_evt_connected(self, ble_driver, conn_handle, peer_addr, role, conn_params):
+        state = self.states.get(ble_driver)
+        if (state is not None) and state.paused and (role == BLEGapRoles.central):
+            self.resume(ble_driver)
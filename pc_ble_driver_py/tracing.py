@@ -0,0 +1,199 @@
+#
+# Copyright (c) 2016 Nordic Semiconductor ASA
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice, this
+#   list of conditions and the following disclaimer in the documentation and/or
+#   other materials provided with the distribution.
+#
+#   3. Neither the name of Nordic Semiconductor ASA nor the names of other
+#   contributors to this software may be used to endorse or promote products
+#   derived from this software without specific prior written permission.
+#
+#   4. This software must only be used in or with a processor manufactured by Nordic
+#   Semiconductor ASA, or in or with a processor manufactured by a third party that
+#   is used in combination with a processor manufactured by Nordic Semiconductor.
+#
+#   5. Any software provided in binary or object form under this license must not be
+#   reverse engineered, decompiled, modified and/or disassembled.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import os
+import time
+import struct
+import logging
+from collections    import deque
+from threading      import Lock, Thread
+
+logger  = logging.getLogger(__name__)
+
+
+# Every trace file starts with FILE_MAGIC followed by records of
+# RECORD_HEADER (timestamp, record type, conn handle, record id, data length)
+# and the record data.
+FILE_MAGIC      = b'PCBLETR1'
+RECORD_HEADER   = struct.Struct('<dBHHH')
+
+TRACE_EVT       = 0x01  # BLE event received, id is the event id
+TRACE_HVX       = 0x02  # Notification or indication, id is the attribute handle, data is the value
+TRACE_API       = 0x03  # SoftDevice API call, id is the error code, or 0xFFFF if there was none
+
+CONN_HANDLE_INVALID = 0xFFFF
+
+
+class TraceWriter(Thread):
+    """Writes queued trace records to a file set rotated on size.
+
+    Records are appended to a deque, which needs no lock on the producer
+    side, and written out every flush_interval_s.
+    """
+    def __init__(self, path, max_bytes, backup_count, queue_size, flush_interval_s = 0.1):
+        super(TraceWriter, self).__init__(name = 'TraceWriter')
+        self.daemon             = True
+        self.path               = path
+        self.max_bytes          = max_bytes
+        self.backup_count       = backup_count
+        self.queue_size         = queue_size
+        self.flush_interval_s   = flush_interval_s
+        self.records            = deque()
+        self.dropped            = 0
+        self.stopped            = False
+        self.f                  = None
+        self.size               = 0
+
+
+    def put(self, record):
+        if len(self.records) < self.queue_size:
+            self.records.append(record)
+        else:
+            self.dropped += 1
+
+
+    def stop(self):
+        self.stopped = True
+        self.join()
+
+
+    def open(self):
+        self.f      = open(self.path, 'wb')
+        self.f.write(FILE_MAGIC)
+        self.size   = len(FILE_MAGIC)
+
+
+    def rotate(self):
+        self.f.close()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                src = '{}.{}'.format(self.path, i)
+                if os.path.exists(src):
+                    os.rename(src, '{}.{}'.format(self.path, i + 1))
+            os.rename(self.path, '{}.1'.format(self.path))
+        self.open()
+
+
+    def flush(self):
+        records = list()
+        try:
+            while True:
+                records.append(self.records.popleft())
+        except IndexError:
+            pass
+        if not records:
+            return
+
+        data = b''.join(records)
+        if self.max_bytes and self.size + len(data) > self.max_bytes and self.size > len(FILE_MAGIC):
+            self.rotate()
+        self.f.write(data)
+        self.f.flush()
+        self.size += len(data)
+
+
+    def run(self):
+        self.open()
+        try:
+            while not self.stopped:
+                time.sleep(self.flush_interval_s)
+                self.flush()
+            self.flush()
+        except Exception as e:
+            logger.error('Trace writer stopped: {}'.format(e))
+        finally:
+            self.f.close()
+
+
+
+class Tracer(object):
+    """Binary event trace, off by default.
+
+    Call sites check the enabled attribute before building a record, so a
+    disabled tracer costs one attribute lookup.
+    """
+    def __init__(self):
+        self.enabled    = False
+        self.writer     = None
+        self.lock       = Lock()
+
+
+    def enable(self, path, max_bytes = 16 * 1024 * 1024, backup_count = 4, queue_size = 65536):
+        """Start writing records to path, rotating to path.1 .. path.<backup_count> past max_bytes."""
+        with self.lock:
+            if self.writer:
+                self._disable()
+            self.writer     = TraceWriter(path, max_bytes, backup_count, queue_size)
+            self.writer.start()
+            self.enabled    = True
+
+
+    def disable(self):
+        with self.lock:
+            self._disable()
+
+
+    def _disable(self):
+        self.enabled = False
+        if self.writer:
+            self.writer.stop()
+            if self.writer.dropped:
+                logger.warning('Trace writer dropped {} records'.format(self.writer.dropped))
+            self.writer = None
+
+
+    def record(self, record_type, conn_handle, record_id, data = b''):
+        writer = self.writer
+        if writer:
+            writer.put(RECORD_HEADER.pack(time.time(), record_type, conn_handle, record_id, len(data)) + data)
+
+
+
+def trace_read(path):
+    """Yield (timestamp, record_type, conn_handle, record_id, data) tuples from a trace file."""
+    with open(path, 'rb') as f:
+        if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError('Not a trace file: {}'.format(path))
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            (timestamp, record_type, conn_handle, record_id, length) = RECORD_HEADER.unpack(header)
+            yield (timestamp, record_type, conn_handle, record_id, f.read(length))
+
+
+tracer = Tracer()